@@ -250,7 +250,7 @@ class Account(Document):
 			frappe.db.set_value("Account", new, "account_name",
 				" - ".join(new.split(" - ")[:-1]))
 		else:
-			from frappe.utils.nestedset import rebuild_tree
+			from erpnext.utilities.tree import rebuild_tree
 			rebuild_tree("Account", "parent_account")
 
 def get_parent_account(doctype, txt, searchfield, start, page_len, filters):
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+import hashlib
+from frappe.utils import flt, cstr, getdate, get_first_day, get_last_day, add_days, add_months, now
+from frappe.model.document import Document
+
+class AccountBalance(Document):
+	pass
+
+balance_fields = ("debit", "credit", "debit_in_account_currency", "credit_in_account_currency")
+key_fields = ("company", "account", "party_type", "party", "cost_center", "project",
+	"fiscal_year", "is_opening", "period_end", "is_period_closing")
+
+# key columns of GL Entry, empty values are stored as '' so that they are part of the unique key
+gl_key_columns = ("company", "account", "ifnull(party_type, '')", "ifnull(party, '')",
+	"ifnull(cost_center, '')", "ifnull(project, '')", "ifnull(fiscal_year, '')", "ifnull(is_opening, 'No')",
+	"last_day(posting_date)", "if(voucher_type='Period Closing Voucher', 1, 0)")
+
+def update_account_balances(gl_entries, cancel=False):
+	'''Add debit and credit of the GL Entries to the monthly balances of their
+	account, party, cost center and project, or subtract them if `cancel` is set'''
+	balances = {}
+	for gle in gl_entries:
+		key = (gle.get("company"), gle.get("account"), gle.get("party_type") or "",
+			gle.get("party") or "", gle.get("cost_center") or "", gle.get("project") or "",
+			gle.get("fiscal_year") or "", gle.get("is_opening") or "No",
+			get_last_day(gle.get("posting_date")),
+			1 if gle.get("voucher_type") == "Period Closing Voucher" else 0)
+
+		amounts = balances.setdefault(key, [0.0] * len(balance_fields))
+		for i, fieldname in enumerate(balance_fields):
+			amounts[i] += -flt(gle.get(fieldname)) if cancel else flt(gle.get(fieldname))
+
+	add_to_balances(balances)
+
+def update_account_balances_for_voucher(voucher_type, voucher_no, cancel=False):
+	'''Update balances from the GL Entries of a voucher, called before the entries are deleted'''
+	update_account_balances(frappe.db.sql("""select company, account, party_type, party,
+			cost_center, project, fiscal_year, is_opening, posting_date, voucher_type, {0}
+		from `tabGL Entry` where voucher_type=%s and voucher_no=%s""".format(", ".join(balance_fields)),
+		(voucher_type, voucher_no), as_dict=1), cancel=cancel)
+
+def add_to_balances(balances):
+	if not balances:
+		return
+
+	timestamp, values = now(), []
+	for key, amounts in balances.items():
+		values.extend([frappe.generate_hash(length=10), timestamp, timestamp,
+			frappe.session.user, frappe.session.user, get_balance_key(key)] + list(key) + list(amounts))
+
+	frappe.db.sql("""insert into `tabAccount Balance`
+		(name, creation, modified, owner, modified_by, balance_key, {0}, {1})
+		values {2}
+		on duplicate key update {3}, modified=values(modified)""".format(
+			", ".join(key_fields), ", ".join(balance_fields),
+			", ".join(["({0})".format(", ".join(["%s"] * (6 + len(key_fields) + len(balance_fields))))] * len(balances)),
+			", ".join("{0}={0}+values({0})".format(f) for f in balance_fields)),
+		tuple(values))
+
+def get_balance_key(key):
+	'''Returns hash of the key fields, the unique key of Account Balance'''
+	return hashlib.md5("\n".join(cstr(value) for value in key).encode("utf-8")).hexdigest()
+
+def split_date_range(from_date=None, to_date=None):
+	'''Returns `(period_from, period_to)`, the whole months between the dates that
+	can be read from Account Balance, and the list of date ranges at either end
+	that must be read from GL Entry. Whole months are None if the range is within
+	a month, an empty date is an open end.'''
+	period_from = period_to = None
+	if from_date:
+		from_date = getdate(from_date)
+		period_from = from_date if from_date.day == 1 else get_first_day(add_months(from_date, 1))
+	if to_date:
+		to_date = getdate(to_date)
+		period_to = get_last_day(to_date)
+		if period_to != to_date:
+			period_to = get_last_day(add_months(to_date, -1))
+
+	if period_from and period_to and period_from > period_to:
+		# range is within a month
+		return None, [(from_date, to_date)]
+
+	gl_date_ranges = []
+	if period_from and from_date < period_from:
+		gl_date_ranges.append((from_date, add_days(period_from, -1)))
+	if period_to and to_date > period_to:
+		gl_date_ranges.append((add_days(period_to, 1), to_date))
+
+	return (period_from, period_to), gl_date_ranges
+
+def get_period_end_conditions(period_from, period_to):
+	conditions = []
+	if period_from:
+		conditions.append("gle.period_end >= '%s'" % get_last_day(period_from))
+	if period_to:
+		conditions.append("gle.period_end <= '%s'" % period_to)
+
+	return conditions
+
+def get_balance(select_field, conditions, from_date=None, to_date=None, exclude_period_closing=False):
+	'''Returns `select_field` (sum of debit and credit columns) of GL Entries matching
+	`conditions` posted between the dates.
+
+	Whole months in the range are read from Account Balance and the remaining
+	days at either end from GL Entry. `conditions` may only use the key fields
+	of Account Balance other than the period, with `gle` as the table alias.'''
+	months, gl_date_ranges = split_date_range(from_date, to_date)
+
+	balance = 0.0
+	if months:
+		balance_conditions = list(conditions) + get_period_end_conditions(*months)
+		if exclude_period_closing:
+			balance_conditions.append("gle.is_period_closing = 0")
+
+		balance = flt(frappe.db.sql("""select {0} from `tabAccount Balance` gle
+			where {1}""".format(select_field, " and ".join(balance_conditions)))[0][0])
+
+	for gl_from_date, gl_to_date in gl_date_ranges:
+		balance += get_gl_balance(select_field, conditions, gl_from_date, gl_to_date, exclude_period_closing)
+
+	return balance
+
+def get_balances_by_account(conditions, from_date=None, to_date=None, exclude_period_closing=False):
+	'''Returns dict of account: [debit, credit] of GL Entries matching `conditions`
+	posted between the dates, read from Account Balance and GL Entry like `get_balance`'''
+	balances = {}
+	def add_balances(rows):
+		for account, debit, credit in rows:
+			balance = balances.setdefault(account, [0.0, 0.0])
+			balance[0] += flt(debit)
+			balance[1] += flt(credit)
+
+	months, gl_date_ranges = split_date_range(from_date, to_date)
+	if months:
+		balance_conditions = list(conditions) + get_period_end_conditions(*months)
+		if exclude_period_closing:
+			balance_conditions.append("gle.is_period_closing = 0")
+
+		add_balances(frappe.db.sql("""select gle.account, sum(gle.debit), sum(gle.credit)
+			from `tabAccount Balance` gle where {0}
+			group by gle.account""".format(" and ".join(balance_conditions))))
+
+	for gl_from_date, gl_to_date in gl_date_ranges:
+		add_balances(frappe.db.sql("""select gle.account, sum(gle.debit), sum(gle.credit)
+			from `tabGL Entry` gle where {0}
+			group by gle.account""".format(" and ".join(get_gl_conditions(conditions,
+				gl_from_date, gl_to_date, exclude_period_closing)))))
+
+	return balances
+
+def get_gl_balance(select_field, conditions, from_date=None, to_date=None, exclude_period_closing=False):
+	return flt(frappe.db.sql("""select {0} from `tabGL Entry` gle
+		where {1}""".format(select_field, " and ".join(get_gl_conditions(conditions,
+			from_date, to_date, exclude_period_closing))))[0][0])
+
+def get_gl_conditions(conditions, from_date=None, to_date=None, exclude_period_closing=False):
+	conditions = list(conditions)
+	if from_date:
+		conditions.append("posting_date >= '%s'" % from_date)
+	if to_date:
+		conditions.append("posting_date <= '%s'" % to_date)
+	if exclude_period_closing:
+		conditions.append("voucher_type != 'Period Closing Voucher'")
+
+	return conditions
+
+def get_balances_from_gl(company=None):
+	condition = "where company=%(company)s" if company else ""
+	return frappe.db.sql("""select {0}, {1}
+		from `tabGL Entry` {2}
+		group by {3}""".format(
+			", ".join("{0} as {1}".format(column, f) for column, f in zip(gl_key_columns, key_fields)),
+			", ".join("sum({0}) as {0}".format(f) for f in balance_fields), condition,
+			", ".join(gl_key_columns)),
+		{"company": company}, as_dict=1)
+
+def rebuild_account_balances(company=None):
+	'''Rebuild all account balances from GL Entry'''
+	frappe.db.sql("""delete from `tabAccount Balance` {0}""".format(
+		"where company=%(company)s" if company else ""), {"company": company})
+
+	gl_balances = get_balances_from_gl(company)
+	for i in xrange(0, len(gl_balances), 500):
+		add_to_balances(dict((tuple(d[f] for f in key_fields), [d[f] for f in balance_fields])
+			for d in gl_balances[i:i + 500]))
+
+def check_account_balances(company=None, rebuild=True):
+	'''Compare account balances with GL Entry and rebuild them if they differ.
+	Returns the mismatched balances. Called daily by the scheduler.'''
+	def get_key(d):
+		return tuple(getdate(d[f]) if f == "period_end" else d[f] for f in key_fields)
+
+	gl_balances = dict((get_key(d), d) for d in get_balances_from_gl(company))
+	balances = dict((get_key(d), d) for d in frappe.db.sql("""select {0}, {1}
+		from `tabAccount Balance` {2}""".format(", ".join(key_fields), ", ".join(balance_fields),
+			"where company=%(company)s" if company else ""), {"company": company}, as_dict=1))
+
+	mismatched = []
+	for key in set(gl_balances.keys() + balances.keys()):
+		gl_balance, balance = gl_balances.get(key, {}), balances.get(key, {})
+		if any(flt(flt(gl_balance.get(f)) - flt(balance.get(f)), 6) for f in balance_fields):
+			mismatched.append(frappe._dict(zip(key_fields, key)))
+
+	if mismatched and rebuild:
+		for company in set(d.company for d in mismatched):
+			rebuild_account_balances(company)
+
+	return mismatched
+
+def on_doctype_update():
+	if not frappe.db.sql("""show index from `tabAccount Balance`
+		where Key_name="balance_key" """):
+		frappe.db.commit()
+		frappe.db.sql("""alter table `tabAccount Balance` add unique index balance_key(balance_key)""")
+		frappe.db.sql("""alter table `tabAccount Balance`
+			add index account_period_end(account, period_end)""")
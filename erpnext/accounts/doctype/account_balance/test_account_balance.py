@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import flt, getdate, nowdate, add_days, add_months, get_first_day
+from erpnext.accounts.utils import get_balance_on
+from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
+from erpnext.accounts.doctype.account_balance.account_balance import (check_account_balances,
+	split_date_range, get_balances_by_account)
+from erpnext.accounts.report.financial_statements import set_gl_entries_by_account
+
+class TestAccountBalance(unittest.TestCase):
+	def test_balance_on(self):
+		account = "_Test Bank - _TC"
+		posting_date = add_days(get_first_day(add_months(nowdate(), -1)), 10)
+
+		jv = make_journal_entry(account, "_Test Cash - _TC", 100, posting_date=posting_date, submit=True)
+
+		for date in (add_days(posting_date, -1), posting_date, nowdate()):
+			self.assertEqual(get_balance_on(account, date), get_gl_balance(account, date))
+
+		jv.cancel()
+		self.assertEqual(get_balance_on(account, nowdate()), get_gl_balance(account, nowdate()))
+		self.assertEqual(check_account_balances("_Test Company", rebuild=False), [])
+
+	def test_split_date_range(self):
+		self.assertEqual(split_date_range("2017-01-15", "2017-02-10"),
+			(None, [(getdate("2017-01-15"), getdate("2017-02-10"))]))
+		self.assertEqual(split_date_range("2017-01-01", "2017-03-31"),
+			((getdate("2017-01-01"), getdate("2017-03-31")), []))
+		self.assertEqual(split_date_range("2017-01-15", "2017-03-10"),
+			((getdate("2017-02-01"), getdate("2017-02-28")),
+				[(getdate("2017-01-15"), getdate("2017-01-31")), (getdate("2017-03-01"), getdate("2017-03-10"))]))
+
+	def test_financial_statement_entries(self):
+		account = "_Test Bank - _TC"
+		from_date = get_first_day(add_months(nowdate(), -2))
+		make_journal_entry(account, "_Test Cash - _TC", 100, posting_date=add_days(from_date, 40), submit=True)
+
+		lft, rgt = frappe.db.get_value("Account", account, ["lft", "rgt"])
+		period_list = [frappe._dict(from_date=getdate(from_date), to_date=getdate(add_days(from_date, 40)),
+			year_start_date=getdate(from_date))]
+
+		gl_entries_by_account = {}
+		set_gl_entries_by_account("_Test Company", from_date, nowdate(), lft, rgt, None,
+			gl_entries_by_account, period_list=period_list)
+
+		entries = gl_entries_by_account.get(account, [])
+		self.assertEqual(flt(sum(flt(d.debit) - flt(d.credit) for d in entries), 2),
+			flt(get_gl_balance(account, nowdate()) - get_gl_balance(account, add_days(from_date, -1)), 2))
+
+	def test_balances_by_account(self):
+		account = "_Test Bank - _TC"
+		posting_date = add_days(get_first_day(add_months(nowdate(), -1)), 10)
+		make_journal_entry(account, "_Test Cash - _TC", 100, posting_date=posting_date, submit=True)
+
+		balances = get_balances_by_account(["gle.company='_Test Company'"], to_date=nowdate())
+		debit, credit = balances.get(account)
+		self.assertEqual(flt(debit - credit, 2), flt(get_gl_balance(account, nowdate()), 2))
+
+def get_gl_balance(account, date):
+	return flt(frappe.db.sql("""select sum(debit_in_account_currency) - sum(credit_in_account_currency)
+		from `tabGL Entry` where account=%s and posting_date <= %s""", (account, date))[0][0])
@@ -8,6 +8,7 @@ from frappe import _
 from frappe.utils import flt, getdate, add_months, get_last_day, fmt_money
 from frappe.model.naming import make_autoname
 from frappe.model.document import Document
+from erpnext.utilities.tree import get_descendants, is_descendant
 
 class BudgetError(frappe.ValidationError): pass
 class DuplicateBudgetError(frappe.ValidationError): pass
@@ -62,44 +63,73 @@ class Budget(Document):
 			self.cost_center = None
 
 def validate_expense_against_budget(args):
-	args = frappe._dict(args)
-	if not args.cost_center and not args.project:
+	validate_gl_map_against_budget([args])
+
+def validate_gl_map_against_budget(gl_map):
+	'''Check expense GL Entries of a voucher against budgets of their cost center and project.
+
+	Budgets for all accounts of the voucher are loaded in one query, and actual expense
+	of a budget and account is read once, as monthly totals from Account Balance.'''
+	entries, checked = [], set()
+	for args in gl_map:
+		args = frappe._dict(args)
+		key = (args.account, args.cost_center, args.project)
+		if (args.cost_center or args.project) and key not in checked:
+			checked.add(key)
+			entries.append(args)
+
+	if not entries:
 		return
-	for budget_against in ['project', 'cost_center']:
-		if args.get(budget_against) \
-				and frappe.db.get_value("Account", {"name": args.account, "root_type": "Expense"}):
 
-			if args.project and budget_against == 'project':
-				condition = "and b.project='%s'" % frappe.db.escape(args.project)
+	expense_accounts = frappe.db.sql_list("""select name from `tabAccount`
+		where root_type='Expense' and name in ({0})""".format(", ".join(["%s"] * len(entries))),
+		tuple(d.account for d in entries))
+
+	entries = [d for d in entries if d.account in expense_accounts]
+	if not entries:
+		return
+
+	budget_records = get_budget_records(list(set(d.fiscal_year for d in entries)), expense_accounts)
+	if not budget_records:
+		return
+
+	expense_cache = {}
+	for args in entries:
+		for budget_against in ['project', 'cost_center']:
+			if not args.get(budget_against):
+				continue
+
+			if budget_against == 'project':
+				records = [b for b in budget_records if b.project == args.project]
 				args.budget_against_field = "Project"
-			
-			elif args.cost_center and budget_against == 'cost_center':
-				cc_lft, cc_rgt = frappe.db.get_value("Cost Center", args.cost_center, ["lft", "rgt"])
-				condition = """and exists(select name from `tabCost Center` 
-					where lft<=%s and rgt>=%s and name=b.cost_center)""" % (cc_lft, cc_rgt)
+
+			else:
+				records = [b for b in budget_records if b.cost_center
+					and is_descendant("Cost Center", args.cost_center, b.cost_center)]
 				args.budget_against_field = "Cost Center"
 
+			records = [b for b in records if b.account == args.account and b.fiscal_year == args.fiscal_year]
+
 			args.budget_against = args.get(budget_against)
 
-			budget_records = frappe.db.sql("""
-				select
-					b.{budget_against_field}, ba.budget_amount, b.monthly_distribution,
-					b.action_if_annual_budget_exceeded, 
-					b.action_if_accumulated_monthly_budget_exceeded
-				from 
-					`tabBudget` b, `tabBudget Account` ba
-				where
-					b.name=ba.parent and b.fiscal_year=%s 
-					and ba.account=%s and b.docstatus=1
-					{condition}
-			""".format(condition=condition, 
-				budget_against_field=frappe.scrub(args.get("budget_against_field"))),
-				(args.fiscal_year, args.account), as_dict=True)
-				
-			if budget_records:
-				validate_budget_records(args, budget_records)
-
-def validate_budget_records(args, budget_records):
+			if records:
+				validate_budget_records(args, records, expense_cache)
+
+def get_budget_records(fiscal_years, accounts):
+	return frappe.db.sql("""
+		select
+			b.cost_center, b.project, b.fiscal_year, ba.account, ba.budget_amount, b.monthly_distribution,
+			b.action_if_annual_budget_exceeded,
+			b.action_if_accumulated_monthly_budget_exceeded
+		from
+			`tabBudget` b, `tabBudget Account` ba
+		where
+			b.name=ba.parent and b.fiscal_year in ({0})
+			and ba.account in ({1}) and b.docstatus=1
+	""".format(", ".join(["%s"] * len(fiscal_years)), ", ".join(["%s"] * len(accounts))),
+		tuple(fiscal_years + accounts), as_dict=True)
+
+def validate_budget_records(args, budget_records, expense_cache=None):
 	for budget in budget_records:
 		if flt(budget.budget_amount):
 			yearly_action = budget.action_if_annual_budget_exceeded
@@ -111,16 +141,16 @@ def validate_budget_records(args, budget_records):
 				args["month_end_date"] = get_last_day(args.posting_date)
 
 				compare_expense_with_budget(args, budget_amount, 
-					_("Accumulated Monthly"), monthly_action)
+					_("Accumulated Monthly"), monthly_action, expense_cache)
 
 			if yearly_action in ("Stop", "Warn") and monthly_action != "Stop" \
 				and yearly_action != monthly_action:
 				compare_expense_with_budget(args, flt(budget.budget_amount), 
-						_("Annual"), yearly_action)
+						_("Annual"), yearly_action, expense_cache)
 
 
-def compare_expense_with_budget(args, budget_amount, action_for, action):
-	actual_expense = get_actual_expense(args)
+def compare_expense_with_budget(args, budget_amount, action_for, action, expense_cache=None):
+	actual_expense = get_actual_expense(args, expense_cache)
 	if actual_expense > budget_amount:
 		diff = actual_expense - budget_amount
 		currency = frappe.db.get_value('Company', args.company, 'default_currency')
@@ -137,29 +167,41 @@ def compare_expense_with_budget(args, budget_amount, action_for, action):
 			frappe.msgprint(msg, indicator='orange')
 
 
-def get_actual_expense(args):
-	condition1 = " and gle.posting_date <= %(month_end_date)s" \
-		if args.get("month_end_date") else ""
+def get_actual_expense(args, expense_cache=None):
+	'''Returns expense of the account against the budget in the fiscal year, up to
+	`month_end_date` if set. Monthly expense is cached in `expense_cache` per budget
+	and account, so a voucher reads it once for all its checks.'''
+	if expense_cache is None:
+		expense_cache = {}
+
+	key = (args.budget_against_field, args.budget_against, args.account, args.fiscal_year, args.company)
+	if key not in expense_cache:
+		expense_cache[key] = get_monthly_expense(args)
+
+	month_end_date = getdate(args.month_end_date) if args.get("month_end_date") else None
+
+	return flt(sum(amount for period_end, amount in expense_cache[key].items()
+		if not month_end_date or getdate(period_end) <= month_end_date))
+
+def get_monthly_expense(args):
+	'''Returns dict of month end: expense, read from Account Balance'''
+	values = frappe._dict(args)
 	if args.budget_against_field == "Cost Center":
-		lft_rgt = frappe.db.get_value(args.budget_against_field, 
-			args.budget_against, ["lft", "rgt"], as_dict=1)
-		args.update(lft_rgt)
-		condition2 = """and exists(select name from `tabCost Center` 
-			where lft>=%(lft)s and rgt<=%(rgt)s and name=gle.cost_center)"""
-	
+		values.cost_centers = tuple(get_descendants("Cost Center", args.budget_against)) or ("",)
+		condition = "and ab.cost_center in %(cost_centers)s"
+
 	elif args.budget_against_field == "Project":
-		condition2 = "and exists(select name from `tabProject` where name=gle.project)"
-
-	return flt(frappe.db.sql("""
-		select sum(gle.debit) - sum(gle.credit)
-		from `tabGL Entry` gle
-		where gle.account=%(account)s
-			{condition1}
-			and gle.fiscal_year=%(fiscal_year)s
-			and gle.company=%(company)s
-			and gle.docstatus=1
-			{condition2}
-	""".format(condition1=condition1, condition2=condition2), (args))[0][0])
+		condition = "and ab.project=%(budget_against)s"
+
+	return dict(frappe.db.sql("""
+		select ab.period_end, sum(ab.debit) - sum(ab.credit)
+		from `tabAccount Balance` ab
+		where ab.account=%(account)s
+			and ab.fiscal_year=%(fiscal_year)s
+			and ab.company=%(company)s
+			{condition}
+		group by ab.period_end
+	""".format(condition=condition), values))
 
 
 def get_accumulated_monthly_budget(monthly_distribution, posting_date, fiscal_year, annual_budget):
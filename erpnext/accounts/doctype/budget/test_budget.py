@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 
 import frappe
 import unittest
+from frappe.utils import flt
 from erpnext.accounts.doctype.budget.budget import get_actual_expense, BudgetError
 from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
 
@@ -140,6 +141,40 @@ class TestBudget(unittest.TestCase):
 		budget.load_from_db()
 		budget.cancel()
 
+	def test_actual_expense_from_account_balance(self):
+		for budget_against_field, budget_against, project in (
+			("Cost Center", "_Test Company - _TC", None),
+			("Project", "_Test Project", "_Test Project")):
+
+			args = frappe._dict({
+				"account": "_Test Account Cost for Goods Sold - _TC",
+				"company": "_Test Company",
+				"fiscal_year": "_Test Fiscal Year 2013",
+				"budget_against_field": budget_against_field,
+				"budget_against": budget_against
+			})
+			expense = get_actual_expense(args)
+			expense_upto_january = get_actual_expense(frappe._dict(args, month_end_date="2013-01-31"))
+
+			make_journal_entry("_Test Account Cost for Goods Sold - _TC", "_Test Bank - _TC", 1000,
+				"_Test Cost Center - _TC", posting_date="2013-02-14", submit=True, project=project)
+
+			self.assertEqual(flt(get_actual_expense(args) - expense, 2), 1000)
+			self.assertEqual(get_actual_expense(frappe._dict(args, month_end_date="2013-01-31")),
+				expense_upto_january)
+
+			# same as the expense in GL Entry
+			condition = "and project=%(budget_against)s" if project else ""
+			self.assertEqual(flt(get_actual_expense(args), 2), flt(frappe.db.sql("""select sum(debit) - sum(credit)
+				from `tabGL Entry` where account=%(account)s and company=%(company)s
+					and fiscal_year=%(fiscal_year)s {0}""".format(condition), args)[0][0], 2))
+
+		# expense without the project is not part of the project's expense
+		expense = get_actual_expense(args)
+		make_journal_entry("_Test Account Cost for Goods Sold - _TC", "_Test Bank - _TC", 1000,
+			"_Test Cost Center - _TC", posting_date="2013-02-14", submit=True)
+		self.assertEqual(get_actual_expense(args), expense)
+
 def set_total_expense_zero(posting_date, budget_against_field=None, budget_against_CC=None):
 	if budget_against_field == "Project":
 		budget_against = "_Test Project"
@@ -10,6 +10,8 @@ from erpnext.accounts.party import validate_party_gle_currency, validate_party_f
 from erpnext.accounts.utils import get_account_currency
 from erpnext.accounts.utils import get_fiscal_year
 from erpnext.exceptions import InvalidAccountCurrency
+from erpnext.utilities.bulk_insert import get_master_details
+from erpnext.accounts.doctype.party_outstanding_invoice.party_outstanding_invoice import update_outstanding_invoice
 
 exclude_from_linked_with = True
 
@@ -135,6 +137,111 @@ class GLEntry(Document):
 			self.fiscal_year = get_fiscal_year(self.posting_date, company=self.company)[0]
 
 
+def validate_gl_entries(gl_map, adv_adj=False, from_repost=False):
+	'''Validate GL Entries of a voucher before they are inserted in bulk
+	(see `general_ledger.save_entries`).
+
+	Runs the checks of `validate` and `on_update_with_args` with one query per master
+	for all entries. Sets fiscal_year and account_currency.'''
+	meta = frappe.get_meta("GL Entry")
+	accounts = get_master_details("Account", [d.get("account") for d in gl_map],
+		["account_type", "report_type", "is_group", "docstatus", "company", "freeze_account"])
+	cost_center_company = dict((d.name, d.company) for d in get_master_details("Cost Center",
+		[d.get("cost_center") for d in gl_map if d.get("cost_center")], ["company"]).values())
+
+	fiscal_years = {}
+
+	if not from_repost:
+		for posting_date in set(getdate(d.get("posting_date")) for d in gl_map):
+			check_freezing_date(posting_date, adv_adj)
+
+		for party_type, party in set((d.get("party_type"), d.get("party")) for d in gl_map):
+			validate_party_frozen_disabled(party_type, party)
+
+	for account, account_details in accounts.items():
+		if account_details.freeze_account == 'Yes':
+			validate_frozen_account(account, adv_adj)
+
+	party_currencies = set()
+	for entry in gl_map:
+		for k in ['account','voucher_type','voucher_no','company']:
+			if not entry.get(k):
+				frappe.throw(_("{0} is required").format(_(meta.get_label(k))))
+
+		account = accounts.get(entry.account)
+		if not account:
+			frappe.throw(_("Account {0} does not exist").format(entry.account))
+
+		if not (entry.get("party_type") and entry.get("party")):
+			if account.account_type == "Receivable":
+				frappe.throw(_("{0} {1}: Customer is required against Receivable account {2}")
+					.format(entry.voucher_type, entry.voucher_no, entry.account))
+			elif account.account_type == "Payable":
+				frappe.throw(_("{0} {1}: Supplier is required against Payable account {2}")
+					.format(entry.voucher_type, entry.voucher_no, entry.account))
+
+		# Zero value transaction is not allowed
+		if not (flt(entry.get("debit")) or flt(entry.get("credit"))):
+			frappe.throw(_("{0} {1}: Either debit or credit amount is required for {2}")
+				.format(entry.voucher_type, entry.voucher_no, entry.account))
+
+		if not entry.get("fiscal_year"):
+			key = (getdate(entry.posting_date), entry.company)
+			if key not in fiscal_years:
+				fiscal_years[key] = get_fiscal_year(entry.posting_date, company=entry.company)[0]
+			entry.fiscal_year = fiscal_years[key]
+
+		if from_repost:
+			continue
+
+		# pl must have cost center
+		if account.report_type == "Profit and Loss":
+			if not entry.get("cost_center") and entry.voucher_type != 'Period Closing Voucher':
+				frappe.throw(_("{0} {1}: Cost Center is required for 'Profit and Loss' account {2}. Please set up a default Cost Center for the Company.")
+					.format(entry.voucher_type, entry.voucher_no, entry.account))
+
+			if entry.get("is_opening")=='Yes':
+				frappe.throw(_("{0} {1}: 'Profit and Loss' type account {2} not allowed in Opening Entry")
+					.format(entry.voucher_type, entry.voucher_no, entry.account))
+		else:
+			entry.cost_center = None
+			entry.project = None
+
+		if entry.get("cost_center") and cost_center_company.get(entry.cost_center) != entry.company:
+			frappe.throw(_("{0} {1}: Cost Center {2} does not belong to Company {3}")
+				.format(entry.voucher_type, entry.voucher_no, entry.cost_center, entry.company))
+
+		# currency
+		company_currency = erpnext.get_company_currency(entry.company)
+		account_currency = get_account_currency(entry.account)
+
+		if not entry.get("account_currency"):
+			entry.account_currency = company_currency
+
+		if account_currency != entry.account_currency:
+			frappe.throw(_("{0} {1}: Accounting Entry for {2} can only be made in currency: {3}")
+				.format(entry.voucher_type, entry.voucher_no, entry.account,
+				(account_currency or company_currency)), InvalidAccountCurrency)
+
+		if entry.get("party_type") and entry.get("party"):
+			party_currencies.add((entry.party_type, entry.party, entry.company, entry.account_currency))
+
+		# account details
+		if account.is_group==1:
+			frappe.throw(_("{0} {1}: Account {2} cannot be a Group")
+				.format(entry.voucher_type, entry.voucher_no, entry.account))
+
+		if account.docstatus==2:
+			frappe.throw(_("{0} {1}: Account {2} is inactive")
+				.format(entry.voucher_type, entry.voucher_no, entry.account))
+
+		if account.company != entry.company:
+			frappe.throw(_("{0} {1}: Account {2} does not belong to Company {3}")
+				.format(entry.voucher_type, entry.voucher_no, entry.account, entry.company))
+
+	for party_type, party, company, account_currency in party_currencies:
+		validate_party_gle_currency(party_type, party, company, account_currency)
+
 def validate_balance_type(account, adv_adj=False):
 	if not adv_adj and account:
 		balance_must_be = frappe.db.get_value("Account", account, "balance_must_be")
@@ -201,6 +308,8 @@ def update_outstanding_amt(account, party_type, party, against_voucher_type, aga
 		ref_doc.db_set('outstanding_amount', bal)
 		ref_doc.set_status(update=True)
 
+	update_outstanding_invoice(party_type, party, account, against_voucher_type, against_voucher)
+
 def validate_frozen_account(account, adv_adj=None):
 	frozen_account = frappe.db.get_value("Account", account, "freeze_account")
 	if frozen_account == 'Yes' and not adv_adj:
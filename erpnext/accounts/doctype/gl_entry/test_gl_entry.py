@@ -23,3 +23,132 @@ class TestGLEntry(unittest.TestCase):
 			and debit = 0 and credit = '.01'""", jv.name)
 
 		self.assertTrue(round_off_entry)
+
+	def test_bulk_insert(self):
+		jv = make_journal_entry("_Test Bank - _TC", "_Test Cash - _TC", 100, submit=False)
+		for i in xrange(10):
+			jv.append("accounts", {
+				"account": "_Test Account Cost for Goods Sold - _TC",
+				"cost_center": "_Test Cost Center - _TC",
+				"debit_in_account_currency": 10
+			})
+		jv.get("accounts")[1].credit_in_account_currency = 200
+		jv.insert()
+		jv.submit()
+
+		gl_entries = frappe.db.sql("""select name, fiscal_year, account_currency, docstatus
+			from `tabGL Entry` where voucher_type='Journal Entry' and voucher_no=%s""", jv.name, as_dict=1)
+
+		# rows of the same account and cost center are merged
+		self.assertEqual(len(gl_entries), 3)
+		self.assertEqual(len(set(d.name for d in gl_entries)), 3)
+		for d in gl_entries:
+			self.assertTrue(d.fiscal_year and d.account_currency)
+			self.assertEqual(d.docstatus, 1)
+
+	def test_bulk_insert_values(self):
+		from erpnext.utilities.bulk_insert import get_valid_value
+
+		# empty numbers are inserted as 0 into not null columns
+		for fieldtype in ("Currency", "Float", "Percent", "Int", "Check"):
+			self.assertEqual(get_valid_value(frappe._dict(fieldtype=fieldtype), None), 0)
+
+		self.assertEqual(get_valid_value(frappe._dict(fieldtype="Check"), 5), 1)
+		self.assertEqual(get_valid_value(frappe._dict(fieldtype="Date"), ""), None)
+		self.assertEqual(get_valid_value(frappe._dict(fieldtype="Data"), None), None)
+
+	def test_merge_similar_entries(self):
+		from erpnext.accounts.general_ledger import merge_similar_entries
+
+		gl_map = get_gl_map(10000, heads=500)
+		gl_map.append(frappe._dict(gl_map[0], project="_Test Project"))
+		gl_map.append(frappe._dict(gl_map[1], debit=-20, debit_in_account_currency=-20))
+		merged = merge_similar_entries(gl_map)
+
+		# entries of SINV-1 add up to zero and are removed, a different project is not merged
+		self.assertEqual(len(merged), 500)
+		self.assertEqual([d.against_voucher for d in merged],
+			["SINV-{0}".format(i) for i in xrange(500) if i != 1] + ["SINV-0"])
+		self.assertEqual([d.project for d in merged], [None] * 499 + ["_Test Project"])
+		self.assertEqual([d.debit for d in merged], [20] * 499 + [1])
+		self.assertEqual([d.debit_in_account_currency for d in merged], [20] * 499 + [1])
+		self.assertEqual(set(d.credit for d in merged), set([0]))
+
+	def test_merge_similar_entries_scaling(self):
+		'''Lines with distinct heads are the worst case for merging. Each line must
+		be matched by key, not compared with every merged entry'''
+		from erpnext.accounts import general_ledger
+
+		comparisons = [0]
+		class MergeKey(tuple):
+			def __eq__(self, other):
+				comparisons[0] += 1
+				return tuple.__eq__(self, other)
+
+			def __hash__(self):
+				return tuple.__hash__(self)
+
+		get_merge_key = general_ledger.get_merge_key
+		general_ledger.get_merge_key = lambda gle: MergeKey(get_merge_key(gle))
+		try:
+			for count in (1000, 10000):
+				comparisons[0] = 0
+				merged = general_ledger.merge_similar_entries(get_gl_map(count, heads=count))
+
+				self.assertEqual(len(merged), count)
+				self.assertTrue(comparisons[0] <= count,
+					"{0} key comparisons for {1} lines".format(comparisons[0], count))
+		finally:
+			general_ledger.get_merge_key = get_merge_key
+
+	def test_repost_gl_entries(self):
+		from erpnext.accounts.general_ledger import repost_gl_entries
+
+		jv = make_journal_entry("_Test Bank - _TC", "_Test Cash - _TC", 100, submit=False)
+		jv.append("accounts", {
+			"account": "_Test Account Cost for Goods Sold - _TC",
+			"cost_center": "_Test Cost Center - _TC",
+			"debit_in_account_currency": 50
+		})
+		jv.get("accounts")[1].credit_in_account_currency = 150
+		jv.insert()
+		jv.submit()
+
+		existing_gle = frappe.db.sql("""select * from `tabGL Entry`
+			where voucher_type='Journal Entry' and voucher_no=%s""", jv.name, as_dict=1)
+		names = dict((d.account, d.name) for d in existing_gle)
+
+		expected_gle = []
+		for d in existing_gle:
+			d = frappe._dict(d.copy())
+			d.pop("name")
+			if d.account == "_Test Account Cost for Goods Sold - _TC":
+				d.debit = d.debit_in_account_currency = 60
+			elif d.account == "_Test Cash - _TC":
+				d.credit = d.credit_in_account_currency = 160
+			expected_gle.append(d)
+
+		changed_keys = repost_gl_entries(expected_gle, existing_gle)
+		self.assertEqual(len(changed_keys), 2)
+
+		reposted_gle = dict((d.account, d) for d in frappe.db.sql("""select name, account, debit, credit
+			from `tabGL Entry` where voucher_type='Journal Entry' and voucher_no=%s""", jv.name, as_dict=1))
+
+		# entries of unchanged accounts are kept
+		self.assertEqual(reposted_gle["_Test Bank - _TC"].name, names["_Test Bank - _TC"])
+		self.assertNotEqual(reposted_gle["_Test Cash - _TC"].name, names["_Test Cash - _TC"])
+		self.assertEqual(reposted_gle["_Test Cash - _TC"].credit, 160)
+		self.assertEqual(reposted_gle["_Test Account Cost for Goods Sold - _TC"].debit, 60)
+
+		self.assertFalse(repost_gl_entries(expected_gle, frappe.db.sql("""select * from `tabGL Entry`
+			where voucher_type='Journal Entry' and voucher_no=%s""", jv.name, as_dict=1)))
+
+def get_gl_map(count, heads):
+	return [frappe._dict({
+		"account": "_Test Account Cost for Goods Sold - _TC",
+		"cost_center": "_Test Cost Center - _TC",
+		"against_voucher_type": "Sales Invoice",
+		"against_voucher": "SINV-{0}".format(i % heads),
+		"debit": 1,
+		"debit_in_account_currency": 1
+	}) for i in xrange(count)]
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import flt, now
+from frappe.model.document import Document
+
+class PartyOutstandingInvoice(Document):
+	pass
+
+# invoice side of GL Entries, a Journal Entry is an invoice if it is not against another voucher
+invoice_condition = """((voucher_type = 'Journal Entry' and (against_voucher = '' or against_voucher is null))
+	or (voucher_type not in ('Journal Entry', 'Payment Entry')))"""
+
+def get_dr_or_cr(party_type):
+	'''Returns invoice amount of a GL Entry for the party type, payments have the opposite sign'''
+	if party_type == "Customer":
+		return "(debit_in_account_currency - credit_in_account_currency)"
+	else:
+		return "(credit_in_account_currency - debit_in_account_currency)"
+
+def update_outstanding_invoice(party_type, party, account, voucher_type, voucher_no):
+	'''Recalculate invoice and payment amount of a voucher from GL Entry. Called
+	from `update_outstanding_amt` and when GL Entries without against voucher are made'''
+	if not (party_type and party):
+		return
+
+	dr_or_cr = get_dr_or_cr(party_type)
+	values = {
+		"party_type": party_type,
+		"party": party,
+		"account": account,
+		"voucher_type": voucher_type,
+		"voucher_no": voucher_no
+	}
+
+	invoice = frappe.db.sql("""select sum({dr_or_cr}) as invoice_amount, min(posting_date) as posting_date
+		from `tabGL Entry`
+		where voucher_type=%(voucher_type)s and voucher_no=%(voucher_no)s
+			and party_type=%(party_type)s and party=%(party)s and account=%(account)s
+			and {dr_or_cr} > 0 and {invoice_condition}""".format(dr_or_cr=dr_or_cr,
+			invoice_condition=invoice_condition), values, as_dict=1)[0]
+
+	payment_amount = flt(frappe.db.sql("""select sum(-{dr_or_cr})
+		from `tabGL Entry`
+		where against_voucher_type=%(voucher_type)s and against_voucher=%(voucher_no)s
+			and party_type=%(party_type)s and party=%(party)s and account=%(account)s
+			and -{dr_or_cr} > 0""".format(dr_or_cr=dr_or_cr), values)[0][0])
+
+	frappe.db.sql("""delete from `tabParty Outstanding Invoice`
+		where party_type=%(party_type)s and party=%(party)s and account=%(account)s
+			and voucher_type=%(voucher_type)s and voucher_no=%(voucher_no)s""", values)
+
+	invoice_amount = flt(invoice.invoice_amount)
+	if invoice_amount - payment_amount > 0.005:
+		values.update({
+			"posting_date": invoice.posting_date,
+			"invoice_amount": invoice_amount,
+			"payment_amount": payment_amount
+		})
+		make_outstanding_invoices([values])
+
+def update_outstanding_invoices(gl_entries, updated_against_voucher_types=()):
+	'''Update outstanding invoices affected by the GL Entries of a voucher: the voucher
+	itself if it is an invoice and the vouchers it is against. Against vouchers of
+	`updated_against_voucher_types` are skipped, they are updated by `update_outstanding_amt`'''
+	invoices = []
+	for gle in gl_entries:
+		if not (gle.get("party_type") and gle.get("party")):
+			continue
+
+		if gle.get("against_voucher"):
+			if gle.get("against_voucher_type") in updated_against_voucher_types:
+				continue
+			key = (gle.get("party_type"), gle.get("party"), gle.get("account"),
+				gle.get("against_voucher_type"), gle.get("against_voucher"))
+		elif gle.get("voucher_type") != "Payment Entry":
+			key = (gle.get("party_type"), gle.get("party"), gle.get("account"),
+				gle.get("voucher_type"), gle.get("voucher_no"))
+		else:
+			continue
+
+		if key not in invoices:
+			invoices.append(key)
+
+	for key in invoices:
+		update_outstanding_invoice(*key)
+
+def make_outstanding_invoices(invoices):
+	if not invoices:
+		return
+
+	due_dates = get_due_dates(invoices)
+	timestamp, values = now(), []
+	for d in invoices:
+		values.extend([frappe.generate_hash(length=10), timestamp, timestamp, frappe.session.user,
+			frappe.session.user, d["party_type"], d["party"], d["account"], d["voucher_type"], d["voucher_no"],
+			d["posting_date"], due_dates.get((d["voucher_type"], d["voucher_no"])),
+			flt(d["invoice_amount"]), flt(d["payment_amount"]),
+			flt(d["invoice_amount"]) - flt(d["payment_amount"])])
+
+	frappe.db.sql("""insert into `tabParty Outstanding Invoice`
+		(name, creation, modified, owner, modified_by, party_type, party, account, voucher_type, voucher_no,
+			posting_date, due_date, invoice_amount, payment_amount, outstanding_amount)
+		values {0}""".format(", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(invoices))),
+		tuple(values))
+
+def get_due_dates(invoices):
+	due_dates = {}
+	for voucher_type in set(d["voucher_type"] for d in invoices):
+		if not frappe.get_meta(voucher_type).has_field("due_date"):
+			continue
+
+		voucher_nos = list(set(d["voucher_no"] for d in invoices if d["voucher_type"] == voucher_type))
+		for name, due_date in frappe.db.sql("""select name, due_date from `tab{0}`
+			where name in ({1})""".format(voucher_type, ", ".join(["%s"] * len(voucher_nos))), tuple(voucher_nos)):
+			due_dates[(voucher_type, name)] = due_date
+
+	return due_dates
+
+def rebuild_outstanding_invoices(party_type=None, party=None):
+	'''Rebuild outstanding invoices of all parties, or of a party, from GL Entry'''
+	conditions, values = "", {"party_type": party_type, "party": party}
+	if party_type:
+		conditions += " and party_type=%(party_type)s"
+	if party:
+		conditions += " and party=%(party)s"
+
+	frappe.db.sql("""delete from `tabParty Outstanding Invoice` where 1=1 {0}""".format(conditions), values)
+
+	for party_type in frappe.db.sql_list("""select distinct party_type from `tabGL Entry`
+		where ifnull(party_type, '') != '' {0}""".format(conditions), values):
+		dr_or_cr = get_dr_or_cr(party_type)
+		values["party_type"] = party_type
+
+		payments = dict(((d[0], d[1], d[2], d[3]), flt(d[4])) for d in frappe.db.sql("""
+			select party, account, against_voucher_type, against_voucher, sum(-{dr_or_cr})
+			from `tabGL Entry`
+			where party_type=%(party_type)s and ifnull(against_voucher, '') != ''
+				and -{dr_or_cr} > 0 {conditions}
+			group by party, account, against_voucher_type, against_voucher""".format(dr_or_cr=dr_or_cr,
+				conditions=conditions), values))
+
+		invoices = []
+		for d in frappe.db.sql("""select party, account, voucher_type, voucher_no,
+				min(posting_date) as posting_date, sum({dr_or_cr}) as invoice_amount
+			from `tabGL Entry`
+			where party_type=%(party_type)s and {dr_or_cr} > 0 and {invoice_condition} {conditions}
+			group by party, account, voucher_type, voucher_no""".format(dr_or_cr=dr_or_cr,
+				invoice_condition=invoice_condition, conditions=conditions), values, as_dict=1):
+
+			d.party_type = party_type
+			d.payment_amount = payments.get((d.party, d.account, d.voucher_type, d.voucher_no), 0.0)
+			if flt(d.invoice_amount) - d.payment_amount > 0.005:
+				invoices.append(d)
+
+		for i in xrange(0, len(invoices), 500):
+			make_outstanding_invoices(invoices[i:i + 500])
+
+def on_doctype_update():
+	if not frappe.db.sql("""show index from `tabParty Outstanding Invoice`
+		where Key_name="party_account_voucher" """):
+		frappe.db.commit()
+		frappe.db.sql("""alter table `tabParty Outstanding Invoice`
+			add unique index party_account_voucher(party_type, party, account, voucher_type, voucher_no)""")
+		frappe.db.sql("""alter table `tabParty Outstanding Invoice`
+			add index party_account_due_date(party_type, party, account, due_date)""")
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from erpnext.accounts.utils import get_outstanding_invoices
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+
+class TestPartyOutstandingInvoice(unittest.TestCase):
+	def test_outstanding_invoice(self):
+		si = create_sales_invoice(rate=100)
+		self.assertEqual(get_outstanding(si.name), 100)
+
+		pe = get_payment_entry("Sales Invoice", si.name, party_amount=40, bank_account="_Test Cash - _TC")
+		pe.references[0].allocated_amount = 40
+		pe.insert()
+		pe.submit()
+		self.assertEqual(get_outstanding(si.name), 60)
+
+		pe.cancel()
+		self.assertEqual(get_outstanding(si.name), 100)
+
+		si.cancel()
+		self.assertEqual(get_outstanding(si.name), None)
+
+	def test_outstanding_invoices_by_page(self):
+		for i in xrange(3):
+			create_sales_invoice(rate=100)
+
+		invoices = [d.voucher_no for d in get_outstanding_invoices("Customer", "_Test Customer", "Debtors - _TC")]
+
+		pages = []
+		for limit_start in xrange(0, len(invoices) + 2, 2):
+			pages.extend(d.voucher_no for d in get_outstanding_invoices("Customer", "_Test Customer",
+				"Debtors - _TC", limit_start=limit_start, limit_page_length=2))
+		self.assertEqual(pages, invoices)
+
+		pr = frappe.get_doc({
+			"doctype": "Payment Reconciliation",
+			"company": "_Test Company",
+			"party_type": "Customer",
+			"party": "_Test Customer",
+			"receivable_payable_account": "Debtors - _TC",
+			"invoice_limit": 2
+		})
+		pr.get_unreconciled_entries()
+		self.assertEqual([d.invoice_number for d in pr.invoices], invoices[:2])
+
+def get_outstanding(voucher_no):
+	for d in get_outstanding_invoices("Customer", "_Test Customer", "Debtors - _TC"):
+		if d.voucher_no == voucher_no:
+			return d.outstanding_amount
@@ -473,7 +473,8 @@ def get_outstanding_reference_documents(args):
 
 	# Get positive outstanding sales /purchase invoices
 	outstanding_invoices = get_outstanding_invoices(args.get("party_type"), args.get("party"), 
-		args.get("party_account"))
+		args.get("party_account"), limit_start=args.get("limit_start"),
+		limit_page_length=args.get("limit_page_length"))
 	
 	for d in outstanding_invoices:
 		d["exchange_rate"] = 1
@@ -79,10 +79,24 @@ class PaymentReconciliation(Document):
 		condition = self.check_condition()
 
 		non_reconciled_invoices = get_outstanding_invoices(self.party_type, self.party,
-			self.receivable_payable_account, condition=condition)
+			self.receivable_payable_account, condition=condition, limit_page_length=self.invoice_limit)
 
 		self.add_invoice_entries(non_reconciled_invoices)
 
+	def get_allocated_invoice_entries(self):
+		# outstanding of the invoices selected in payments, they may not be in the first
+		# `invoice_limit` invoices any more
+		invoice_numbers = list(set(p.invoice_number for p in self.get("payments")
+			if p.invoice_number and p.allocated_amount))
+		if not invoice_numbers:
+			return
+
+		condition = " and voucher_no in ({0})".format(", ".join("'{0}'".format(frappe.db.escape(d))
+			for d in invoice_numbers))
+
+		self.add_invoice_entries(get_outstanding_invoices(self.party_type, self.party,
+			self.receivable_payable_account, condition=condition))
+
 	def add_invoice_entries(self, non_reconciled_invoices):
 		#Populate 'invoices' with JVs and Invoices to reconcile against
 		self.set('invoices', [])
@@ -101,7 +115,7 @@ class PaymentReconciliation(Document):
 			if e.invoice_number and " | " in e.invoice_number:
 				e.invoice_type, e.invoice_number = e.invoice_number.split(" | ")
 
-		self.get_invoice_entries()
+		self.get_allocated_invoice_entries()
 		self.validate_invoice()
 		dr_or_cr = "credit_in_account_currency" \
 			if self.party_type == "Customer" else "debit_in_account_currency"
@@ -173,14 +187,9 @@ class PaymentReconciliation(Document):
 		cond = " and posting_date >= '{0}'".format(frappe.db.escape(self.from_date)) if self.from_date else ""
 		cond += " and posting_date <= '{0}'".format(frappe.db.escape(self.to_date)) if self.to_date else ""
 
-		if self.party_type == "Customer":
-			dr_or_cr = "debit_in_account_currency"
-		else:
-			dr_or_cr = "credit_in_account_currency"
-
 		if self.minimum_amount:
-			cond += " and `{0}` >= {1}".format(dr_or_cr, flt(self.minimum_amount))
+			cond += " and invoice_amount >= {0}".format(flt(self.minimum_amount))
 		if self.maximum_amount:
-			cond += " and `{0}` <= {1}".format(dr_or_cr, flt(self.maximum_amount))
+			cond += " and invoice_amount <= {0}".format(flt(self.maximum_amount))
 
 		return cond
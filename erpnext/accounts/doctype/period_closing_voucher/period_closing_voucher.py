@@ -17,6 +17,8 @@ class PeriodClosingVoucher(AccountsController):
 		self.make_gl_entries()
 
 	def on_cancel(self):
+		from erpnext.accounts.doctype.account_balance.account_balance import update_account_balances_for_voucher
+		update_account_balances_for_voucher(self.doctype, self.name, cancel=True)
 		frappe.db.sql("""delete from `tabGL Entry`
 			where voucher_type = 'Period Closing Voucher' and voucher_no=%s""", self.name)
 
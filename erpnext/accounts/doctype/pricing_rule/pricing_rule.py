@@ -8,12 +8,16 @@ import frappe
 import json
 import copy
 from frappe import throw, _
-from frappe.utils import flt, cint
+from frappe.utils import flt, cint, getdate
 from frappe.model.document import Document
 
 
 class MultiplePricingRuleConflict(frappe.ValidationError): pass
 
+# open ends of the validity of a pricing rule
+min_valid_from = getdate("2000-01-01")
+max_valid_upto = getdate("2500-12-31")
+
 class PricingRule(Document):
 	def validate(self):
 		self.validate_mandatory()
@@ -25,6 +29,15 @@ class PricingRule(Document):
 
 		if not self.margin_type: self.margin_rate_or_amount = 0.0
 
+	def on_update(self):
+		clear_pricing_rule_index(self)
+
+	def on_trash(self):
+		clear_pricing_rule_index(self)
+
+	def after_rename(self, old, new, merge=False):
+		clear_pricing_rule_index(self)
+
 	def validate_mandatory(self):
 		for field in ["apply_on", "applicable_for"]:
 			tocheck = frappe.scrub(self.get(field) or "")
@@ -136,6 +149,8 @@ def get_serial_no_for_item(args):
 	return item_details
 
 def get_pricing_rule_for_item(args):
+	from erpnext.stock.get_item_details import get_item_values, get_shared_value
+
 	if args.get("parenttype") == "Material Request": return {}
 
 	item_details = frappe._dict({
@@ -151,7 +166,7 @@ def get_pricing_rule_for_item(args):
 
 	if not (args.item_group and args.brand):
 		try:
-			args.item_group, args.brand = frappe.db.get_value("Item", args.item_code, ["item_group", "brand"])
+			args.item_group, args.brand = get_item_values(args.item_code, ["item_group", "brand"])
 		except TypeError:
 			# invalid item_code
 			return item_details
@@ -160,14 +175,14 @@ def get_pricing_rule_for_item(args):
 
 	if args.transaction_type=="selling":
 		if args.customer and not (args.customer_group and args.territory):
-			customer = frappe.db.get_value("Customer", args.customer, ["customer_group", "territory"])
+			customer = get_shared_value("Customer", args.customer, ["customer_group", "territory"])
 			if customer:
 				args.customer_group, args.territory = customer
 
 		args.supplier = args.supplier_type = None
 
 	elif args.supplier and not args.supplier_type:
-		args.supplier_type = frappe.db.get_value("Supplier", args.supplier, "supplier_type")
+		args.supplier_type = get_shared_value("Supplier", args.supplier, "supplier_type")
 		args.customer = args.customer_group = args.territory = None
 
 	pricing_rules = get_pricing_rules(args)
@@ -218,70 +233,88 @@ def remove_pricing_rules(item_list):
 	return out
 	
 def get_pricing_rules(args):
-	def _get_tree_conditions(parenttype, allow_blank=True):
+	"""Returns pricing rules applicable to the item and party in `args`, ordered by
+	priority. Rules are matched from the cached index of the company, price list
+	and transaction type, see `get_pricing_rule_index`."""
+	from erpnext.stock.get_item_details import get_item_values
+	from erpnext.utilities.tree import get_ancestors
+
+	# ancestors (with self) of the groups in args, rules for any of them apply
+	ancestors = {}
+	for parenttype in ("Customer Group", "Territory", "Item Group"):
 		field = frappe.scrub(parenttype)
-		condition = ""
 		if args.get(field):
-			try:
-				lft, rgt = frappe.db.get_value(parenttype, args[field], ["lft", "rgt"])
-			except TypeError:
+			ancestors[field] = get_ancestors(parenttype, args[field])
+			if not ancestors[field]:
 				frappe.throw(_("Invalid {0}").format(args[field]))
 
-			parent_groups = frappe.db.sql_list("""select name from `tab%s`
-				where lft<=%s and rgt>=%s""" % (parenttype, '%s', '%s'), (lft, rgt))
-
-			if parent_groups:
-				if allow_blank: parent_groups.append('')
-				condition = " ifnull("+field+", '') in ('" + \
-					"', '".join([frappe.db.escape(d) for d in parent_groups])+"')"
-		return condition
-
-
-	conditions = item_variant_condition = ""
-	values =  {"item_code": args.get("item_code"), "brand": args.get("brand")}
-
-	for field in ["company", "customer", "supplier", "supplier_type", "campaign", "sales_partner"]:
-		if args.get(field):
-			conditions += " and ifnull("+field+", '') in (%("+field+")s, '')"
-			values[field] = args.get(field)
-		else:
-			conditions += " and ifnull("+field+", '') = ''"
-
-	for parenttype in ["Customer Group", "Territory"]:
-		group_condition = _get_tree_conditions(parenttype)
-		if group_condition:
-			conditions += " and " + group_condition
-
 	if not args.price_list: args.price_list = None
-	conditions += " and ifnull(for_price_list, '') in (%(price_list)s, '')"
-	values["price_list"] = args.get("price_list")
-
-	if args.get("transaction_date"):
-		conditions += """ and %(transaction_date)s between ifnull(valid_from, '2000-01-01')
-			and ifnull(valid_upto, '2500-12-31')"""
-		values['transaction_date'] = args.get('transaction_date')
-
-	item_group_condition = _get_tree_conditions("Item Group", False)
-	if item_group_condition:
-		item_group_condition = " or " + item_group_condition
 
 	# load variant of if not defined
 	if "variant_of" not in args:
-		args.variant_of = frappe.db.get_value("Item", args.item_code, "variant_of")
+		args.variant_of = get_item_values(args.item_code, "variant_of")
+
+	index = get_pricing_rule_index(args.get("company"), args.price_list, args.transaction_type)
 
+	positions = set(index["item_code"].get(args.item_code, []))
 	if args.variant_of:
-		item_variant_condition = ' or item_code=%(variant_of)s '
-		values['variant_of'] = args.variant_of
-
-	return frappe.db.sql("""select * from `tabPricing Rule`
-		where (item_code=%(item_code)s {item_variant_condition} {item_group_condition} or brand=%(brand)s)
-			and docstatus < 2 and disable = 0
-			and {transaction_type} = 1 {conditions}
-		order by priority desc, name desc""".format(
-			item_group_condition = item_group_condition,
-			item_variant_condition = item_variant_condition,
-			transaction_type = args.transaction_type,
-			conditions = conditions), values, as_dict=1)
+		positions.update(index["item_code"].get(args.variant_of, []))
+	if args.brand is not None:
+		positions.update(index["brand"].get(args.brand, []))
+	for item_group in ancestors.get("item_group", []):
+		positions.update(index["item_group"].get(item_group, []))
+
+	transaction_date = getdate(args.transaction_date) if args.get("transaction_date") else None
+
+	return [frappe._dict(index["rules"][i]) for i in sorted(positions)
+		if match_pricing_rule(index["rules"][i], args, ancestors, transaction_date)]
+
+def match_pricing_rule(pricing_rule, args, ancestors, transaction_date=None):
+	"""Returns True if the party and date conditions of the pricing rule match `args`"""
+	for field in ("customer", "supplier", "supplier_type", "campaign", "sales_partner"):
+		if (pricing_rule.get(field) or "") not in ((args.get(field), "") if args.get(field) else ("",)):
+			return False
+
+	for field in ("customer_group", "territory"):
+		if args.get(field) and pricing_rule.get(field) and pricing_rule.get(field) not in ancestors[field]:
+			return False
+
+	if transaction_date and not (pricing_rule.valid_from or min_valid_from) <= transaction_date \
+		<= (pricing_rule.valid_upto or max_valid_upto):
+			return False
+
+	return True
+
+def get_pricing_rule_index(company, price_list, transaction_type):
+	"""Returns the index of enabled pricing rules of the company, price list and
+	transaction type (including rules without company or price list).
+
+	`rules` is the list of rules in order of priority and `item_code`, `item_group`
+	and `brand` map values to positions of the rules that apply on them. The index
+	is cached and cleared when a Pricing Rule is changed."""
+	key = json.dumps([company or "", price_list or "", transaction_type])
+	index = frappe.cache().hget("pricing_rule_index", key)
+
+	if not index:
+		index = {"rules": [], "item_code": {}, "item_group": {}, "brand": {}}
+		for i, d in enumerate(frappe.db.sql("""select * from `tabPricing Rule`
+			where docstatus < 2 and disable = 0 and {transaction_type} = 1
+				and ifnull(company, '') in (%(company)s, '')
+				and ifnull(for_price_list, '') in (%(price_list)s, '')
+			order by priority desc, name desc""".format(transaction_type=transaction_type),
+			{"company": company or "", "price_list": price_list or ""}, as_dict=1)):
+				index["rules"].append(d)
+				for field in ("item_code", "item_group", "brand"):
+					if d.get(field) is not None:
+						index[field].setdefault(d.get(field), []).append(i)
+
+		frappe.cache().hset("pricing_rule_index", key, index)
+
+	return index
+
+def clear_pricing_rule_index(doc=None, method=None):
+	"""Clear cached pricing rule index, called on update, rename and delete of Pricing Rule"""
+	frappe.cache().delete_value("pricing_rule_index")
 
 def filter_pricing_rules(args, pricing_rules):
 	# filter for qty
@@ -8,13 +8,14 @@ import frappe
 from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
 from erpnext.stock.get_item_details import get_item_details
 from frappe import MandatoryError
+from erpnext.accounts.doctype.pricing_rule.pricing_rule import clear_pricing_rule_index
 
 class TestPricingRule(unittest.TestCase):
 	def test_pricing_rule_for_discount(self):
 		from erpnext.stock.get_item_details import get_item_details
 		from frappe import MandatoryError
 
-		frappe.db.sql("delete from `tabPricing Rule`")
+		delete_pricing_rules()
 
 		test_record = {
 			"doctype": "Pricing Rule",
@@ -80,6 +81,7 @@ class TestPricingRule(unittest.TestCase):
 		self.assertEquals(details.get("discount_percentage"), 5)
 
 		frappe.db.sql("update `tabPricing Rule` set priority=NULL where campaign='_Test Campaign'")
+		clear_pricing_rule_index()
 		from erpnext.accounts.doctype.pricing_rule.pricing_rule	import MultiplePricingRuleConflict
 		self.assertRaises(MultiplePricingRuleConflict, get_item_details, args)
 
@@ -87,13 +89,13 @@ class TestPricingRule(unittest.TestCase):
 		details = get_item_details(args)
 		self.assertEquals(details.get("discount_percentage"), 15)
 
-		frappe.db.sql("delete from `tabPricing Rule`")
+		delete_pricing_rules()
 
 	def test_pricing_rule_for_margin(self):
 		from erpnext.stock.get_item_details import get_item_details
 		from frappe import MandatoryError
 
-		frappe.db.sql("delete from `tabPricing Rule`")
+		delete_pricing_rules()
 
 		test_record = {
 			"doctype": "Pricing Rule",
@@ -135,13 +137,13 @@ class TestPricingRule(unittest.TestCase):
 		self.assertEquals(details.get("margin_type"), "Percentage")
 		self.assertEquals(details.get("margin_rate_or_amount"), 10)
 
-		frappe.db.sql("delete from `tabPricing Rule`")
+		delete_pricing_rules()
 
 	def test_pricing_rule_for_variants(self):
 		from erpnext.stock.get_item_details import get_item_details
 		from frappe import MandatoryError
 
-		frappe.db.sql("delete from `tabPricing Rule`")
+		delete_pricing_rules()
 
 		if not frappe.db.exists("Item", "Test Variant PRT"):
 			frappe.get_doc({
@@ -208,7 +210,7 @@ class TestPricingRule(unittest.TestCase):
 		self.assertEquals(details.get("discount_percentage"), 17.5)
 
 	def test_pricing_rule_for_stock_qty(self):
-		frappe.db.sql("delete from `tabPricing Rule`")
+		delete_pricing_rules()
 
 		test_record = {
 			"doctype": "Pricing Rule",
@@ -248,4 +250,37 @@ class TestPricingRule(unittest.TestCase):
 		so.submit()
 		so = frappe.get_doc('Sales Order', so.name)
 		self.assertEquals(so.items[0].discount_percentage, 0)
-		self.assertEquals(so.items[0].rate, 100)
\ No newline at end of file
+		self.assertEquals(so.items[0].rate, 100)
+
+	def test_pricing_rule_index(self):
+		from erpnext.accounts.doctype.pricing_rule.pricing_rule import get_pricing_rule_index
+
+		delete_pricing_rules()
+		self.assertFalse(get_pricing_rule_index("_Test Company", "_Test Price List", "selling")["rules"])
+
+		pricing_rule = frappe.get_doc({
+			"doctype": "Pricing Rule",
+			"title": "_Test Pricing Rule",
+			"apply_on": "Item Group",
+			"item_group": "_Test Item Group",
+			"selling": 1,
+			"price_or_discount": "Discount Percentage",
+			"discount_percentage": 10,
+			"company": "_Test Company"
+		}).insert()
+
+		# index is rebuilt after the rule is inserted
+		index = get_pricing_rule_index("_Test Company", "_Test Price List", "selling")
+		self.assertEquals([d.name for d in index["rules"]], [pricing_rule.name])
+		self.assertEquals(index["item_group"], {"_Test Item Group": [0]})
+		self.assertFalse(get_pricing_rule_index("_Test Company", "_Test Price List", "buying")["rules"])
+
+		pricing_rule.disable = 1
+		pricing_rule.save()
+		self.assertFalse(get_pricing_rule_index("_Test Company", "_Test Price List", "selling")["rules"])
+
+		delete_pricing_rules()
+
+def delete_pricing_rules():
+	frappe.db.sql("delete from `tabPricing Rule`")
+	clear_pricing_rule_index()
@@ -9,6 +9,7 @@ from frappe.core.doctype.communication.email import make
 from erpnext.stock.get_item_details import get_pos_profile
 from erpnext.accounts.party import get_party_account_currency
 from erpnext.controllers.accounts_controller import get_taxes_and_charges
+from erpnext.utilities.tree import get_descendants, get_lft_rgt
 
 @frappe.whitelist()
 def get_pos_data():
@@ -191,9 +192,12 @@ def get_customers_address(customers):
 	return customer_address
 
 def get_child_nodes(group_type, root):
-	lft, rgt = frappe.db.get_value(group_type, root, ["lft", "rgt"])
-	return frappe.db.sql(""" Select name, lft, rgt from `tab{tab}` where
-			lft >= {lft} and rgt <= {rgt} order by lft""".format(tab=group_type, lft=lft, rgt=rgt), as_dict=1)
+	nodes = []
+	for name in get_descendants(group_type, root):
+		lft, rgt = get_lft_rgt(group_type, name)
+		nodes.append(frappe._dict({"name": name, "lft": lft, "rgt": rgt}))
+
+	return nodes
 
 def get_serial_no_data(pos_profile, company):
 	# get itemwise serial no data
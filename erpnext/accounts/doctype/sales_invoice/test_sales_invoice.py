@@ -3,7 +3,7 @@
 from __future__ import unicode_literals
 
 import frappe
-import unittest, copy
+import unittest, copy, json
 from frappe.utils import nowdate, add_days, flt
 from erpnext.stock.doctype.stock_entry.test_stock_entry import make_stock_entry, get_qty_after_transaction
 from erpnext.accounts.doctype.purchase_invoice.test_purchase_invoice import unlink_payment_on_cancel_of_invoice
@@ -202,6 +202,42 @@ class TestSalesInvoice(unittest.TestCase):
 		self.assertEquals(si.net_total, 4298.24)
 		self.assertEquals(si.grand_total, 4900.00)
 
+	def test_sales_invoice_taxes_with_many_items(self):
+		si = create_sales_invoice(qty=1, rate=50, do_not_save=True)
+		for i in xrange(99):
+			si.append("items", {
+				"item_code": "_Test Item",
+				"warehouse": "_Test Warehouse - _TC",
+				"qty": 1,
+				"rate": 50,
+				"income_account": "Sales - _TC",
+				"expense_account": "Cost of Goods Sold - _TC",
+				"cost_center": "_Test Cost Center - _TC"
+			})
+
+		for charge_type, account_head, rate, tax_amount, row_id in (
+			("On Net Total", "_Test Account Service Tax - _TC", 10, 0, None),
+			("Actual", "_Test Account Shipping Charges - _TC", 0, 100, None),
+			("On Previous Row Amount", "_Test Account Education Cess - _TC", 50, 0, 1)):
+				si.append("taxes", {
+					"charge_type": charge_type,
+					"account_head": account_head,
+					"cost_center": "_Test Cost Center - _TC",
+					"description": account_head,
+					"rate": rate,
+					"tax_amount": tax_amount,
+					"row_id": row_id
+				})
+		si.insert()
+
+		self.assertEquals(si.net_total, 5000)
+		self.assertEquals([d.tax_amount for d in si.taxes], [500, 100, 250])
+		self.assertEquals([d.total for d in si.taxes], [5500, 5600, 5850])
+		self.assertEquals(si.grand_total, 5850)
+
+		item_wise_tax_detail = json.loads(si.taxes[1].item_wise_tax_detail)
+		self.assertEquals(flt(item_wise_tax_detail["_Test Item"][1], 2), 100)
+
 	def test_sales_invoice_discount_amount(self):
 		si = frappe.copy_doc(test_records[3])
 		si.discount_amount = 104.95
@@ -6,11 +6,19 @@ import frappe
 from frappe.utils import flt, cstr, cint
 from frappe import _
 from frappe.model.meta import get_field_precision
-from erpnext.accounts.doctype.budget.budget import validate_expense_against_budget
+from erpnext.accounts.doctype.budget.budget import validate_gl_map_against_budget
+from erpnext.utilities.bulk_insert import insert_submitted_docs
+from erpnext.accounts.doctype.party_outstanding_invoice.party_outstanding_invoice import \
+	update_outstanding_invoices
+from erpnext.accounts.doctype.account_balance.account_balance import update_account_balances, \
+	update_account_balances_for_voucher
 
 
 class StockAccountInvalidTransaction(frappe.ValidationError): pass
 
+# outstanding amount of these vouchers is updated when GL Entries are made against them
+outstanding_voucher_types = ('Journal Entry', 'Sales Invoice', 'Purchase Invoice')
+
 def make_gl_entries(gl_map, cancel=False, adv_adj=False, merge_entries=True, update_outstanding='Yes', from_repost=False):
 	if gl_map:
 		if not cancel:
@@ -49,10 +57,12 @@ def process_gl_map(gl_map, merge_entries=True):
 
 def merge_similar_entries(gl_map):
 	merged_gl_map = []
+	merged_entries = {}
 	for entry in gl_map:
 		# if there is already an entry in this account then just add it
 		# to that entry
-		same_head = check_if_in_list(entry, merged_gl_map)
+		key = get_merge_key(entry)
+		same_head = merged_entries.get(key)
 		if same_head:
 			same_head.debit	= flt(same_head.debit) + flt(entry.debit)
 			same_head.debit_in_account_currency	= \
@@ -61,44 +71,114 @@ def merge_similar_entries(gl_map):
 			same_head.credit_in_account_currency = \
 				flt(same_head.credit_in_account_currency) + flt(entry.credit_in_account_currency)
 		else:
+			merged_entries[key] = entry
 			merged_gl_map.append(entry)
 
 	# filter zero debit and credit entries
 	merged_gl_map = filter(lambda x: flt(x.debit, 9)!=0 or flt(x.credit, 9)!=0, merged_gl_map)
 	return merged_gl_map
 
-def check_if_in_list(gle, gl_map):
-	for e in gl_map:
-		if e.account == gle.account \
-			and cstr(e.get('party_type'))==cstr(gle.get('party_type')) \
-			and cstr(e.get('party'))==cstr(gle.get('party')) \
-			and cstr(e.get('against_voucher'))==cstr(gle.get('against_voucher')) \
-			and cstr(e.get('against_voucher_type')) == cstr(gle.get('against_voucher_type')) \
-			and cstr(e.get('cost_center')) == cstr(gle.get('cost_center')) \
-			and cstr(e.get('project')) == cstr(gle.get('project')):
-				return e
+def get_merge_key(gle):
+	"""Entries with the same account, party, against voucher, cost center and project are merged"""
+	return (gle.account, cstr(gle.get('party_type')), cstr(gle.get('party')),
+		cstr(gle.get('against_voucher')), cstr(gle.get('against_voucher_type')),
+		cstr(gle.get('cost_center')), cstr(gle.get('project')))
 
 def save_entries(gl_map, adv_adj, update_outstanding, from_repost=False):
+	from erpnext.accounts.doctype.gl_entry.gl_entry import validate_gl_entries, validate_balance_type, \
+		update_outstanding_amt
+
 	if not from_repost:
 		validate_account_for_auto_accounting_for_stock(gl_map)
-		
+
 	round_off_debit_credit(gl_map)
 
-	for entry in gl_map:
-		make_entry(entry, adv_adj, update_outstanding, from_repost)
-		
-		# check against budget
-		if not from_repost:
-			validate_expense_against_budget(entry)
-
-def make_entry(args, adv_adj, update_outstanding, from_repost=False):
-	args.update({"doctype": "GL Entry"})
-	gle = frappe.get_doc(args)
-	gle.flags.ignore_permissions = 1
-	gle.flags.from_repost = from_repost
-	gle.insert()
-	gle.run_method("on_update_with_args", adv_adj, update_outstanding, from_repost)
-	gle.submit()
+	validate_gl_entries(gl_map, adv_adj, from_repost)
+	insert_submitted_docs("GL Entry", gl_map, "GL.", 7)
+
+	for account in unique([entry.account for entry in gl_map]):
+		validate_balance_type(account, adv_adj)
+
+	# Update outstanding amt on against voucher, once per against voucher
+	if update_outstanding == 'Yes' and not from_repost:
+		for args in unique([(entry.account, entry.get("party_type"), entry.get("party"),
+			entry.against_voucher_type, entry.against_voucher) for entry in gl_map
+			if entry.get("against_voucher_type") in outstanding_voucher_types
+				and entry.get("against_voucher")]):
+				update_outstanding_amt(*args)
+
+	if not from_repost:
+		update_outstanding_invoices(gl_map,
+			outstanding_voucher_types if update_outstanding == 'Yes' else ())
+
+	# actual expense for budget check is read from account balances
+	update_account_balances(gl_map)
+
+	if not from_repost:
+		validate_gl_map_against_budget(gl_map)
+
+def repost_gl_entries(gl_map, existing_gl_entries):
+	"""Update GL Entries of a voucher to `gl_map`, the expected entries, on repost.
+
+	Expected and existing entries are totalled by `get_merge_key`. Existing entries of
+	keys with the same amounts are kept, entries of the other keys are deleted and
+	the expected entries of those keys are inserted. Returns the changed keys."""
+	from erpnext.accounts.doctype.gl_entry.gl_entry import validate_gl_entries, validate_balance_type, \
+		update_outstanding_amt
+
+	gl_map = process_gl_map(gl_map)
+	if gl_map:
+		round_off_debit_credit(gl_map)
+
+	expected_amounts, existing_amounts = get_amounts_by_key(gl_map), get_amounts_by_key(existing_gl_entries)
+	changed_keys = set(key for key in set(expected_amounts.keys() + existing_amounts.keys())
+		if expected_amounts.get(key) != existing_amounts.get(key))
+
+	if not changed_keys:
+		return changed_keys
+
+	to_delete = [d for d in existing_gl_entries if get_merge_key(d) in changed_keys]
+	to_insert = [d for d in gl_map if get_merge_key(d) in changed_keys]
+
+	if to_delete:
+		update_account_balances(to_delete, cancel=True)
+		frappe.db.sql("""delete from `tabGL Entry` where name in ({0})""".format(
+			", ".join(["%s"] * len(to_delete))), tuple(d.name for d in to_delete))
+
+	if to_insert:
+		validate_gl_entries(to_insert, False, from_repost=True)
+		insert_submitted_docs("GL Entry", to_insert, "GL.", 7)
+
+		for account in unique([entry.account for entry in to_insert]):
+			validate_balance_type(account, False)
+
+		update_account_balances(to_insert)
+
+	changed_entries = to_delete + to_insert
+	for args in unique([(entry.account, entry.get("party_type"), entry.get("party"),
+		entry.against_voucher_type, entry.against_voucher) for entry in changed_entries
+		if entry.get("against_voucher_type") in outstanding_voucher_types and entry.get("against_voucher")]):
+			update_outstanding_amt(*args)
+
+	update_outstanding_invoices(changed_entries, outstanding_voucher_types)
+
+	return changed_keys
+
+def get_amounts_by_key(gl_entries):
+	"""Returns dict of merge key: debit and credit (rounded), for comparing entries on repost"""
+	amounts = {}
+	for entry in gl_entries:
+		key = get_merge_key(entry)
+		totals = amounts.setdefault(key, [0.0] * 4)
+		for i, fieldname in enumerate(("debit", "credit", "debit_in_account_currency", "credit_in_account_currency")):
+			totals[i] += flt(entry.get(fieldname))
+
+	return dict((key, tuple(flt(amount, 2) for amount in totals)) for key, totals in amounts.items())
+
+def unique(values):
+	"""Returns unique values in the order of first appearance"""
+	seen = set()
+	return [v for v in values if not (v in seen or seen.add(v))]
 
 def validate_account_for_auto_accounting_for_stock(gl_map):
 	if cint(frappe.db.get_single_value("Accounts Settings", "auto_accounting_for_stock")) \
@@ -173,7 +253,7 @@ def delete_gl_entries(gl_entries=None, voucher_type=None, voucher_no=None,
 
 	if not gl_entries:
 		gl_entries = frappe.db.sql("""
-			select account, posting_date, party_type, party, cost_center, fiscal_year,voucher_type,
+			select account, posting_date, party_type, party, cost_center, project, fiscal_year,voucher_type,
 			voucher_no, against_voucher_type, against_voucher, cost_center, company
 			from `tabGL Entry`
 			where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no), as_dict=True)
@@ -181,14 +261,27 @@ def delete_gl_entries(gl_entries=None, voucher_type=None, voucher_no=None,
 	if gl_entries:
 		check_freezing_date(gl_entries[0]["posting_date"], adv_adj)
 
+	voucher_type = voucher_type or gl_entries[0]["voucher_type"]
+	voucher_no = voucher_no or gl_entries[0]["voucher_no"]
+
+	party_gl_entries = frappe.db.sql("""select party_type, party, account, voucher_type, voucher_no,
+			against_voucher_type, against_voucher
+		from `tabGL Entry` where voucher_type=%s and voucher_no=%s and ifnull(party, '') != ''""",
+		(voucher_type, voucher_no), as_dict=1)
+
+	update_account_balances_for_voucher(voucher_type, voucher_no, cancel=True)
 	frappe.db.sql("""delete from `tabGL Entry` where voucher_type=%s and voucher_no=%s""",
-		(voucher_type or gl_entries[0]["voucher_type"], voucher_no or gl_entries[0]["voucher_no"]))
+		(voucher_type, voucher_no))
 
 	for entry in gl_entries:
 		validate_frozen_account(entry["account"], adv_adj)
 		validate_balance_type(entry["account"], adv_adj)
-		validate_expense_against_budget(entry)
-		
+
 		if entry.get("against_voucher") and update_outstanding == 'Yes':
 			update_outstanding_amt(entry["account"], entry.get("party_type"), entry.get("party"), entry.get("against_voucher_type"),
 				entry.get("against_voucher"), on_cancel=True)
+
+	validate_gl_map_against_budget(gl_entries)
+
+	update_outstanding_invoices(party_gl_entries, [d.against_voucher_type for d in party_gl_entries]
+		if update_outstanding == 'Yes' else ())
@@ -14,6 +14,13 @@ class ReceivablePayableReport(object):
 			if self.filters.report_date > getdate(nowdate()) \
 			else self.filters.report_date
 
+		if not "range1" in self.filters:
+			self.filters["range1"] = "30"
+		if not "range2" in self.filters:
+			self.filters["range2"] = "60"
+		if not "range3" in self.filters:
+			self.filters["range3"] = "90"
+
 	def run(self, args):
 		party_naming_by = frappe.db.get_value(args.get("naming_by")[0], None, args.get("naming_by")[1])
 		columns = self.get_columns(party_naming_by, args)
@@ -45,13 +52,6 @@ class ReceivablePayableReport(object):
 		
 		self.ageing_col_idx_start = len(columns)
 
-		if not "range1" in self.filters:
-			self.filters["range1"] = "30"
-		if not "range2" in self.filters:
-			self.filters["range2"] = "60"
-		if not "range3" in self.filters:
-			self.filters["range3"] = "90"
-			
 		for label in ("0-{range1}".format(range1=self.filters["range1"]),
 			"{range1}-{range2}".format(range1=cint(self.filters["range1"])+ 1, range2=self.filters["range2"]),
 			"{range2}-{range3}".format(range2=cint(self.filters["range2"])+ 1, range3=self.filters["range3"]),
@@ -83,83 +83,122 @@ class ReceivablePayableReport(object):
 		return columns
 
 	def get_data(self, party_naming_by, args):
+		data = []
+		for d in self.get_voucher_rows(party_naming_by, args):
+			row = [d.posting_date, d.party]
+
+			# customer / supplier name
+			if party_naming_by == "Naming Series":
+				row += [d.party_name]
+
+			row += [d.voucher_type, d.voucher_no, d.due_date]
+
+			# get supplier bill details
+			if args.get("party_type") == "Supplier":
+				row += [d.bill_no, d.bill_date]
+
+			row += [d.invoiced_amt, d.paid_amt, d.outstanding_amt,
+				d.age, d.range1, d.range2, d.range3, d.range4, d.currency]
+
+			# customer territory / supplier type
+			if args.get("party_type") == "Customer":
+				row += [d.territory, d.customer_group]
+			if args.get("party_type") == "Supplier":
+				row += [d.supplier_type]
+
+			row.append(d.remarks)
+			data.append(row)
+
+		return data
+
+	def get_voucher_rows(self, party_naming_by, args):
+		"""Yields outstanding vouchers as dicts, used by the summary reports too.
+
+		GL Entries are read once. Entries after the report date and payments
+		against each voucher are collected in one pass, so the outstanding of
+		a voucher is a lookup instead of a scan of its payments."""
 		from erpnext.accounts.utils import get_currency_precision
 		currency_precision = get_currency_precision() or 2
-		dr_or_cr = "debit" if args.get("party_type") == "Customer" else "credit"
+		party_type = args.get("party_type")
+		dr_or_cr = "debit" if party_type == "Customer" else "credit"
+		cr_or_dr = "credit" if party_type == "Customer" else "debit"
+		report_date = self.filters.report_date
 
-		voucher_details = self.get_voucher_details(args.get("party_type"))
-
-		future_vouchers = self.get_entries_after(self.filters.report_date, args.get("party_type"))
+		voucher_details = self.get_voucher_details(party_type)
 
 		if not self.filters.get("company"):
 			self.filters["company"] = frappe.db.get_single_value('Global Defaults', 'default_company')
 
 		company_currency = frappe.db.get_value("Company", self.filters.get("company"), "default_currency")
 
-		data = []
-		for gle in self.get_entries_till(self.filters.report_date, args.get("party_type")):
-			if self.is_receivable_or_payable(gle, dr_or_cr, future_vouchers):
-				outstanding_amount = flt(self.get_outstanding_amount(gle, 
-					self.filters.report_date, dr_or_cr), currency_precision)
-					
-				if abs(outstanding_amount) > 0.1/10**currency_precision:
-					row = [gle.posting_date, gle.party]
-
-					# customer / supplier name
-					if party_naming_by == "Naming Series":
-						row += [self.get_party_name(gle.party_type, gle.party)]
-
-					# get due date
-					due_date = voucher_details.get(gle.voucher_no, {}).get("due_date", "")
-
-					row += [gle.voucher_type, gle.voucher_no, due_date]
-
-					# get supplier bill details
-					if args.get("party_type") == "Supplier":
-						row += [
-							voucher_details.get(gle.voucher_no, {}).get("bill_no", ""),
-							voucher_details.get(gle.voucher_no, {}).get("bill_date", "")
-						]
-
-					# invoiced and paid amounts
-					invoiced_amount = gle.get(dr_or_cr) if (gle.get(dr_or_cr) > 0) else 0
-					paid_amt = invoiced_amount - outstanding_amount
-					row += [invoiced_amount, paid_amt, outstanding_amount]
-
-					# ageing data
-					entry_date = due_date if self.filters.ageing_based_on == "Due Date" else gle.posting_date
-					row += get_ageing_data(cint(self.filters.range1), cint(self.filters.range2),
-						cint(self.filters.range3), self.age_as_on, entry_date, outstanding_amount)
-
-					# issue 6371-Ageing buckets should not have amounts if due date is not reached
-					if self.filters.ageing_based_on == "Due Date" and getdate(due_date) > getdate(self.filters.report_date):
-						row[-1]=row[-2]=row[-3]=row[-4]=0
-
-					if self.filters.get(scrub(args.get("party_type"))):
-						row.append(gle.account_currency)
-					else:
-						row.append(company_currency)
-
-					# customer territory / supplier type
-					if args.get("party_type") == "Customer":
-						row += [self.get_territory(gle.party), self.get_customer_group(gle.party)]
-					if args.get("party_type") == "Supplier":
-						row += [self.get_supplier_type(gle.party)]
-
-					row.append(gle.remarks)
-					data.append(row)
+		gl_entries, future_vouchers, payments = [], set(), {}
+		for gle in self.get_gl_entries(party_type):
+			if getdate(gle.posting_date) > report_date:
+				future_vouchers.add((gle.voucher_type, gle.voucher_no))
+			else:
+				gl_entries.append(gle)
+				if gle.against_voucher_type and gle.against_voucher:
+					key = (gle.party, gle.against_voucher_type, gle.against_voucher)
+					payments[key] = payments.get(key, 0.0) + flt(gle.get(cr_or_dr)) - flt(gle.get(dr_or_cr))
+
+		ranges = [cint(self.filters.range1), cint(self.filters.range2), cint(self.filters.range3)]
+
+		for gle in gl_entries:
+			if not self.is_receivable_or_payable(gle, dr_or_cr, future_vouchers):
+				continue
+
+			payment_amount = payments.get((gle.party, gle.voucher_type, gle.voucher_no), 0.0)
+			if gle.against_voucher_type == gle.voucher_type and gle.against_voucher == gle.voucher_no:
+				# the invoice entry itself is not a payment
+				payment_amount -= flt(gle.get(cr_or_dr)) - flt(gle.get(dr_or_cr))
+
+			outstanding_amount = flt(flt(gle.get(dr_or_cr)) - flt(gle.get(cr_or_dr)) - payment_amount,
+				currency_precision)
+
+			if abs(outstanding_amount) <= 0.1/10**currency_precision:
+				continue
+
+			details = voucher_details.get(gle.voucher_no, {})
+			due_date = details.get("due_date", "")
+
+			# invoiced and paid amounts
+			invoiced_amount = gle.get(dr_or_cr) if (gle.get(dr_or_cr) > 0) else 0
+
+			row = frappe._dict({
+				"posting_date": gle.posting_date,
+				"party": gle.party,
+				"voucher_type": gle.voucher_type,
+				"voucher_no": gle.voucher_no,
+				"due_date": due_date,
+				"invoiced_amt": invoiced_amount,
+				"paid_amt": invoiced_amount - outstanding_amount,
+				"outstanding_amt": outstanding_amount,
+				"currency": gle.account_currency if self.filters.get(scrub(party_type)) else company_currency,
+				"remarks": gle.remarks
+			})
 
-		return data
+			if party_naming_by == "Naming Series":
+				row.party_name = self.get_party_name(gle.party_type, gle.party)
+
+			if party_type == "Supplier":
+				row.bill_no = details.get("bill_no", "")
+				row.bill_date = details.get("bill_date", "")
+				row.supplier_type = self.get_supplier_type(gle.party)
+
+			if party_type == "Customer":
+				row.territory = self.get_territory(gle.party)
+				row.customer_group = self.get_customer_group(gle.party)
+
+			# ageing data
+			entry_date = due_date if self.filters.ageing_based_on == "Due Date" else gle.posting_date
+			row.age, row.range1, row.range2, row.range3, row.range4 = get_ageing_data(ranges[0], ranges[1],
+				ranges[2], self.age_as_on, entry_date, outstanding_amount)
 
-	def get_entries_after(self, report_date, party_type):
-		# returns a distinct list
-		return list(set([(e.voucher_type, e.voucher_no) for e in self.get_gl_entries(party_type)
-			if getdate(e.posting_date) > report_date]))
+			# issue 6371-Ageing buckets should not have amounts if due date is not reached
+			if self.filters.ageing_based_on == "Due Date" and getdate(due_date) > report_date:
+				row.range1 = row.range2 = row.range3 = row.range4 = 0
 
-	def get_entries_till(self, report_date, party_type):
-		# returns a generator
-		return (e for e in self.get_gl_entries(party_type)
-			if getdate(e.posting_date) <= report_date)
+			yield row
 
 	def is_receivable_or_payable(self, gle, dr_or_cr, future_vouchers):
 		return (
@@ -176,14 +215,6 @@ class ReceivablePayableReport(object):
 			((gle.against_voucher_type, gle.against_voucher) in future_vouchers)
 		)
 
-	def get_outstanding_amount(self, gle, report_date, dr_or_cr):
-		payment_amount = 0.0
-		for e in self.get_gl_entries_for(gle.party, gle.party_type, gle.voucher_type, gle.voucher_no):
-			if getdate(e.posting_date) <= report_date and e.name!=gle.name:
-				payment_amount += (flt(e.credit if gle.party_type == "Customer" else e.debit) - flt(e.get(dr_or_cr)))
-
-		return flt(gle.get(dr_or_cr)) - flt(gle.credit if gle.party_type == "Customer" else gle.debit) - payment_amount
-
 	def get_party_name(self, party_type, party_name):
 		return self.get_party_map(party_type).get(party_name, {}).get("customer_name" if party_type == "Customer" else "supplier_name") or ""
 
@@ -272,20 +303,6 @@ class ReceivablePayableReport(object):
 
 		return " and ".join(conditions), values
 
-	def get_gl_entries_for(self, party, party_type, against_voucher_type, against_voucher):
-		if not hasattr(self, "gl_entries_map"):
-			self.gl_entries_map = {}
-			for gle in self.get_gl_entries(party_type):
-				if gle.against_voucher_type and gle.against_voucher:
-					self.gl_entries_map.setdefault(gle.party, {})\
-						.setdefault(gle.against_voucher_type, {})\
-						.setdefault(gle.against_voucher, [])\
-						.append(gle)
-
-		return self.gl_entries_map.get(party, {})\
-			.get(against_voucher_type, {})\
-			.get(against_voucher, [])
-			
 	def get_chart_data(self, columns, data):
 		ageing_columns = columns[self.ageing_col_idx_start : self.ageing_col_idx_start+4]
 		
@@ -72,7 +72,7 @@ class AccountsReceivableSummary(ReceivablePayableReport):
 
 	def get_partywise_total(self, party_naming_by, args):
 		party_total = frappe._dict()
-		for d in self.get_voucherwise_data(party_naming_by, args):
+		for d in self.get_voucher_rows(party_naming_by, args):
 			party_total.setdefault(d.party,
 				frappe._dict({
 					"invoiced_amt": 0,
@@ -91,36 +91,6 @@ class AccountsReceivableSummary(ReceivablePayableReport):
 
 		return party_total
 
-	def get_voucherwise_data(self, party_naming_by, args):
-		voucherwise_data = ReceivablePayableReport(self.filters).run(args)[1]
-
-		cols = ["posting_date", "party"]
-
-		if party_naming_by == "Naming Series":
-			cols += ["party_name"]
-
-		cols += ["voucher_type", "voucher_no", "due_date"]
-
-		if args.get("party_type") == "Supplier":
-			cols += ["bill_no", "bill_date"]
-
-		cols += ["invoiced_amt", "paid_amt",
-		"outstanding_amt", "age", "range1", "range2", "range3", "range4", "currency"]
-
-		if args.get("party_type") == "Supplier":
-			cols += ["supplier_type", "remarks"]
-		if args.get("party_type") == "Customer":
-			cols += ["territory", "customer_group", "remarks"]
-
-		return self.make_data_dict(cols, voucherwise_data)
-
-	def make_data_dict(self, cols, data):
-		data_dict = []
-		for d in data:
-			data_dict.append(frappe._dict(zip(cols, d)))
-
-		return data_dict
-
 def execute(filters=None):
 	args = {
 		"party_type": "Customer",
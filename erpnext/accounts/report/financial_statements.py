@@ -4,10 +4,14 @@
 from __future__ import unicode_literals
 import frappe
 import re
+from array import array
+from bisect import bisect_left
 from frappe import _
 from frappe.utils import (flt, getdate, get_first_day, get_last_day, date_diff,
 	add_months, add_days, formatdate, cint)
 from erpnext.accounts.utils import get_fiscal_year
+from erpnext.accounts.doctype.account_balance.account_balance import (split_date_range,
+	get_period_end_conditions)
 
 
 def get_period_list(from_fiscal_year, to_fiscal_year, periodicity, accumulated_values=False, 
@@ -130,7 +134,8 @@ def get_data(company, root_type, balance_must_be, period_list, filters=None,
 			period_list[0]["year_start_date"] if only_current_fiscal_year else None,
 			period_list[-1]["to_date"], 
 			root.lft, root.rgt, filters,
-			gl_entries_by_account, ignore_closing_entries=ignore_closing_entries)
+			gl_entries_by_account, ignore_closing_entries=ignore_closing_entries,
+			period_list=period_list)
 
 	calculate_values(accounts_by_name, gl_entries_by_account, period_list, accumulated_values, ignore_accumulated_values_for_fy)
 	accumulate_values_into_parents(accounts, accounts_by_name, period_list, accumulated_values)
@@ -143,31 +148,84 @@ def get_data(company, root_type, balance_must_be, period_list, filters=None,
 	return out
 
 def calculate_values(accounts_by_name, gl_entries_by_account, period_list, accumulated_values, ignore_accumulated_values_for_fy):
-	for entries in gl_entries_by_account.values():
+	"""Set `period_values` of accounts, an array of values per period followed by the opening balance.
+
+	The first period of an entry is found by binary search on the period end dates.
+	An entry adds its amount to a range of periods, which is recorded as a change at
+	the start and end of the range, and values are the running sum of the changes."""
+	period_count = len(period_list)
+	from_dates = [getdate(period.from_date) for period in period_list]
+	to_dates = [getdate(period.to_date) for period in period_list]
+	year_start_date = getdate(period_list[0].year_start_date)
+
+	# first and last period of each fiscal year
+	fiscal_year_periods = {}
+	for i, period in enumerate(period_list):
+		fiscal_year_periods[period.to_date_fiscal_year] = \
+			(fiscal_year_periods.get(period.to_date_fiscal_year, (i, i))[0], i)
+
+	for account, entries in gl_entries_by_account.items():
+		changes = array("d", [0.0] * (period_count + 1))
+		opening_balance = 0.0
+
 		for entry in entries:
-			d = accounts_by_name.get(entry.account)
-			for period in period_list:
-				# check if posting date is within the period
+			posting_date = entry["posting_date"]
+			amount = flt(entry["debit"]) - flt(entry["credit"])
+
+			if posting_date < year_start_date:
+				opening_balance += amount
+
+			# first period ending on or after the posting date
+			start = bisect_left(to_dates, posting_date)
+			if start == period_count:
+				continue
+
+			if accumulated_values:
+				end = period_count - 1
+			elif posting_date >= from_dates[start]:
+				end = start
+			else:
+				continue
+
+			if ignore_accumulated_values_for_fy:
+				if entry["fiscal_year"] not in fiscal_year_periods:
+					continue
+				fy_start, fy_end = fiscal_year_periods[entry["fiscal_year"]]
+				start, end = max(start, fy_start), min(end, fy_end)
+				if start > end:
+					continue
+
+			changes[start] += amount
+			changes[end + 1] -= amount
 
-				if entry.posting_date <= period.to_date:
-					if (accumulated_values or entry.posting_date >= period.from_date) and \
-						(not ignore_accumulated_values_for_fy or 
-							entry.fiscal_year == period.to_date_fiscal_year):
-						d[period.key] = d.get(period.key, 0.0) + flt(entry.debit) - flt(entry.credit)
+		values = array("d", [0.0] * (period_count + 1))
+		value = 0.0
+		for i in xrange(period_count):
+			value += changes[i]
+			values[i] = value
+		values[period_count] = opening_balance
+
+		accounts_by_name.get(account)["period_values"] = values
 
-			if entry.posting_date < period_list[0].year_start_date:
-				d["opening_balance"] = d.get("opening_balance", 0.0) + flt(entry.debit) - flt(entry.credit)
-				
 def accumulate_values_into_parents(accounts, accounts_by_name, period_list, accumulated_values):
 	"""accumulate children's values in parent accounts"""
 	for d in reversed(accounts):
-		if d.parent_account:
-			for period in period_list:
-				accounts_by_name[d.parent_account][period.key] = \
-					accounts_by_name[d.parent_account].get(period.key, 0.0) + d.get(period.key, 0.0)
-			
-			accounts_by_name[d.parent_account]["opening_balance"] = \
-				accounts_by_name[d.parent_account].get("opening_balance", 0.0) + d.get("opening_balance", 0.0)
+		values = d.get("period_values")
+		if values and d.parent_account:
+			parent = accounts_by_name[d.parent_account]
+			if parent.get("period_values"):
+				parent_values = parent["period_values"]
+				for i in xrange(len(values)):
+					parent_values[i] += values[i]
+			else:
+				parent["period_values"] = array("d", values)
+
+	for d in accounts:
+		values = d.pop("period_values", None)
+		if values:
+			for i, period in enumerate(period_list):
+				d[period.key] = values[i]
+			d["opening_balance"] = values[-1]
 
 def prepare_data(accounts, balance_must_be, period_list, company_currency):
 	data = []
@@ -294,37 +352,95 @@ def sort_root_accounts(roots):
 	roots.sort(compare_roots)
 
 def set_gl_entries_by_account(company, from_date, to_date, root_lft, root_rgt, filters, gl_entries_by_account,
-		ignore_closing_entries=False):
-	"""Returns a dict like { "account": [gl entries], ... }"""
-
-	additional_conditions = get_additional_conditions(from_date, ignore_closing_entries, filters)
-
-	gl_entries = frappe.db.sql("""select posting_date, account, debit, credit, is_opening, fiscal_year from `tabGL Entry`
-		where company=%(company)s
-		{additional_conditions}
-		and posting_date <= %(to_date)s
-		and account in (select name from `tabAccount`
-			where lft >= %(lft)s and rgt <= %(rgt)s)
-		order by account, posting_date""".format(additional_conditions=additional_conditions),
-		{
-			"company": company,
-			"from_date": from_date,
-			"to_date": to_date,
-			"lft": root_lft,
-			"rgt": root_rgt
-		},
-		as_dict=True)
-
-	for entry in gl_entries:
+		ignore_closing_entries=False, period_list=None):
+	"""Returns a dict like { "account": [gl entries], ... }
+
+	Whole months are read from Account Balance, as one entry per account, fiscal year
+	and opening flag dated on the last day of the month. Days of months that are split
+	by the dates or by a period in `period_list` are read from GL Entry."""
+	values = {
+		"company": company,
+		"lft": root_lft,
+		"rgt": root_rgt
+	}
+
+	balance_ranges, gl_date_ranges = [], []
+	for segment_from_date, segment_to_date in get_date_segments(from_date, to_date, period_list):
+		months, date_ranges = split_date_range(segment_from_date, segment_to_date)
+		if months:
+			balance_ranges.append(" and ".join(get_period_end_conditions(*months)))
+		gl_date_ranges += date_ranges
+
+	gl_entries = []
+	if balance_ranges:
+		additional_conditions = get_additional_conditions(None, ignore_closing_entries, filters,
+			from_balances=True)
+
+		gl_entries += frappe.db.sql("""select gle.period_end as posting_date, gle.account,
+				sum(gle.debit) as debit, sum(gle.credit) as credit, gle.is_opening, gle.fiscal_year
+			from `tabAccount Balance` gle
+			where gle.company=%(company)s
+			{additional_conditions}
+			and ({balance_ranges})
+			and gle.account in (select name from `tabAccount`
+				where lft >= %(lft)s and rgt <= %(rgt)s)
+			group by gle.account, gle.period_end, gle.is_opening, gle.fiscal_year""".format(
+				additional_conditions=additional_conditions,
+				balance_ranges=" or ".join("({0})".format(d) for d in balance_ranges)),
+			values, as_dict=True)
+
+	if gl_date_ranges:
+		additional_conditions = get_additional_conditions(None, ignore_closing_entries, filters)
+
+		gl_entries += frappe.db.sql("""select posting_date, account, debit, credit, is_opening, fiscal_year from `tabGL Entry`
+			where company=%(company)s
+			{additional_conditions}
+			and ({date_ranges})
+			and account in (select name from `tabAccount`
+				where lft >= %(lft)s and rgt <= %(rgt)s)""".format(additional_conditions=additional_conditions,
+				date_ranges=" or ".join(get_date_range_condition(d) for d in gl_date_ranges)),
+			values, as_dict=True)
+
+	for entry in sorted(gl_entries, key=lambda d: (d.account, d.posting_date)):
 		gl_entries_by_account.setdefault(entry.account, []).append(entry)
 
 	return gl_entries_by_account
 
-def get_additional_conditions(from_date, ignore_closing_entries, filters):
+def get_date_segments(from_date, to_date, period_list=None):
+	"""Splits the dates at the start and end of each period, so that a month
+	read from Account Balance is within a single period"""
+	to_date = getdate(to_date)
+	from_date = getdate(from_date) if from_date else None
+
+	split_dates = set()
+	for period in period_list or []:
+		for date in (period.from_date, add_days(period.to_date, 1), period.year_start_date):
+			date = getdate(date)
+			if (not from_date or date > from_date) and date <= to_date:
+				split_dates.add(date)
+
+	segments = []
+	for date in sorted(split_dates):
+		segments.append((from_date, add_days(date, -1)))
+		from_date = date
+	segments.append((from_date, to_date))
+
+	return segments
+
+def get_date_range_condition(date_range):
+	from_date, to_date = date_range
+	if from_date:
+		return "(posting_date between '{0}' and '{1}')".format(from_date, to_date)
+	return "(posting_date <= '{0}')".format(to_date)
+
+def get_additional_conditions(from_date, ignore_closing_entries, filters, from_balances=False):
 	additional_conditions = []
 
 	if ignore_closing_entries:
-		additional_conditions.append("ifnull(voucher_type, '')!='Period Closing Voucher'")
+		if from_balances:
+			additional_conditions.append("is_period_closing=0")
+		else:
+			additional_conditions.append("ifnull(voucher_type, '')!='Period Closing Voucher'")
 
 	if from_date:
 		additional_conditions.append("posting_date >= %(from_date)s")
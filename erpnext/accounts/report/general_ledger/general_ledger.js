@@ -106,5 +106,21 @@ frappe.query_reports["General Ledger"] = {
 			"label": __("Group by Account"),
 			"fieldtype": "Check",
 		}
-	]
+	],
+	"onload": function(report) {
+		report.page.add_inner_button(__("Export Full Ledger"), function() {
+			frappe.call({
+				method: "erpnext.accounts.report.general_ledger.general_ledger.export_ledger",
+				args: {
+					filters: report.get_values()
+				},
+				freeze: true,
+				callback: function(r) {
+					if(r.message) {
+						window.open(r.message);
+					}
+				}
+			});
+		});
+	}
 }
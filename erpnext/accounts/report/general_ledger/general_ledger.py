@@ -2,27 +2,34 @@
 # License: GNU General Public License v3. See license.txt
 
 from __future__ import unicode_literals
-import frappe
-from frappe.utils import flt, getdate, cstr
+import frappe, json, csv, hashlib
+from frappe.utils import flt, cint, cstr, now_datetime
 from frappe import _
 from erpnext.accounts.utils import get_account_currency
 
+# GL Entries read per query, pages are read by keyset on the sort order
+PAGE_LENGTH = 1000
+
 def execute(filters=None):
-	account_details = {}
-	for acc in frappe.db.sql("""select name, is_group from tabAccount""", as_dict=1):
-		account_details.setdefault(acc.name, acc)
+	validate(filters)
 
-	validate_filters(filters, account_details)
+	columns = get_columns(filters)
 
-	validate_party(filters)
+	res = get_result(filters)
 
-	filters = set_account_currency(filters)
+	return columns, res
 
-	columns = get_columns(filters)
+def validate(filters):
+	account_details = {}
+	if filters.get("account"):
+		account_details[filters.account] = frappe.db.get_value("Account", filters.account,
+			["name", "is_group"], as_dict=1)
+
+	validate_filters(filters, account_details)
 
-	res = get_result(filters, account_details)
+	validate_party(filters)
 
-	return columns, res
+	set_account_currency(filters)
 
 def validate_filters(filters, account_details):
 	if not filters.get('company'):
@@ -79,13 +86,14 @@ def set_account_currency(filters):
 def get_columns(filters):
 	columns = [
 		_("Posting Date") + ":Date:90", _("Account") + ":Link/Account:200",
-		_("Debit") + ":Float:100", _("Credit") + ":Float:100"
+		_("Debit") + ":Float:100", _("Credit") + ":Float:100", _("Balance") + ":Float:100"
 	]
 
 	if filters.get("show_in_account_currency"):
 		columns += [
 			_("Debit") + " (" + filters.account_currency + ")" + ":Float:100",
-			_("Credit") + " (" + filters.account_currency + ")" + ":Float:100"
+			_("Credit") + " (" + filters.account_currency + ")" + ":Float:100",
+			_("Balance") + " (" + filters.account_currency + ")" + ":Float:100"
 		]
 
 	columns += [
@@ -98,38 +106,216 @@ def get_columns(filters):
 
 	return columns
 
-def get_result(filters, account_details):
-	gl_entries = get_gl_entries(filters)
+def get_result(filters):
+	return [get_row_as_list(d, filters) for d in GeneralLedger(filters).get_rows()]
+
+class GeneralLedger(object):
+	"""Builds the ledger rows from GL Entries read a page at a time.
+
+	Opening balances are read with an aggregate query. The running balance, totals
+	and the position in the ledger are kept in `state`, so the rows can be resumed
+	after any entry from a cursor, see `get_ledger_page`."""
+	def __init__(self, filters, cursor=None):
+		self.filters = filters
+		self.state = frappe._dict(cursor or {})
+
+		# opening, totals and closing of the filtered account / party
+		self.show_balance = filters.get("account") or filters.get("party")
+		self.show_in_account_currency = filters.get("show_in_account_currency")
+		self.group_by_account = filters.get("group_by_account")
+
+		# True when the last row returned is an entry, rows can be resumed from there
+		self.resumable = False
+
+	def get_rows(self):
+		state = self.state
+		openings = self.get_openings() if (self.show_balance or self.group_by_account) else {}
+
+		if not state.after:
+			opening, opening_in_account_currency = [sum(d[i] for d in openings.values()) for i in (0, 1)]
+			state.update({
+				"balance": opening if self.show_balance else 0.0,
+				"balance_in_account_currency": opening_in_account_currency if self.show_balance else 0.0,
+				"totals": [0.0] * 4
+			})
+
+			if self.show_balance:
+				yield get_balance_row(_("Opening"), opening,
+					opening_in_account_currency if self.show_in_account_currency else None)
+				yield {}
+
+		for gle in iter_gl_entries(self.filters, state.after):
+			if self.group_by_account and gle.account != state.account:
+				for row in self.get_account_closing_rows():
+					yield row
+
+				self.set_account(gle.account, openings.get(gle.account, (0.0, 0.0)))
+				yield get_balance_row(_("Opening"), state.account_balance,
+					state.account_balance_in_account_currency if self.show_in_account_currency else None)
+
+			self.add_entry(gle)
+			state.after = [cstr(gle.get(key)) for key in get_keyset_fields(self.filters)]
+
+			# opening entries are only counted in totals, if not shown as opening
+			if self.show_balance or self.group_by_account or cstr(gle.is_opening) == "No":
+				self.resumable = True
+				yield gle
+				self.resumable = False
+
+		for row in self.get_account_closing_rows():
+			yield row
+
+		# Total debit and credit between from and to date
+		total_debit, total_credit, total_debit_in_account_currency, total_credit_in_account_currency = state.totals
+		if total_debit or total_credit:
+			yield {
+				"account": "'" + _("Totals") + "'",
+				"debit": total_debit,
+				"credit": total_credit,
+				"debit_in_account_currency": total_debit_in_account_currency,
+				"credit_in_account_currency": total_credit_in_account_currency
+			}
+
+		# Closing for filtered account
+		if self.show_balance:
+			yield get_balance_row(_("Closing (Opening + Totals)"), state.balance,
+				state.balance_in_account_currency if self.show_in_account_currency else None)
+
+	def add_entry(self, gle):
+		state = self.state
+		debit, credit = flt(gle.debit, 3), flt(gle.credit, 3)
+		debit_in_account_currency = flt(gle.debit_in_account_currency, 3)
+		credit_in_account_currency = flt(gle.credit_in_account_currency, 3)
+
+		for totals in filter(None, [state.totals, state.account_totals]):
+			totals[0] += debit
+			totals[1] += credit
+			if self.show_in_account_currency:
+				totals[2] += debit_in_account_currency
+				totals[3] += credit_in_account_currency
+
+		if self.group_by_account:
+			state.account_balance += debit - credit
+			state.account_balance_in_account_currency += debit_in_account_currency - credit_in_account_currency
+			gle.balance = state.account_balance
+			gle.balance_in_account_currency = state.account_balance_in_account_currency
+
+		state.balance += debit - credit
+		state.balance_in_account_currency += debit_in_account_currency - credit_in_account_currency
+		if not self.group_by_account:
+			gle.balance = state.balance
+			gle.balance_in_account_currency = state.balance_in_account_currency
+
+	def set_account(self, account, opening):
+		self.state.update({
+			"account": account,
+			"account_balance": opening[0],
+			"account_balance_in_account_currency": opening[1],
+			"account_totals": [0.0] * 4
+		})
+
+	def get_account_closing_rows(self):
+		"""Totals and closing for individual ledger, if grouped by account"""
+		state = self.state
+		if not (self.group_by_account and state.account):
+			return []
+
+		return [{"account": "'" + _("Totals") + "'", "debit": state.account_totals[0],
+				"credit": state.account_totals[1]},
+			get_balance_row(_("Closing (Opening + Totals)"), state.account_balance,
+				state.account_balance_in_account_currency if self.show_in_account_currency else None), {}]
+
+	def get_openings(self):
+		"""Returns opening balance and balance in account currency per account: entries
+		before the from date and opening entries"""
+		return dict((d[0], (flt(d[1], 3), flt(d[2], 3))) for d in frappe.db.sql("""
+			select account, sum(debit) - sum(credit),
+				sum(debit_in_account_currency) - sum(credit_in_account_currency)
+			from `tabGL Entry`
+			where company=%(company)s {conditions}
+				and (posting_date < %(from_date)s or ifnull(is_opening, 'No') = 'Yes')
+			group by account""".format(conditions=get_conditions(self.filters)), self.filters))
+
+def get_keyset_fields(filters):
+	"""Sort order of GL Entries, also the keyset for reading the next page"""
+	if filters.get("group_by_account"):
+		return ["account", "posting_date", "name"]
+	return ["posting_date", "name"]
 
-	data = get_data_with_opening_closing(filters, account_details, gl_entries)
+def iter_gl_entries(filters, after=None, page_length=PAGE_LENGTH):
+	"""Yields GL Entries between the dates a page at a time, after the keyset values `after`"""
+	while True:
+		gl_entries = get_gl_entries(filters, after, page_length)
+		for gle in gl_entries:
+			yield gle
 
-	result = get_result_as_list(data, filters)
+		if len(gl_entries) < page_length:
+			break
 
-	return result
+		after = [gl_entries[-1].get(key) for key in get_keyset_fields(filters)]
 
-def get_gl_entries(filters):
+def get_gl_entries(filters, after=None, page_length=PAGE_LENGTH):
 	select_fields = """, sum(debit_in_account_currency) as debit_in_account_currency,
 		sum(credit_in_account_currency) as credit_in_account_currency""" \
 		if filters.get("show_in_account_currency") else ""
 
-	group_by_condition = "group by voucher_type, voucher_no, account, cost_center" \
-		if filters.get("group_by_voucher") else "group by name"
+	if filters.get("group_by_voucher"):
+		group_by_condition = "group by voucher_type, voucher_no, account, cost_center"
+		name_field = "min(name)"
+	else:
+		group_by_condition = "group by name"
+		name_field = "name"
+
+	conditions = [get_conditions(filters)]
+
+	# opening entries are shown in the opening balance of the account / party
+	if filters.get("account") or filters.get("party") or filters.get("group_by_account"):
+		conditions.append("and ifnull(is_opening, 'No') != 'Yes'")
+
+	keyset_fields = get_keyset_fields(filters)
+	having_condition = ""
+	values = dict(filters)
 
-	gl_entries = frappe.db.sql("""
+	if after:
+		values.update(dict(("after_" + key, value) for key, value in zip(keyset_fields, after)))
+		if filters.get("group_by_voucher"):
+			# rows of a voucher have the same first keyset value
+			conditions.append("and {0} >= %(after_{0})s".format(keyset_fields[0]))
+			having_condition = "having " + get_keyset_condition(keyset_fields, {"name": name_field})
+		else:
+			conditions.append("and " + get_keyset_condition(keyset_fields))
+
+	return frappe.db.sql("""
 		select
-			posting_date, account, party_type, party,
+			{name_field} as name, posting_date, account, party_type, party,
 			sum(debit) as debit, sum(credit) as credit,
 			voucher_type, voucher_no, cost_center, project,
 			against_voucher_type, against_voucher,
 			remarks, against, is_opening {select_fields}
 		from `tabGL Entry`
-		where company=%(company)s {conditions}
+		where company=%(company)s
+			and posting_date between %(from_date)s and %(to_date)s
+			{conditions}
 		{group_by_condition}
-		order by posting_date, account"""\
-		.format(select_fields=select_fields, conditions=get_conditions(filters),
-			group_by_condition=group_by_condition), filters, as_dict=1)
+		{having_condition}
+		order by {order_by}
+		limit {page_length}"""\
+		.format(name_field=name_field, select_fields=select_fields, conditions=" ".join(conditions),
+			group_by_condition=group_by_condition, having_condition=having_condition,
+			order_by=", ".join(name_field if key=="name" else key for key in keyset_fields),
+			page_length=cint(page_length)), values, as_dict=1)
+
+def get_keyset_condition(fields, expressions=None):
+	"""Returns condition for rows after the keyset values `%(after_<field>)s`,
+	(a, b) > (x, y) written out as a > x or (a = x and b > y)"""
+	expressions = expressions or {}
+	conditions = []
+	for i, fieldname in enumerate(fields):
+		condition = ["{0}=%(after_{1})s".format(expressions.get(f, f), f) for f in fields[:i]]
+		condition.append("{0}>%(after_{1})s".format(expressions.get(fieldname, fieldname), fieldname))
+		conditions.append("({0})".format(" and ".join(condition)))
 
-	return gl_entries
+	return "({0})".format(" or ".join(conditions))
 
 def get_conditions(filters):
 	conditions = []
@@ -147,9 +333,6 @@ def get_conditions(filters):
 	if filters.get("party"):
 		conditions.append("party=%(party)s")
 
-	if not (filters.get("account") or filters.get("party") or filters.get("group_by_account")):
-		conditions.append("posting_date >=%(from_date)s")
-
 	if filters.get("project"):
 		conditions.append("project=%(project)s")
 
@@ -159,119 +342,6 @@ def get_conditions(filters):
 
 	return "and {}".format(" and ".join(conditions)) if conditions else ""
 
-def get_data_with_opening_closing(filters, account_details, gl_entries):
-	data = []
-	gle_map = initialize_gle_map(gl_entries)
-
-	opening, total_debit, total_credit, opening_in_account_currency, total_debit_in_account_currency, \
-		total_credit_in_account_currency, gle_map = get_accountwise_gle(filters, gl_entries, gle_map)
-
-	# Opening for filtered account
-	if filters.get("account") or filters.get("party"):
-		data += [get_balance_row(_("Opening"), opening, opening_in_account_currency), {}]
-
-	if filters.get("group_by_account"):
-		for acc, acc_dict in gle_map.items():
-			if acc_dict.entries:
-				# Opening for individual ledger, if grouped by account
-				data.append(get_balance_row(_("Opening"), acc_dict.opening,
-					acc_dict.opening_in_account_currency))
-
-				data += acc_dict.entries
-
-				# Totals and closing for individual ledger, if grouped by account
-				account_closing = acc_dict.opening + acc_dict.total_debit - acc_dict.total_credit
-				account_closing_in_account_currency = acc_dict.opening_in_account_currency \
-					+ acc_dict.total_debit_in_account_currency - acc_dict.total_credit_in_account_currency
-
-				data += [{"account": "'" + _("Totals") + "'", "debit": acc_dict.total_debit,
-					"credit": acc_dict.total_credit},
-					get_balance_row(_("Closing (Opening + Totals)"),
-						account_closing, account_closing_in_account_currency), {}]
-
-	else:
-		for gl in gl_entries:
-			if gl.posting_date >= getdate(filters.from_date) and gl.posting_date <= getdate(filters.to_date) \
-					and gl.is_opening == "No":
-				data.append(gl)
-
-
-	# Total debit and credit between from and to date
-	if total_debit or total_credit:
-		data.append({
-			"account": "'" + _("Totals") + "'",
-			"debit": total_debit,
-			"credit": total_credit,
-			"debit_in_account_currency": total_debit_in_account_currency,
-			"credit_in_account_currency": total_credit_in_account_currency
-		})
-
-	# Closing for filtered account
-	if filters.get("account") or filters.get("party"):
-		closing = opening + total_debit - total_credit
-		closing_in_account_currency = opening_in_account_currency + \
-			total_debit_in_account_currency - total_credit_in_account_currency
-
-		data.append(get_balance_row(_("Closing (Opening + Totals)"),
-			closing, closing_in_account_currency))
-
-	return data
-
-def initialize_gle_map(gl_entries):
-	gle_map = frappe._dict()
-	for gle in gl_entries:
-		gle_map.setdefault(gle.account, frappe._dict({
-			"opening": 0,
-			"opening_in_account_currency": 0,
-			"entries": [],
-			"total_debit": 0,
-			"total_debit_in_account_currency": 0,
-			"total_credit": 0,
-			"total_credit_in_account_currency": 0,
-			"closing": 0,
-			"closing_in_account_currency": 0
-		}))
-	return gle_map
-
-def get_accountwise_gle(filters, gl_entries, gle_map):
-	opening, total_debit, total_credit = 0, 0, 0
-	opening_in_account_currency, total_debit_in_account_currency, total_credit_in_account_currency = 0, 0, 0
-
-	from_date, to_date = getdate(filters.from_date), getdate(filters.to_date)
-	for gle in gl_entries:
-		amount = flt(gle.debit, 3) - flt(gle.credit, 3)
-		amount_in_account_currency = flt(gle.debit_in_account_currency, 3) - flt(gle.credit_in_account_currency, 3)
-
-		if (filters.get("account") or filters.get("party") or filters.get("group_by_account")) \
-				and (gle.posting_date < from_date or cstr(gle.is_opening) == "Yes"):
-
-			gle_map[gle.account].opening += amount
-			if filters.get("show_in_account_currency"):
-				gle_map[gle.account].opening_in_account_currency += amount_in_account_currency
-
-			if filters.get("account") or filters.get("party"):
-				opening += amount
-				if filters.get("show_in_account_currency"):
-					opening_in_account_currency += amount_in_account_currency
-
-		elif gle.posting_date <= to_date:
-			gle_map[gle.account].entries.append(gle)
-			gle_map[gle.account].total_debit += flt(gle.debit, 3)
-			gle_map[gle.account].total_credit += flt(gle.credit, 3)
-
-			total_debit += flt(gle.debit, 3)
-			total_credit += flt(gle.credit, 3)
-
-			if filters.get("show_in_account_currency"):
-				gle_map[gle.account].total_debit_in_account_currency += flt(gle.debit_in_account_currency, 3)
-				gle_map[gle.account].total_credit_in_account_currency += flt(gle.credit_in_account_currency, 3)
-
-				total_debit_in_account_currency += flt(gle.debit_in_account_currency, 3)
-				total_credit_in_account_currency += flt(gle.credit_in_account_currency, 3)
-
-	return opening, total_debit, total_credit, opening_in_account_currency, \
-		total_debit_in_account_currency, total_credit_in_account_currency, gle_map
-
 def get_balance_row(label, balance, balance_in_account_currency=None):
 	balance_row = {
 		"account": "'" + label + "'",
@@ -287,18 +357,75 @@ def get_balance_row(label, balance, balance_in_account_currency=None):
 
 	return balance_row
 
-def get_result_as_list(data, filters):
+def get_row_as_list(d, filters):
+	row = [d.get("posting_date"), d.get("account"), d.get("debit"), d.get("credit"), d.get("balance")]
+
+	if filters.get("show_in_account_currency"):
+		row += [d.get("debit_in_account_currency"), d.get("credit_in_account_currency"),
+			d.get("balance_in_account_currency")]
+
+	row += [d.get("voucher_type"), d.get("voucher_no"), d.get("against"),
+		d.get("party_type"), d.get("party"), d.get("project"), d.get("cost_center"), d.get("against_voucher_type"), d.get("against_voucher"), d.get("remarks")
+	]
+
+	return row
+
+@frappe.whitelist()
+def get_ledger_page(filters, cursor=None, page_length=500):
+	"""Returns the next page of ledger rows after `cursor` and the cursor of the page.
+	Running balance and totals are carried in the cursor, cursor is None on the last page."""
+	filters = get_filters(filters)
+	cursor = json.loads(cursor) if isinstance(cursor, basestring) else cursor
+
+	ledger = GeneralLedger(filters, cursor)
 	result = []
-	for d in data:
-		row = [d.get("posting_date"), d.get("account"), d.get("debit"), d.get("credit")]
+	for row in ledger.get_rows():
+		result.append(get_row_as_list(row, filters))
+		if len(result) >= cint(page_length) and ledger.resumable:
+			return {"result": result, "cursor": ledger.state}
 
-		if filters.get("show_in_account_currency"):
-			row += [d.get("debit_in_account_currency"), d.get("credit_in_account_currency")]
+	return {"result": result, "cursor": None}
 
-		row += [d.get("voucher_type"), d.get("voucher_no"), d.get("against"),
-			d.get("party_type"), d.get("party"), d.get("project"), d.get("cost_center"), d.get("against_voucher_type"), d.get("against_voucher"), d.get("remarks")
-		]
+@frappe.whitelist()
+def export_ledger(filters):
+	"""Writes the ledger to a private CSV file a page at a time and returns its url"""
+	filters = get_filters(filters)
+	columns = get_columns(filters)
+
+	file_name = "general-ledger-{0}-{1}.csv".format(now_datetime().strftime("%Y%m%d%H%M%S"),
+		frappe.generate_hash(length=6))
+	content_hash = hashlib.md5()
+
+	with open(frappe.get_site_path("private", "files", file_name), "wb") as f:
+		writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+		writer.writerow([cstr(c.split(":")[0]).encode("utf-8") for c in columns])
+
+		for d in GeneralLedger(filters).get_rows():
+			writer.writerow([v if isinstance(v, (int, long, float)) else cstr(v).encode("utf-8")
+				for v in get_row_as_list(d, filters)])
+
+	with open(frappe.get_site_path("private", "files", file_name), "rb") as f:
+		for chunk in iter(lambda: f.read(65536), b""):
+			content_hash.update(chunk)
+
+	file_doc = frappe.get_doc({
+		"doctype": "File",
+		"file_name": file_name,
+		"file_url": "/private/files/" + file_name,
+		"is_private": 1,
+		"content_hash": content_hash.hexdigest()
+	})
+	file_doc.flags.ignore_permissions = True
+	file_doc.insert()
+
+	return file_doc.file_url
+
+def get_filters(filters):
+	if not frappe.get_doc("Report", "General Ledger").is_permitted():
+		frappe.throw(_("You don't have access to Report: {0}").format(_("General Ledger")),
+			frappe.PermissionError)
 
-		result.append(row)
+	filters = frappe._dict(json.loads(filters) if isinstance(filters, basestring) else filters)
+	validate(filters)
 
-	return result
+	return filters
@@ -0,0 +1,94 @@
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe, json, unittest
+from frappe.utils import flt
+from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
+from erpnext.accounts.report.general_ledger.general_ledger import execute, get_ledger_page, \
+	get_gl_entries, iter_gl_entries
+
+test_dependencies = ["Journal Entry"]
+
+class TestGeneralLedger(unittest.TestCase):
+	def setUp(self):
+		self.vouchers = [make_journal_entry("_Test Bank - _TC", "_Test Cash - _TC", amount,
+			posting_date=posting_date, submit=True).name
+			for posting_date, amount in (("2013-02-20", 300), ("2013-03-05", 100),
+				("2013-03-05", -40), ("2013-03-10", 250), ("2013-03-28", -75))]
+
+	def test_opening_totals_and_closing(self):
+		filters = get_filters(account="_Test Bank - _TC")
+		rows = execute(frappe._dict(filters))[1]
+		opening_row, entries, totals_row, closing_row = rows[0], rows[2:-2], rows[-2], rows[-1]
+
+		self.assertEqual(opening_row[1], "'Opening'")
+		self.assertEqual(totals_row[1], "'Totals'")
+		self.assertEqual(closing_row[1], "'Closing (Opening + Totals)'")
+
+		# vouchers between the dates are listed, the voucher before is in the opening
+		voucher_nos = [d[6] for d in entries]
+		self.assertTrue(all(name in voucher_nos for name in self.vouchers[1:]))
+		self.assertFalse(self.vouchers[0] in voucher_nos)
+
+		opening, debit, credit = frappe.db.sql("""select
+				sum(if(posting_date < %(from_date)s or ifnull(is_opening, 'No') = 'Yes', debit - credit, 0)),
+				sum(if(posting_date >= %(from_date)s and ifnull(is_opening, 'No') != 'Yes', debit, 0)),
+				sum(if(posting_date >= %(from_date)s and ifnull(is_opening, 'No') != 'Yes', credit, 0))
+			from `tabGL Entry`
+			where account=%(account)s and company=%(company)s and posting_date <= %(to_date)s""",
+			filters)[0]
+
+		self.assertEqual(flt(opening_row[2] - opening_row[3], 2), flt(opening, 2))
+		self.assertEqual(flt(totals_row[2], 2), flt(debit, 2))
+		self.assertEqual(flt(totals_row[3], 2), flt(credit, 2))
+		self.assertEqual(flt(closing_row[2] - closing_row[3], 2), flt(opening + debit - credit, 2))
+
+		# running balance
+		balance = opening_row[2] - opening_row[3]
+		for d in entries:
+			balance += d[2] - d[3]
+			self.assertEqual(flt(d[4], 2), flt(balance, 2))
+
+		self.assertEqual(flt(balance, 2), flt(closing_row[2] - closing_row[3], 2))
+
+	def test_ledger_pages(self):
+		for filters in (
+			get_filters(account="_Test Bank - _TC"),
+			get_filters(account="_Test Bank - _TC", group_by_voucher=1),
+			get_filters(account="Current Assets - _TC", group_by_account=1),
+			get_filters(account="Current Assets - _TC", group_by_account=1, group_by_voucher=1),
+			get_filters()):
+
+			rows = execute(frappe._dict(filters))[1]
+			self.assertTrue(len(rows) > 6)
+
+			for page_length in (1, 2, 5):
+				self.assertEqual(get_pages(filters, page_length), rows)
+
+	def test_gl_entry_keyset(self):
+		for filters in (get_filters(), get_filters(group_by_voucher=1),
+			get_filters(account="Current Assets - _TC", group_by_account=1, group_by_voucher=1)):
+
+			gl_entries = get_gl_entries(frappe._dict(filters), page_length=100000)
+			self.assertEqual([d.name for d in iter_gl_entries(frappe._dict(filters), page_length=2)],
+				[d.name for d in gl_entries])
+
+def get_filters(**filters):
+	filters.update({
+		"company": "_Test Company",
+		"from_date": "2013-03-01",
+		"to_date": "2013-03-31"
+	})
+	return filters
+
+def get_pages(filters, page_length):
+	'''Rows of all pages, the cursor is passed back as the client does'''
+	rows, cursor = [], None
+	while True:
+		page = get_ledger_page(json.dumps(filters), cursor, page_length)
+		rows.extend(page["result"])
+		if not page["cursor"]:
+			return rows
+
+		cursor = json.dumps(page["cursor"])
@@ -0,0 +1,90 @@
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe, unittest
+from frappe.utils import getdate
+from erpnext.accounts.report.financial_statements import calculate_values, \
+	accumulate_values_into_parents
+
+class TestFinancialStatements(unittest.TestCase):
+	def test_period_values(self):
+		self.assertEqual(get_values(), {
+			"_Test Root": [110, -30, 200, -25, 50],
+			"_Test Account A": [100, -30, 200, -20, 50],
+			"_Test Account B": [10, 0, 0, -5, 0]
+		})
+
+	def test_accumulated_values(self):
+		# the entry before the first period is in all periods and in the opening
+		self.assertEqual(get_values(accumulated_values=1), {
+			"_Test Root": [160, 130, 330, 305, 50],
+			"_Test Account A": [150, 120, 320, 300, 50],
+			"_Test Account B": [10, 10, 10, 5, 0]
+		})
+
+	def test_accumulated_values_reset_on_fiscal_year(self):
+		# values accumulate within the fiscal year of the entry
+		self.assertEqual(get_values(accumulated_values=1, ignore_accumulated_values_for_fy=1), {
+			"_Test Root": [110, 80, 200, 175, 50],
+			"_Test Account A": [100, 70, 200, 180, 50],
+			"_Test Account B": [10, 10, 0, -5, 0]
+		})
+
+def get_values(accumulated_values=0, ignore_accumulated_values_for_fy=0):
+	'''Values per period and opening balance of each account, after calculating
+	values and rolling them up into the parent'''
+	period_list = get_test_period_list()
+	accounts = [frappe._dict(name="_Test Root", parent_account=None),
+		frappe._dict(name="_Test Account A", parent_account="_Test Root"),
+		frappe._dict(name="_Test Account B", parent_account="_Test Root")]
+	accounts_by_name = dict((d.name, d) for d in accounts)
+
+	gl_entries_by_account = {
+		"_Test Account A": [
+			# before the first period, only in the opening balance
+			get_gl_entry("2013-12-15", "_Test Fiscal Year 2013", debit=50),
+			# on the last day of the first period and the first day of the second
+			get_gl_entry("2014-06-30", "_Test Fiscal Year 2014", debit=100),
+			get_gl_entry("2014-07-01", "_Test Fiscal Year 2014", credit=30),
+			# on the first day of the second fiscal year and the last day of the last period
+			get_gl_entry("2015-01-01", "_Test Fiscal Year 2015", debit=200),
+			get_gl_entry("2015-12-31", "_Test Fiscal Year 2015", credit=20),
+			# after the last period, ignored
+			get_gl_entry("2016-01-01", "_Test Fiscal Year 2016", debit=999)
+		],
+		"_Test Account B": [
+			get_gl_entry("2014-03-01", "_Test Fiscal Year 2014", debit=10),
+			get_gl_entry("2015-08-01", "_Test Fiscal Year 2015", credit=5)
+		]
+	}
+
+	calculate_values(accounts_by_name, gl_entries_by_account, period_list,
+		accumulated_values, ignore_accumulated_values_for_fy)
+	accumulate_values_into_parents(accounts, accounts_by_name, period_list, accumulated_values)
+
+	return dict((d.name, [d.get(period.key) for period in period_list] + [d.opening_balance])
+		for d in accounts)
+
+def get_test_period_list():
+	'''Half yearly periods of the fiscal years 2014 and 2015'''
+	period_list = []
+	for from_date, to_date, fiscal_year in (("2014-01-01", "2014-06-30", "_Test Fiscal Year 2014"),
+		("2014-07-01", "2014-12-31", "_Test Fiscal Year 2014"),
+		("2015-01-01", "2015-06-30", "_Test Fiscal Year 2015"),
+		("2015-07-01", "2015-12-31", "_Test Fiscal Year 2015")):
+
+		period_list.append(frappe._dict({
+			"from_date": getdate(from_date),
+			"to_date": getdate(to_date),
+			"key": getdate(to_date).strftime("%b_%Y").lower(),
+			"to_date_fiscal_year": fiscal_year,
+			"year_start_date": getdate("2014-01-01"),
+			"year_end_date": getdate("2015-12-31")
+		}))
+
+	return period_list
+
+def get_gl_entry(posting_date, fiscal_year, debit=0, credit=0):
+	return frappe._dict(posting_date=getdate(posting_date), fiscal_year=fiscal_year,
+		debit=debit, credit=credit)
@@ -4,9 +4,10 @@
 from __future__ import unicode_literals
 import frappe, erpnext
 from frappe import _
-from frappe.utils import flt, getdate, formatdate, cstr
+from frappe.utils import flt, getdate, formatdate, cstr, add_days
 from erpnext.accounts.report.financial_statements \
 	import filter_accounts, set_gl_entries_by_account, filter_out_zero_value_rows
+from erpnext.accounts.doctype.account_balance.account_balance import get_balances_by_account
 
 value_fields = ("opening_debit", "opening_credit", "debit", "credit", "closing_debit", "closing_credit")
 
@@ -88,35 +89,32 @@ def get_opening_balances(filters):
 
 
 def get_rootwise_opening_balances(filters, report_type):
-	additional_conditions = ""
-	if not filters.show_unclosed_fy_pl_balances:
-		additional_conditions = " and posting_date >= %(year_start_date)s" \
-			if report_type == "Profit and Loss" else ""
-
-	if not flt(filters.with_period_closing_entry):
-		additional_conditions += " and ifnull(voucher_type, '')!='Period Closing Voucher'"
-
-	gle = frappe.db.sql("""
-		select
-			account, sum(debit) as opening_debit, sum(credit) as opening_credit
-		from `tabGL Entry`
-		where
-			company=%(company)s
-			{additional_conditions}
-			and (posting_date < %(from_date)s or ifnull(is_opening, 'No') = 'Yes')
-			and account in (select name from `tabAccount` where report_type=%(report_type)s)
-		group by account""".format(additional_conditions=additional_conditions),
-		{
-			"company": filters.company,
-			"from_date": filters.from_date,
-			"report_type": report_type,
-			"year_start_date": filters.year_start_date
-		},
-		as_dict=True)
+	"""Returns opening debit and credit per account, read from monthly Account Balance.
+	Only the days of the month before `from_date` are summed from GL Entry."""
+	conditions = ["gle.company='{0}'".format(frappe.db.escape(filters.company)),
+		"""gle.account in (select name from `tabAccount`
+			where report_type='{0}')""".format(frappe.db.escape(report_type))]
+	exclude_period_closing = not flt(filters.with_period_closing_entry)
+
+	from_date = None
+	if not filters.show_unclosed_fy_pl_balances and report_type == "Profit and Loss":
+		from_date = filters.year_start_date
+
+	balances = []
+	if not from_date or from_date < filters.from_date:
+		balances.append(get_balances_by_account(conditions, from_date,
+			add_days(filters.from_date, -1), exclude_period_closing))
+
+	# opening entries posted in the period
+	balances.append(get_balances_by_account(conditions + ["gle.is_opening='Yes'"],
+		filters.from_date, None, exclude_period_closing))
 
 	opening = frappe._dict()
-	for d in gle:
-		opening.setdefault(d.account, d)
+	for balance in balances:
+		for account, (debit, credit) in balance.items():
+			d = opening.setdefault(account, frappe._dict(account=account, opening_debit=0.0, opening_credit=0.0))
+			d.opening_debit += debit
+			d.opening_credit += credit
 
 	return opening
 
@@ -11,6 +11,7 @@ from frappe.utils import formatdate, get_number_format_info
 
 # imported to enable erpnext.accounts.utils.get_account_currency
 from erpnext.accounts.doctype.account.account import get_account_currency
+from erpnext.utilities.tree import get_descendants_condition
 
 class FiscalYearError(frappe.ValidationError): pass
 
@@ -93,10 +94,11 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 	if not party and frappe.form_dict.get("party"):
 		party = frappe.form_dict.get("party")
 
+	from erpnext.accounts.doctype.account_balance.account_balance import get_balance
+
 	cond = []
-	if date:
-		cond.append("posting_date <= '%s'" % frappe.db.escape(cstr(date)))
-	else:
+	from_date, to_date = None, date
+	if not date:
 		# get balance of all entries that exist
 		date = nowdate()
 
@@ -120,15 +122,11 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 
 		# for pl accounts, get balance within a fiscal year
 		if acc.report_type == 'Profit and Loss':
-			cond.append("posting_date >= '%s' and voucher_type != 'Period Closing Voucher'" \
-				% year_start_date)
+			from_date = year_start_date
 
 		# different filter for group and ledger - improved performance
 		if acc.is_group:
-			cond.append("""exists (
-				select name from `tabAccount` ac where ac.name = gle.account
-				and ac.lft >= %s and ac.rgt <= %s
-			)""" % (acc.lft, acc.rgt))
+			cond.append(get_descendants_condition("gle.account", "Account", acc.name))
 
 			# If group and currency same as company,
 			# always return balance based on debit and credit in company currency
@@ -149,13 +147,10 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 			select_field = "sum(debit_in_account_currency) - sum(credit_in_account_currency)"
 		else:
 			select_field = "sum(debit) - sum(credit)"
-		bal = frappe.db.sql("""
-			SELECT {0}
-			FROM `tabGL Entry` gle
-			WHERE {1}""".format(select_field, " and ".join(cond)))[0][0]
 
-		# if bal is None, return 0
-		return flt(bal)
+		# whole months are read from the maintained Account Balance
+		return get_balance(select_field, cond, from_date, to_date,
+			exclude_period_closing=bool(from_date))
 
 def get_count_on(account, fieldname, date):
 
@@ -191,10 +186,7 @@ def get_count_on(account, fieldname, date):
 
 		# different filter for group and ledger - improved performance
 		if acc.is_group:
-			cond.append("""exists (
-				select name from `tabAccount` ac where ac.name = gle.account
-				and ac.lft >= %s and ac.rgt <= %s
-			)""" % (acc.lft, acc.rgt))
+			cond.append(get_descendants_condition("gle.account", "Account", acc.name))
 
 			# If group and currency same as company,
 			# always return balance based on debit and credit in company currency
@@ -502,6 +494,8 @@ def get_company_default(company, fieldname):
 	return value
 
 def fix_total_debit_credit():
+	from erpnext.accounts.doctype.account_balance.account_balance import update_account_balances_for_voucher
+
 	vouchers = frappe.db.sql("""select voucher_type, voucher_no,
 		sum(debit) - sum(credit) as diff
 		from `tabGL Entry`
@@ -512,11 +506,16 @@ def fix_total_debit_credit():
 		if abs(d.diff) > 0:
 			dr_or_cr = d.voucher_type == "Sales Invoice" and "credit" or "debit"
 
+			# remove the voucher from account balances and add it back after the update
+			update_account_balances_for_voucher(d.voucher_type, d.voucher_no, cancel=True)
+
 			frappe.db.sql("""update `tabGL Entry` set %s = %s + %s
 				where voucher_type = %s and voucher_no = %s and %s > 0 limit 1""" %
 				(dr_or_cr, dr_or_cr, '%s', '%s', '%s', dr_or_cr),
 				(d.diff, d.voucher_type, d.voucher_no))
 
+			update_account_balances_for_voucher(d.voucher_type, d.voucher_no)
+
 def get_stock_and_account_difference(account_list=None, posting_date=None):
 	from erpnext.stock.utils import get_stock_value_on
 
@@ -572,65 +571,39 @@ def get_stock_rbnb_difference(posting_date, company):
 	# Amount should be credited
 	return flt(stock_rbnb) + flt(sys_bal)
 
-def get_outstanding_invoices(party_type, party, account, condition=None):
-	outstanding_invoices = []
+def get_outstanding_invoices(party_type, party, account, condition=None, limit_start=0, limit_page_length=None):
+	"""Returns outstanding invoices of the party, by due date. Read from Party Outstanding Invoice,
+	`condition` may filter on posting_date, due_date and the amount fields"""
 	precision = frappe.get_precision("Sales Invoice", "outstanding_amount")
 
-	if party_type=="Customer":
-		dr_or_cr = "debit_in_account_currency - credit_in_account_currency"
-		payment_dr_or_cr = "payment_gl_entry.credit_in_account_currency - payment_gl_entry.debit_in_account_currency"
-	else:
-		dr_or_cr = "credit_in_account_currency - debit_in_account_currency"
-		payment_dr_or_cr = "payment_gl_entry.debit_in_account_currency - payment_gl_entry.credit_in_account_currency"
-
 	invoice_list = frappe.db.sql("""
 		select
-			voucher_no,	voucher_type, posting_date, ifnull(sum({dr_or_cr}), 0) as invoice_amount,
-			(
-				select ifnull(sum({payment_dr_or_cr}), 0)
-				from `tabGL Entry` payment_gl_entry
-				where payment_gl_entry.against_voucher_type = invoice_gl_entry.voucher_type
-					and payment_gl_entry.against_voucher = invoice_gl_entry.voucher_no
-					and payment_gl_entry.party_type = invoice_gl_entry.party_type
-					and payment_gl_entry.party = invoice_gl_entry.party
-					and payment_gl_entry.account = invoice_gl_entry.account
-					and {payment_dr_or_cr} > 0
-			) as payment_amount
+			voucher_no, voucher_type, posting_date, due_date,
+			invoice_amount, payment_amount, outstanding_amount
 		from
-			`tabGL Entry` invoice_gl_entry
+			`tabParty Outstanding Invoice`
 		where
 			party_type = %(party_type)s and party = %(party)s
-			and account = %(account)s and {dr_or_cr} > 0
+			and account = %(account)s
 			{condition}
-			and ((voucher_type = 'Journal Entry'
-					and (against_voucher = '' or against_voucher is null))
-				or (voucher_type not in ('Journal Entry', 'Payment Entry')))
-		group by voucher_type, voucher_no
-		having (invoice_amount - payment_amount) > 0.005
-		order by posting_date, name""".format(
-			dr_or_cr = dr_or_cr,
-			payment_dr_or_cr = payment_dr_or_cr,
-			condition = condition or ""
+		order by ifnull(due_date, %(today)s), posting_date, voucher_no
+		{limit}""".format(
+			condition = condition or "",
+			limit = "limit {0}, {1}".format(cint(limit_start), cint(limit_page_length))
+				if limit_page_length else ""
 		), {
 			"party_type": party_type,
 			"party": party,
 			"account": account,
+			"today": nowdate()
 		}, as_dict=True)
 
 	for d in invoice_list:
-		outstanding_invoices.append(frappe._dict({
-			'voucher_no': d.voucher_no,
-			'voucher_type': d.voucher_type,
-			'posting_date': d.posting_date,
-			'invoice_amount': flt(d.invoice_amount),
-			'payment_amount': flt(d.payment_amount),
-			'outstanding_amount': flt(d.invoice_amount - d.payment_amount, precision),
-			'due_date': frappe.db.get_value(d.voucher_type, d.voucher_no, "due_date"),
-		}))
-
-	outstanding_invoices = sorted(outstanding_invoices, key=lambda k: k['due_date'] or getdate(nowdate()))
-
-	return outstanding_invoices
+		d.invoice_amount = flt(d.invoice_amount)
+		d.payment_amount = flt(d.payment_amount)
+		d.outstanding_amount = flt(d.outstanding_amount, precision)
+
+	return invoice_list
 
 
 def get_account_name(account_type=None, root_type=None, is_group=None, account_currency=None, company=None):
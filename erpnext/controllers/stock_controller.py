@@ -7,9 +7,12 @@ from frappe.utils import cint, flt, cstr
 from frappe import msgprint, _
 import frappe.defaults
 from erpnext.accounts.utils import get_fiscal_year
-from erpnext.accounts.general_ledger import make_gl_entries, delete_gl_entries, process_gl_map
+from erpnext.accounts.general_ledger import make_gl_entries, delete_gl_entries, process_gl_map, \
+	repost_gl_entries
 from erpnext.controllers.accounts_controller import AccountsController
 from erpnext.stock.stock_ledger import get_valuation_rate
+from erpnext.stock.utils import get_posting_datetime
+from erpnext.stock.doctype.repost_item_valuation.repost_item_valuation import is_reposting_deferred
 
 class StockController(AccountsController):
 	def validate(self):
@@ -28,7 +31,7 @@ class StockController(AccountsController):
 					gl_entries = self.get_gl_entries(warehouse_account)
 				make_gl_entries(gl_entries, from_repost=from_repost)
 
-			if repost_future_gle:
+			if repost_future_gle and not is_reposting_deferred(self.doctype, self.name):
 				items, warehouses = self.get_items_and_warehouses()
 				update_gl_entries_after(self.posting_date, self.posting_time, warehouses, items,
 					warehouse_account)
@@ -336,7 +339,13 @@ class StockController(AccountsController):
 
 def update_gl_entries_after(posting_date, posting_time, for_warehouses=None, for_items=None,
 		warehouse_account=None):
+	'''Repost GL Entries of stock vouchers posted after the given datetime.
+
+	Only vouchers whose stock value difference does not match their GL Entries in
+	warehouse accounts are loaded, and only their changed GL Entries are rewritten.'''
 	def _delete_gl_entries(voucher_type, voucher_no):
+		from erpnext.accounts.doctype.account_balance.account_balance import update_account_balances_for_voucher
+		update_account_balances_for_voucher(voucher_type, voucher_no, cancel=True)
 		frappe.db.sql("""delete from `tabGL Entry`
 			where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no))
 
@@ -344,6 +353,7 @@ def update_gl_entries_after(posting_date, posting_time, for_warehouses=None, for
 		warehouse_account = get_warehouse_account()
 
 	future_stock_vouchers = get_future_stock_vouchers(posting_date, posting_time, for_warehouses, for_items)
+	future_stock_vouchers = get_vouchers_with_valuation_change(future_stock_vouchers, warehouse_account)
 	gle = get_voucherwise_gl_entries(future_stock_vouchers, posting_date)
 
 	for voucher_type, voucher_no in future_stock_vouchers:
@@ -351,28 +361,49 @@ def update_gl_entries_after(posting_date, posting_time, for_warehouses=None, for
 		voucher_obj = frappe.get_doc(voucher_type, voucher_no)
 		expected_gle = voucher_obj.get_gl_entries(warehouse_account)
 		if expected_gle:
-			if not existing_gle or not compare_existing_and_expected_gle(existing_gle, expected_gle):
-				_delete_gl_entries(voucher_type, voucher_no)
+			if not existing_gle:
 				voucher_obj.make_gl_entries(gl_entries=expected_gle, repost_future_gle=False, from_repost=True)
+			else:
+				repost_gl_entries(expected_gle, existing_gle)
 		else:
 			_delete_gl_entries(voucher_type, voucher_no)
 
-def compare_existing_and_expected_gle(existing_gle, expected_gle):
-	matched = True
-	for entry in expected_gle:
-		account_existed = False
-		for e in existing_gle:
-			if entry.account == e.account:
-				account_existed = True
-			if entry.account == e.account and entry.against_account == e.against_account \
-					and (not entry.cost_center or not e.cost_center or entry.cost_center == e.cost_center) \
-					and (entry.debit != e.debit or entry.credit != e.credit):
-				matched = False
-				break
-		if not account_existed:
-			matched = False
-			break
-	return matched
+def get_vouchers_with_valuation_change(stock_vouchers, warehouse_account):
+	'''Returns the vouchers where the stock value difference in a warehouse account
+	is not equal to the balance of the account in the GL Entries of the voucher'''
+	stock_accounts = list(set(d.name for d in warehouse_account.values()))
+	if not (stock_vouchers and stock_accounts):
+		return stock_vouchers
+
+	changed_vouchers = set()
+	for i in xrange(0, len(stock_vouchers), 500):
+		voucher_nos = list(set(d[1] for d in stock_vouchers[i:i + 500]))
+
+		# difference per voucher and warehouse account, stock value difference less GL balance
+		differences = {}
+		for voucher_type, voucher_no, warehouse, stock_value_difference in frappe.db.sql("""
+			select voucher_type, voucher_no, warehouse, sum(round(stock_value_difference, 2))
+			from `tabStock Ledger Entry`
+			where voucher_no in ({0})
+			group by voucher_type, voucher_no, warehouse""".format(", ".join(["%s"] * len(voucher_nos))),
+			tuple(voucher_nos)):
+				if warehouse in warehouse_account:
+					key = (voucher_type, voucher_no, warehouse_account[warehouse].name)
+					differences[key] = differences.get(key, 0.0) + flt(stock_value_difference)
+
+		for voucher_type, voucher_no, account, balance in frappe.db.sql("""
+			select voucher_type, voucher_no, account, sum(debit) - sum(credit)
+			from `tabGL Entry`
+			where voucher_no in ({0}) and account in ({1})
+			group by voucher_type, voucher_no, account""".format(", ".join(["%s"] * len(voucher_nos)),
+				", ".join(["%s"] * len(stock_accounts))), tuple(voucher_nos + stock_accounts)):
+				key = (voucher_type, voucher_no, account)
+				differences[key] = differences.get(key, 0.0) - flt(balance)
+
+		changed_vouchers.update((key[0], key[1]) for key, difference in differences.items()
+			if flt(difference, 2))
+
+	return [d for d in stock_vouchers if (d[0], d[1]) in changed_vouchers]
 
 def get_future_stock_vouchers(posting_date, posting_time, for_warehouses=None, for_items=None):
 	future_stock_vouchers = []
@@ -389,9 +420,9 @@ def get_future_stock_vouchers(posting_date, posting_time, for_warehouses=None, f
 
 	for d in frappe.db.sql("""select distinct sle.voucher_type, sle.voucher_no
 		from `tabStock Ledger Entry` sle
-		where timestamp(sle.posting_date, sle.posting_time) >= timestamp(%s, %s) {condition}
-		order by timestamp(sle.posting_date, sle.posting_time) asc, name asc""".format(condition=condition),
-		tuple([posting_date, posting_time] + values), as_dict=True):
+		where sle.posting_datetime >= %s {condition}
+		order by sle.posting_datetime asc, name asc""".format(condition=condition),
+		tuple([get_posting_datetime(posting_date, posting_time)] + values), as_dict=True):
 			future_stock_vouchers.append([d.voucher_type, d.voucher_no])
 
 	return future_stock_vouchers
@@ -12,6 +12,7 @@ from erpnext.controllers.accounts_controller import validate_conversion_rate, \
 class calculate_taxes_and_totals(object):
 	def __init__(self, doc):
 		self.doc = doc
+		self.item_tax_maps = {}
 		self.calculate()
 
 	def calculate(self):
@@ -28,6 +29,7 @@ class calculate_taxes_and_totals(object):
 	def _calculate(self):
 		self.calculate_item_values()
 		self.initialize_taxes()
+		self.compile_taxes()
 		self.determine_exclusive_rate()
 		self.calculate_net_total()
 		self.calculate_taxes()
@@ -98,65 +100,103 @@ class calculate_taxes_and_totals(object):
 
 			self.doc.round_floats_in(tax)
 
+	def compile_taxes(self):
+		"""Set `tax_plan`, the charge type, referred row, rates and precisions of each tax,
+		looked up once for the item-wise calculation. Taxes can only refer to previous
+		rows, so the rows are calculated in order, each as a column over all items."""
+		self.tax_plan = []
+		for i, tax in enumerate(self.doc.get("taxes")):
+			row_index = None
+			if tax.charge_type in ("On Previous Row Amount", "On Previous Row Total"):
+				row_index = cint(tax.row_id) - 1
+				if not 0 <= row_index < i:
+					frappe.throw(_("Cannot refer row number greater than or equal to current row number for this Charge type"))
+
+			self.tax_plan.append(frappe._dict({
+				"charge_type": tax.charge_type,
+				"row_index": row_index,
+				"account_head": tax.account_head,
+				"rate": tax.rate,
+				"rate_precision": self.doc.precision("rate", tax),
+				"tax_amount_precision": tax.precision("tax_amount"),
+				"total_precision": tax.precision("total"),
+				"base_tax_amount_precision": tax.precision("base_tax_amount"),
+				"included_in_print_rate": cint(tax.included_in_print_rate),
+				"add_deduct_tax": getattr(tax, "add_deduct_tax", None),
+				"category": getattr(tax, "category", None)
+			}))
+
+		# tax rates of each tax per item tax rate
+		self.item_tax_rates = {}
+
+	def get_item_tax_rates(self, item_tax_rate):
+		"""Returns rate of each tax for items with the `item_tax_rate`"""
+		if item_tax_rate not in self.item_tax_rates:
+			item_tax_map = self._load_item_tax_rate(item_tax_rate)
+			self.item_tax_rates[item_tax_rate] = [flt(item_tax_map.get(p.account_head), p.rate_precision)
+				if p.account_head in item_tax_map else p.rate for p in self.tax_plan]
+
+		return self.item_tax_rates[item_tax_rate]
+
 	def determine_exclusive_rate(self):
-		if not any((cint(tax.included_in_print_rate) for tax in self.doc.get("taxes"))):
+		if not any(p.included_in_print_rate for p in self.tax_plan):
 			return
 
-		for item in self.doc.get("items"):
-			item_tax_map = self._load_item_tax_rate(item.item_tax_rate)
-			cumulated_tax_fraction = 0
-			for i, tax in enumerate(self.doc.get("taxes")):
-				tax.tax_fraction_for_current_item = self.get_current_tax_fraction(tax, item_tax_map)
+		items = self.doc.get("items")
+		item_tax_rates = [self.get_item_tax_rates(item.item_tax_rate) for item in items]
 
-				if i==0:
-					tax.grand_total_fraction_for_current_item = 1 + tax.tax_fraction_for_current_item
-				else:
-					tax.grand_total_fraction_for_current_item = \
-						self.doc.get("taxes")[i-1].grand_total_fraction_for_current_item \
-						+ tax.tax_fraction_for_current_item
+		# fraction of the tax and grand total of each tax (columns) for each item
+		tax_fractions, grand_total_fractions = [], []
+		cumulated_tax_fractions = [0] * len(items)
 
-				cumulated_tax_fraction += tax.tax_fraction_for_current_item
+		for i, (tax, p) in enumerate(zip(self.doc.get("taxes"), self.tax_plan)):
+			tax_fraction_column, grand_total_fraction_column = [], []
 
-			if cumulated_tax_fraction and not self.discount_amount_applied and item.qty:
-				item.net_amount = flt(item.amount / (1 + cumulated_tax_fraction), item.precision("net_amount"))
-				item.net_rate = flt(item.net_amount / item.qty, item.precision("net_rate"))
-				item.discount_percentage = flt(item.discount_percentage, item.precision("discount_percentage"))
+			for n in xrange(len(items)):
+				current_tax_fraction = 0
 
-				self._set_in_company_currency(item, ["net_rate", "net_amount"])
+				if p.included_in_print_rate:
+					tax_rate = item_tax_rates[n][i]
 
-	def _load_item_tax_rate(self, item_tax_rate):
-		return json.loads(item_tax_rate) if item_tax_rate else {}
+					if p.charge_type == "On Net Total":
+						current_tax_fraction = tax_rate / 100.0
 
-	def get_current_tax_fraction(self, tax, item_tax_map):
-		"""
-			Get tax fraction for calculating tax exclusive amount
-			from tax inclusive amount
-		"""
-		current_tax_fraction = 0
+					elif p.charge_type == "On Previous Row Amount":
+						current_tax_fraction = (tax_rate / 100.0) * tax_fractions[p.row_index][n]
 
-		if cint(tax.included_in_print_rate):
-			tax_rate = self._get_tax_rate(tax, item_tax_map)
+					elif p.charge_type == "On Previous Row Total":
+						current_tax_fraction = (tax_rate / 100.0) * grand_total_fractions[p.row_index][n]
 
-			if tax.charge_type == "On Net Total":
-				current_tax_fraction = tax_rate / 100.0
+				if p.add_deduct_tax:
+					current_tax_fraction *= -1.0 if (p.add_deduct_tax == "Deduct") else 1.0
 
-			elif tax.charge_type == "On Previous Row Amount":
-				current_tax_fraction = (tax_rate / 100.0) * \
-					self.doc.get("taxes")[cint(tax.row_id) - 1].tax_fraction_for_current_item
+				tax_fraction_column.append(current_tax_fraction)
+				grand_total_fraction_column.append(1 + current_tax_fraction if i==0
+					else grand_total_fractions[i-1][n] + current_tax_fraction)
 
-			elif tax.charge_type == "On Previous Row Total":
-				current_tax_fraction = (tax_rate / 100.0) * \
-					self.doc.get("taxes")[cint(tax.row_id) - 1].grand_total_fraction_for_current_item
+				cumulated_tax_fractions[n] += current_tax_fraction
 
-		if getattr(tax, "add_deduct_tax", None):
-			current_tax_fraction *= -1.0 if (tax.add_deduct_tax == "Deduct") else 1.0
-		return current_tax_fraction
+			tax_fractions.append(tax_fraction_column)
+			grand_total_fractions.append(grand_total_fraction_column)
 
-	def _get_tax_rate(self, tax, item_tax_map):
-		if item_tax_map.has_key(tax.account_head):
-			return flt(item_tax_map.get(tax.account_head), self.doc.precision("rate", tax))
-		else:
-			return tax.rate
+			if items:
+				tax.tax_fraction_for_current_item = tax_fraction_column[-1]
+				tax.grand_total_fraction_for_current_item = grand_total_fraction_column[-1]
+
+		for item, cumulated_tax_fraction in zip(items, cumulated_tax_fractions):
+			if cumulated_tax_fraction and not self.discount_amount_applied and item.qty:
+				item.net_amount = flt(item.amount / (1 + cumulated_tax_fraction), item.precision("net_amount"))
+				item.net_rate = flt(item.net_amount / item.qty, item.precision("net_rate"))
+				item.discount_percentage = flt(item.discount_percentage, item.precision("discount_percentage"))
+
+				self._set_in_company_currency(item, ["net_rate", "net_amount"])
+
+	def _load_item_tax_rate(self, item_tax_rate):
+		"""Returns parsed `item_tax_rate` of an item, parsed once per value"""
+		if item_tax_rate not in self.item_tax_maps:
+			self.item_tax_maps[item_tax_rate] = json.loads(item_tax_rate) if item_tax_rate else {}
+
+		return self.item_tax_maps[item_tax_rate]
 
 	def calculate_net_total(self):
 		self.doc.total = self.doc.base_total = self.doc.net_total = self.doc.base_net_total = 0.0
@@ -170,98 +210,96 @@ class calculate_taxes_and_totals(object):
 		self.doc.round_floats_in(self.doc, ["total", "base_total", "net_total", "base_net_total"])
 
 	def calculate_taxes(self):
-		# maintain actual tax rate based on idx
-		actual_tax_dict = dict([[tax.idx, flt(tax.tax_amount, tax.precision("tax_amount"))]
-			for tax in self.doc.get("taxes") if tax.charge_type == "Actual"])
+		items = self.doc.get("items")
+		if not items:
+			return
 
-		for n, item in enumerate(self.doc.get("items")):
-			item_tax_map = self._load_item_tax_rate(item.item_tax_rate)
+		item_tax_rates = [self.get_item_tax_rates(item.item_tax_rate) for item in items]
+		net_amounts = [item.net_amount for item in items]
+		item_keys = [item.item_code or item.item_name for item in items]
+		last_item, last_tax = len(items) - 1, len(self.tax_plan) - 1
 
-			for i, tax in enumerate(self.doc.get("taxes")):
-				# tax_amount represents the amount of tax for the current step
-				current_tax_amount = self.get_current_tax_amount(item, tax, item_tax_map)
+		discount_on_grand_total = self.discount_amount_applied and self.doc.apply_discount_on=="Grand Total"
 
-				# Adjust divisional loss to the last item
-				if tax.charge_type == "Actual":
-					actual_tax_dict[tax.idx] -= current_tax_amount
-					if n == len(self.doc.get("items")) - 1:
-						current_tax_amount += actual_tax_dict[tax.idx]
+		# tax amount and grand total of each tax (columns) for each item
+		tax_amounts, grand_totals = [], []
 
-				# accumulate tax amount into tax.tax_amount
-				if tax.charge_type != "Actual" and \
-					not (self.discount_amount_applied and self.doc.apply_discount_on=="Grand Total"):
-						tax.tax_amount += current_tax_amount
+		for i, (tax, p) in enumerate(zip(self.doc.get("taxes"), self.tax_plan)):
+			tax_amount_column, grand_total_column = [], []
+			tax_amount, tax_amount_after_discount_amount, total = \
+				tax.tax_amount, tax.tax_amount_after_discount_amount, tax.total
 
-				# store tax_amount for current item as it will be used for
-				# charge type = 'On Previous Row Amount'
-				tax.tax_amount_for_current_item = current_tax_amount
+			if p.charge_type == "Actual":
+				# distribute the tax amount proportionally to each item row,
+				# divisional loss is adjusted in the last item
+				actual = remaining_actual = flt(tax.tax_amount, p.tax_amount_precision)
 
-				# set tax after discount
-				tax.tax_amount_after_discount_amount += current_tax_amount
+			for n in xrange(len(items)):
+				tax_rate = item_tax_rates[n][i]
+				current_tax_amount = 0.0
 
-				if getattr(tax, "category", None):
-					# if just for valuation, do not add the tax amount in total
-					# hence, setting it as 0 for further steps
-					current_tax_amount = 0.0 if (tax.category == "Valuation") \
-						else current_tax_amount
+				if p.charge_type == "Actual":
+					current_tax_amount = net_amounts[n]*actual / self.doc.net_total if self.doc.net_total else 0.0
+				elif p.charge_type == "On Net Total":
+					current_tax_amount = (tax_rate / 100.0) * net_amounts[n]
+				elif p.charge_type == "On Previous Row Amount":
+					current_tax_amount = (tax_rate / 100.0) * tax_amounts[p.row_index][n]
+				elif p.charge_type == "On Previous Row Total":
+					current_tax_amount = (tax_rate / 100.0) * grand_totals[p.row_index][n]
 
-					current_tax_amount *= -1.0 if (tax.add_deduct_tax == "Deduct") else 1.0
+				current_tax_amount = flt(current_tax_amount, p.tax_amount_precision)
 
-				# Calculate tax.total viz. grand total till that step
-				# note: grand_total_for_current_item contains the contribution of
-				# item's amount, previously applied tax and the current tax on that item
-				if i==0:
-					tax.grand_total_for_current_item = flt(item.net_amount + current_tax_amount, tax.precision("total"))
-				else:
-					tax.grand_total_for_current_item = \
-						flt(self.doc.get("taxes")[i-1].grand_total_for_current_item + current_tax_amount, tax.precision("total"))
+				# store tax breakup for each item
+				item_wise_tax_amount = current_tax_amount*self.doc.conversion_rate
+				if tax.item_wise_tax_detail.get(item_keys[n]):
+					item_wise_tax_amount += tax.item_wise_tax_detail[item_keys[n]][1]
 
-				# in tax.total, accumulate grand total of each item
-				tax.total += tax.grand_total_for_current_item
+				tax.item_wise_tax_detail[item_keys[n]] = [tax_rate,
+					flt(item_wise_tax_amount, p.base_tax_amount_precision)]
 
-				# set precision in the last item iteration
-				if n == len(self.doc.get("items")) - 1:
-					self.round_off_totals(tax)
+				if p.charge_type == "Actual":
+					remaining_actual -= current_tax_amount
+					if n == last_item:
+						current_tax_amount += remaining_actual
 
-					# adjust Discount Amount loss in last tax iteration
-					if i == (len(self.doc.get("taxes")) - 1) and self.discount_amount_applied \
-						and self.doc.discount_amount and self.doc.apply_discount_on == "Grand Total":
-							self.adjust_discount_amount_loss(tax)
+				# accumulate tax amount into tax.tax_amount
+				elif not discount_on_grand_total:
+					tax_amount += current_tax_amount
 
+				# tax amount of the item is used for charge type = 'On Previous Row Amount'
+				tax_amount_column.append(current_tax_amount)
 
+				# set tax after discount
+				tax_amount_after_discount_amount += current_tax_amount
 
-	def get_current_tax_amount(self, item, tax, item_tax_map):
-		tax_rate = self._get_tax_rate(tax, item_tax_map)
-		current_tax_amount = 0.0
+				if p.category:
+					# if just for valuation, do not add the tax amount in total
+					current_tax_amount = 0.0 if (p.category == "Valuation") \
+						else current_tax_amount
 
-		if tax.charge_type == "Actual":
-			# distribute the tax amount proportionally to each item row
-			actual = flt(tax.tax_amount, tax.precision("tax_amount"))
-			current_tax_amount = item.net_amount*actual / self.doc.net_total if self.doc.net_total else 0.0
+					current_tax_amount *= -1.0 if (p.add_deduct_tax == "Deduct") else 1.0
 
-		elif tax.charge_type == "On Net Total":
-			current_tax_amount = (tax_rate / 100.0) * item.net_amount
-		elif tax.charge_type == "On Previous Row Amount":
-			current_tax_amount = (tax_rate / 100.0) * \
-				self.doc.get("taxes")[cint(tax.row_id) - 1].tax_amount_for_current_item
-		elif tax.charge_type == "On Previous Row Total":
-			current_tax_amount = (tax_rate / 100.0) * \
-				self.doc.get("taxes")[cint(tax.row_id) - 1].grand_total_for_current_item
+				# grand total till this tax for the item: item's amount,
+				# previously applied taxes and the current tax on the item
+				grand_total_column.append(flt((net_amounts[n] if i==0 else grand_totals[i-1][n])
+					+ current_tax_amount, p.total_precision))
 
-		current_tax_amount = flt(current_tax_amount, tax.precision("tax_amount"))
+				# in tax.total, accumulate grand total of each item
+				total += grand_total_column[-1]
 
-		self.set_item_wise_tax(item, tax, tax_rate, current_tax_amount)
+			tax_amounts.append(tax_amount_column)
+			grand_totals.append(grand_total_column)
 
-		return current_tax_amount
+			tax.tax_amount, tax.tax_amount_after_discount_amount, tax.total = \
+				tax_amount, tax_amount_after_discount_amount, total
+			tax.tax_amount_for_current_item = tax_amount_column[-1]
+			tax.grand_total_for_current_item = grand_total_column[-1]
 
-	def set_item_wise_tax(self, item, tax, tax_rate, current_tax_amount):
-		# store tax breakup for each item
-		key = item.item_code or item.item_name
-		item_wise_tax_amount = current_tax_amount*self.doc.conversion_rate
-		if tax.item_wise_tax_detail.get(key):
-			item_wise_tax_amount += tax.item_wise_tax_detail[key][1]
+			self.round_off_totals(tax)
 
-		tax.item_wise_tax_detail[key] = [tax_rate,flt(item_wise_tax_amount, tax.precision("base_tax_amount"))]
+			# adjust Discount Amount loss in last tax iteration
+			if i == last_tax and discount_on_grand_total and self.doc.discount_amount:
+				self.adjust_discount_amount_loss(tax)
 
 	def round_off_totals(self, tax):
 		tax.total = flt(tax.total, tax.precision("total"))
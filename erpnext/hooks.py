@@ -157,10 +157,23 @@ doc_events = {
 	},
 	"Payment Entry": {
 		"on_submit": "erpnext.accounts.doctype.payment_request.payment_request.make_status_as_paid"
+	},
+	("Item", "Warehouse", "Company", "Stock Settings"): {
+		"on_update": "erpnext.stock.utils.clear_master_cache",
+		"after_rename": "erpnext.stock.utils.clear_master_cache",
+		"on_trash": "erpnext.stock.utils.clear_master_cache"
+	},
+	("Account", "Cost Center", "Warehouse", "Item Group", "Customer Group", "Territory", "Sales Person"): {
+		"on_update": "erpnext.utilities.tree.clear_tree_cache",
+		"after_rename": "erpnext.utilities.tree.clear_tree_cache",
+		"on_trash": "erpnext.utilities.tree.clear_tree_cache"
 	}
 }
 
 scheduler_events = {
+	"all": [
+		"erpnext.stock.doctype.repost_item_valuation.repost_item_valuation.repost_entries"
+	],
 	"hourly": [
 		"erpnext.controllers.recurring_document.create_recurring_documents",
 		'erpnext.hr.doctype.daily_work_summary_settings.daily_work_summary_settings.trigger_emails'
@@ -176,7 +189,8 @@ scheduler_events = {
 		"erpnext.projects.doctype.task.task.set_tasks_as_overdue",
 		"erpnext.accounts.doctype.asset.depreciation.post_depreciation_entries",
 		"erpnext.hr.doctype.daily_work_summary_settings.daily_work_summary_settings.send_summary",
-		"erpnext.stock.doctype.serial_no.serial_no.update_maintenance_status"
+		"erpnext.stock.doctype.serial_no.serial_no.update_maintenance_status",
+		"erpnext.accounts.doctype.account_balance.account_balance.check_account_balances"
 	]
 }
 
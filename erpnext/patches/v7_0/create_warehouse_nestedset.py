@@ -3,7 +3,7 @@ from __future__ import unicode_literals
 import frappe
 from frappe import _
 from frappe.utils import cint
-from frappe.utils.nestedset import rebuild_tree
+from erpnext.utilities.tree import rebuild_tree
 
 def execute():
 	"""
@@ -0,0 +1,8 @@
+from __future__ import unicode_literals
+import frappe
+from erpnext.accounts.doctype.account_balance.account_balance import rebuild_account_balances
+
+def execute():
+	frappe.reload_doc("accounts", "doctype", "account_balance")
+
+	rebuild_account_balances()
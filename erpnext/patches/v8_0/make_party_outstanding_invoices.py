@@ -0,0 +1,8 @@
+from __future__ import unicode_literals
+import frappe
+from erpnext.accounts.doctype.party_outstanding_invoice.party_outstanding_invoice import rebuild_outstanding_invoices
+
+def execute():
+	frappe.reload_doc("accounts", "doctype", "party_outstanding_invoice")
+
+	rebuild_outstanding_invoices()
@@ -0,0 +1,8 @@
+from __future__ import unicode_literals
+import frappe
+from erpnext.stock.doctype.stock_balance_snapshot.stock_balance_snapshot import rebuild_snapshots
+
+def execute():
+	frappe.reload_doc("stock", "doctype", "stock_balance_snapshot")
+
+	rebuild_snapshots()
@@ -9,6 +9,7 @@ from frappe.utils.nestedset import NestedSet
 from frappe.website.website_generator import WebsiteGenerator
 from frappe.website.render import clear_cache
 from frappe.website.doctype.website_slideshow.website_slideshow import get_slideshow
+from erpnext.utilities.tree import get_descendants
 
 
 class ItemGroup(NestedSet, WebsiteGenerator):
@@ -107,10 +108,13 @@ def get_product_list_for_group(product_group=None, start=0, limit=10, search=Non
 	return [get_item_for_list_in_html(r) for r in data]
 
 def get_child_groups(item_group_name):
-	item_group = frappe.get_doc("Item Group", item_group_name)
+	child_groups = get_descendants("Item Group", item_group_name)
+	if not child_groups:
+		raise frappe.DoesNotExistError
+
 	return frappe.db.sql("""select name
-		from `tabItem Group` where lft>=%(lft)s and rgt<=%(rgt)s
-			and show_in_website = 1""", {"lft": item_group.lft, "rgt": item_group.rgt})
+		from `tabItem Group` where name in ({0})
+			and show_in_website = 1""".format(", ".join(["%s"] * len(child_groups))), tuple(child_groups))
 
 def get_item_for_list_in_html(context):
 	# add missing absolute link in files
@@ -71,6 +71,46 @@ class TestItem(unittest.TestCase):
 		rebuild_tree("Item Group", "parent_item_group")
 		self.test_basic_tree()
 
+	def test_tree_cache(self):
+		from erpnext.utilities.tree import get_ancestors, get_descendants, is_descendant
+
+		def get_descendants_from_db(item_group):
+			lft, rgt = frappe.db.get_value("Item Group", item_group, ["lft", "rgt"])
+			return frappe.db.sql_list("""select name from `tabItem Group`
+				where lft >= %s and rgt <= %s order by lft""", (lft, rgt))
+
+		for item_group in ("All Item Groups", "_Test Item Group B", "_Test Item Group C"):
+			self.assertEquals(get_descendants("Item Group", item_group), get_descendants_from_db(item_group))
+			self.assertEquals(get_ancestors("Item Group", item_group),
+				get_ancestors_of("Item Group", item_group)[::-1] + [item_group])
+
+		# cache is cleared when a group is moved
+		group_b = frappe.get_doc("Item Group", "_Test Item Group B")
+		group_b.parent_item_group = "_Test Item Group C"
+		group_b.save()
+
+		self.assertTrue(is_descendant("Item Group", "_Test Item Group B - 3", "_Test Item Group C"))
+		self.assertEquals(get_descendants("Item Group", "_Test Item Group C"),
+			get_descendants_from_db("_Test Item Group C"))
+
+		self.move_it_back()
+		self.assertFalse(is_descendant("Item Group", "_Test Item Group B - 3", "_Test Item Group C"))
+
+	def test_tree_cache_on_rebuild(self):
+		from erpnext.utilities.tree import is_descendant, rebuild_tree
+
+		self.assertFalse(is_descendant("Item Group", "_Test Item Group B - 3", "_Test Item Group C"))
+
+		# parent changed without saving the group, as patches do before rebuilding
+		frappe.db.set_value("Item Group", "_Test Item Group B", "parent_item_group", "_Test Item Group C")
+		rebuild_tree("Item Group", "parent_item_group")
+		self.assertTrue(is_descendant("Item Group", "_Test Item Group B - 3", "_Test Item Group C"))
+
+		frappe.db.set_value("Item Group", "_Test Item Group B", "parent_item_group", "All Item Groups")
+		rebuild_tree("Item Group", "parent_item_group")
+		self.assertFalse(is_descendant("Item Group", "_Test Item Group B - 3", "_Test Item Group C"))
+		self.test_basic_tree()
+
 	def move_it_back(self):
 		group_b = frappe.get_doc("Item Group", "_Test Item Group B")
 		group_b.parent_item_group = "All Item Groups"
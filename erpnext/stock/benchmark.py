@@ -0,0 +1,67 @@
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe, time
+from erpnext.stock.utils import get_posting_datetime
+
+previous_sle_query = """select name from `tabStock Ledger Entry`
+	where item_code=%(item_code)s and warehouse=%(warehouse)s
+	and ifnull(is_cancelled, 'No')='No' and {condition}
+	order by {order_by} desc, name desc limit 1"""
+
+def previous_sle_lookup(item_code=None, warehouse=None, runs=100):
+	"""
+	Compare the previous stock ledger entry lookup on timestamp(posting_date, posting_time)
+	with the lookup on the indexed posting_datetime. Prints the query plan and the
+	average time of both. Uses the item / warehouse with the most entries if not given.
+
+	Run as:
+
+	bench --site [your-site-name] execute erpnext.stock.benchmark.previous_sle_lookup
+	"""
+	if not (item_code and warehouse):
+		item_code, warehouse = frappe.db.sql("""select item_code, warehouse
+			from `tabStock Ledger Entry`
+			group by item_code, warehouse
+			order by count(name) desc limit 1""")[0]
+
+	# look up from the middle of the ledger
+	count = frappe.db.sql("""select count(name) from `tabStock Ledger Entry`
+		where item_code=%s and warehouse=%s""", (item_code, warehouse))[0][0]
+	posting_date, posting_time = frappe.db.sql("""select posting_date, posting_time
+		from `tabStock Ledger Entry`
+		where item_code=%s and warehouse=%s
+		order by posting_datetime, name limit %s, 1""", (item_code, warehouse, count / 2))[0]
+
+	values = {
+		"item_code": item_code,
+		"warehouse": warehouse,
+		"posting_date": posting_date,
+		"posting_time": posting_time,
+		"posting_datetime": get_posting_datetime(posting_date, posting_time)
+	}
+
+	result = {}
+	for label, condition, order_by in (
+		("timestamp", "timestamp(posting_date, posting_time) <= timestamp(%(posting_date)s, %(posting_time)s)",
+			"timestamp(posting_date, posting_time)"),
+		("posting_datetime", "posting_datetime <= %(posting_datetime)s", "posting_datetime")):
+
+		query = previous_sle_query.format(condition=condition, order_by=order_by)
+		plan = frappe.db.sql("explain " + query, values, as_dict=1)
+
+		start = time.time()
+		for i in xrange(runs):
+			frappe.db.sql(query, values)
+		average = (time.time() - start) / runs * 1000
+
+		result[label] = {"plan": plan, "average_ms": average}
+
+		print "{0}: {1:.3f} ms per lookup".format(label, average)
+		for d in plan:
+			print "  type: {0}, key: {1}, rows: {2}, extra: {3}".format(d.type, d.key, d.rows, d.Extra)
+
+	print "{0} / {1}, {2} entries".format(item_code, warehouse, count)
+
+	return result
@@ -4,7 +4,7 @@
 from __future__ import unicode_literals
 import frappe
 from frappe import _
-from frappe.utils import flt, nowdate
+from frappe.utils import flt, nowdate, now
 import frappe.defaults
 from frappe.model.document import Document
 
@@ -33,8 +33,11 @@ class Bin(Document):
 	def update_stock(self, args, allow_negative_stock=False, via_landed_cost_voucher=False):
 		self.update_qty(args)
 
-		if args.get("actual_qty") or args.get("voucher_type") == "Stock Reconciliation":
+		# entries inserted in bulk are netted per bin, so repost even if the net qty is zero
+		if args.get("actual_qty") or args.get("sle_id") or args.get("voucher_type") == "Stock Reconciliation":
 			from erpnext.stock.stock_ledger import update_entries_after
+			from erpnext.stock.doctype.repost_item_valuation.repost_item_valuation import \
+				is_reposting_in_background, has_future_sle, make_repost_item_valuation
 
 			if not args.get("posting_date"):
 				args["posting_date"] = nowdate()
@@ -42,37 +45,65 @@ class Bin(Document):
 			# update valuation and qty after transaction for post dated entry
 			if args.get("is_cancelled") == "Yes" and via_landed_cost_voucher:
 				return
-			update_entries_after({
+
+			sle_args = {
 				"item_code": self.item_code,
 				"warehouse": self.warehouse,
 				"posting_date": args.get("posting_date"),
 				"posting_time": args.get("posting_time"),
 				"voucher_no": args.get("voucher_no")
-			}, allow_negative_stock=allow_negative_stock, via_landed_cost_voucher=via_landed_cost_voucher)
+			}
+
+			if is_reposting_in_background() and has_future_sle(sle_args):
+				# value the current transaction now, back-dated effect on
+				# future entries is reposted by the scheduler
+				update_entries_after(sle_args.copy(), allow_negative_stock=allow_negative_stock,
+					via_landed_cost_voucher=via_landed_cost_voucher, repost_future_entries=False)
+
+				sle_args["voucher_type"] = args.get("voucher_type")
+				make_repost_item_valuation(sle_args, allow_negative_stock, via_landed_cost_voucher)
+			else:
+				update_entries_after(sle_args, allow_negative_stock=allow_negative_stock,
+					via_landed_cost_voucher=via_landed_cost_voucher)
 
 	def update_qty(self, args):
 		# update the stock values (for current quantities)
+		# quantities are changed by deltas in a single update, so concurrent
+		# transactions on the same bin do not overwrite each other
+		values = {
+			"name": self.name,
+			"modified": now(),
+			"modified_by": frappe.session.user
+		}
+		for fieldname in ("actual_qty", "ordered_qty", "reserved_qty", "indented_qty", "planned_qty"):
+			values[fieldname] = flt(args.get(fieldname))
+
+		actual_qty = "actual_qty = ifnull(actual_qty, 0) + %(actual_qty)s"
 		if args.get("voucher_type")=="Stock Reconciliation":
+			actual_qty = "actual_qty = %(actual_qty)s"
 			if args.get('is_cancelled') == 'No':
-				self.actual_qty = args.get("qty_after_transaction")
+				values["actual_qty"] = flt(args.get("qty_after_transaction"))
 			else:
-				qty_after_transaction = frappe.db.get_value("""select qty_after_transaction
+				qty_after_transaction = frappe.db.sql("""select qty_after_transaction
 					from `tabStock Ledger Entry`
 					where item_code=%s and warehouse=%s
 					and not (voucher_type='Stock Reconciliation' and voucher_no=%s)
-					order by posting_date desc limit 1""",
+					order by posting_datetime desc, name desc limit 1""",
 					(self.item_code, self.warehouse, args.get('voucher_no')))
 
-				self.actual_qty = flt(qty_after_transaction[0][0]) if qty_after_transaction else 0.0
-		else:
-			self.actual_qty = flt(self.actual_qty) + flt(args.get("actual_qty"))
+				values["actual_qty"] = flt(qty_after_transaction[0][0]) if qty_after_transaction else 0.0
 
-		self.ordered_qty = flt(self.ordered_qty) + flt(args.get("ordered_qty"))
-		self.reserved_qty = flt(self.reserved_qty) + flt(args.get("reserved_qty"))
-		self.indented_qty = flt(self.indented_qty) + flt(args.get("indented_qty"))
-		self.planned_qty = flt(self.planned_qty) + flt(args.get("planned_qty"))
+		# assignments are applied left to right, projected qty sees the new quantities
+		frappe.db.sql("""update `tabBin` set {0},
+				ordered_qty = ifnull(ordered_qty, 0) + %(ordered_qty)s,
+				reserved_qty = ifnull(reserved_qty, 0) + %(reserved_qty)s,
+				indented_qty = ifnull(indented_qty, 0) + %(indented_qty)s,
+				planned_qty = ifnull(planned_qty, 0) + %(planned_qty)s,
+				{1},
+				modified = %(modified)s, modified_by = %(modified_by)s
+			where name = %(name)s""".format(actual_qty, projected_qty_sql), values)
 
-		self.save()
+		queue_item_projected_qty_update(self.item_code)
 
 	def set_projected_qty(self):
 		self.projected_qty = (flt(self.actual_qty) + flt(self.ordered_qty)
@@ -84,7 +115,7 @@ class Bin(Document):
 			select * from `tabStock Ledger Entry`
 			where item_code = %s
 			and warehouse = %s
-			order by timestamp(posting_date, posting_time) asc, name asc
+			order by posting_datetime asc, name asc
 			limit 1
 		""", (self.item_code, self.warehouse), as_dict=1)
 		return sle and sle[0] or None
@@ -106,6 +137,28 @@ class Bin(Document):
 		self.db_set('projected_qty', self.projected_qty)
 
 
+projected_qty_sql = """projected_qty = ifnull(actual_qty, 0) + ifnull(ordered_qty, 0)
+	+ ifnull(indented_qty, 0) + ifnull(planned_qty, 0) - ifnull(reserved_qty, 0)
+	- ifnull(reserved_qty_for_production, 0)"""
+
+def queue_item_projected_qty_update(item_code):
+	'''Update total_projected_qty of the Item now, or at the end of the
+	stock transaction if one is in progress (see `stock_ledger.make_sl_entries`)'''
+	if frappe.flags.items_to_update_projected_qty is None:
+		update_item_projected_qty(item_code)
+	else:
+		frappe.flags.items_to_update_projected_qty.add(item_code)
+
+def update_items_projected_qty(items):
+	'''Set total_projected_qty of all the items in one query'''
+	items = list(set(items))
+	if not items:
+		return
+
+	frappe.db.sql('''update tabItem item set
+		total_projected_qty = ifnull((select sum(projected_qty) from tabBin where item_code=item.name), 0)
+		where item.name in ({0})'''.format(", ".join(["%s"] * len(items))), tuple(items))
+
 def update_item_projected_qty(item_code):
 	'''Set total_projected_qty in Item as sum of projected qty in all warehouses'''
 	frappe.db.sql('''update tabItem set
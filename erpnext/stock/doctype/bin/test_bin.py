@@ -5,8 +5,28 @@ from __future__ import unicode_literals
 
 import frappe
 import unittest
+from frappe.utils import flt
+from erpnext.stock.utils import get_bin
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
 
 # test_records = frappe.get_test_records('Bin')
 
 class TestBin(unittest.TestCase):
-	pass
+	def test_update_qty(self):
+		bin = get_bin("_Test Item", "_Test Warehouse - _TC")
+		bin.update_qty({"actual_qty": 5, "reserved_qty": 2})
+
+		updated = get_bin("_Test Item", "_Test Warehouse - _TC")
+		self.assertEqual(flt(updated.actual_qty), flt(bin.actual_qty) + 5)
+		self.assertEqual(flt(updated.reserved_qty), flt(bin.reserved_qty) + 2)
+		self.assertEqual(flt(updated.projected_qty), flt(bin.projected_qty) + 3)
+
+		bin.update_qty({"actual_qty": -5, "reserved_qty": -2})
+
+	def test_item_projected_qty(self):
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=10, basic_rate=100)
+
+		total_projected_qty = frappe.db.sql("""select sum(projected_qty) from tabBin
+			where item_code='_Test Item'""")[0][0]
+		self.assertEqual(flt(frappe.db.get_value("Item", "_Test Item", "total_projected_qty")),
+			flt(total_projected_qty))
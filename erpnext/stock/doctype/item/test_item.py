@@ -93,6 +93,33 @@ class TestItem(unittest.TestCase):
 		for key, value in to_check.iteritems():
 			self.assertEquals(value, details.get(key))
 
+	def test_get_item_details_for_items(self):
+		from erpnext.stock.get_item_details import get_item_details, get_item_details_for_items
+
+		make_test_records("Item Price")
+
+		args = {
+			"company": "_Test Company",
+			"price_list": "_Test Price List",
+			"currency": "_Test Currency",
+			"doctype": "Sales Order",
+			"conversion_rate": 1,
+			"price_list_currency": "_Test Currency",
+			"plc_conversion_rate": 1,
+			"order_type": "Sales",
+			"customer": "_Test Customer"
+		}
+		items = [{"item_code": "_Test Item", "qty": 2}, {"item_code": "_Test Item 2"},
+			{"item_code": "_Test Item", "qty": 5}]
+
+		expected = []
+		for item in items:
+			row = args.copy()
+			row.update(item)
+			expected.append(get_item_details(row))
+
+		self.assertEquals(get_item_details_for_items(args, items), expected)
+
 	def test_item_attribute_change_after_variant(self):
 		frappe.delete_doc_if_exists("Item", "_Test Variant Item-L", force=1)
 
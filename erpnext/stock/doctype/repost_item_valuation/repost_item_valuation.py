@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+import frappe.defaults
+from frappe.utils import cint, now
+from frappe.model.document import Document
+
+class RepostItemValuation(Document):
+	def validate(self):
+		from erpnext.stock.utils import get_posting_datetime
+		self.posting_datetime = get_posting_datetime(self.posting_date, self.posting_time)
+
+def is_reposting_in_background():
+	return cint(frappe.db.get_single_value("Stock Settings", "repost_future_stock_in_background"))
+
+def has_future_sle(args):
+	'''Returns True if there are stock ledger entries after the given posting datetime'''
+	from erpnext.stock.utils import get_posting_datetime
+
+	return bool(frappe.db.sql("""select name from `tabStock Ledger Entry`
+		where item_code = %(item_code)s and warehouse = %(warehouse)s
+		and ifnull(is_cancelled, 'No') = 'No'
+		and posting_datetime > %(posting_datetime)s
+		limit 1""", {
+			"item_code": args.get("item_code"),
+			"warehouse": args.get("warehouse"),
+			"posting_datetime": get_posting_datetime(args.get("posting_date"), args.get("posting_time"))
+		}))
+
+def make_repost_item_valuation(args, allow_negative_stock=False, via_landed_cost_voucher=False):
+	'''Queue reposting of future stock ledger entries from the given posting datetime'''
+	repost = frappe.get_doc({
+		"doctype": "Repost Item Valuation",
+		"item_code": args.get("item_code"),
+		"warehouse": args.get("warehouse"),
+		"posting_date": args.get("posting_date"),
+		"posting_time": args.get("posting_time") or "00:00",
+		"voucher_type": args.get("voucher_type"),
+		"voucher_no": args.get("voucher_no"),
+		"allow_negative_stock": cint(allow_negative_stock),
+		"via_landed_cost_voucher": cint(via_landed_cost_voucher),
+		"status": "Queued"
+	})
+	repost.flags.ignore_permissions = True
+	repost.insert()
+
+	return repost
+
+def is_reposting_deferred(voucher_type, voucher_no):
+	'''Returns True if reposting of future entries for this voucher is still queued'''
+	return bool(frappe.db.sql("""select name from `tabRepost Item Valuation`
+		where voucher_type=%s and voucher_no=%s and status in ('Queued', 'In Progress')
+		limit 1""", (voucher_type, voucher_no)))
+
+def repost_entries():
+	'''Repost queued back-dated stock transactions. Called by the scheduler.
+
+	Overlapping requests for the same item and warehouse are coalesced and
+	the ledger is reposted once from the earliest queued posting datetime.'''
+	item_warehouse_map = {}
+	for d in claim_queued_entries():
+		item_warehouse_map.setdefault((d.item_code, d.warehouse), []).append(d)
+
+	for (item_code, warehouse), entries in item_warehouse_map.items():
+		repost_item_valuation(item_code, warehouse, entries)
+
+def claim_queued_entries():
+	'''Returns the queued reposts and sets them In Progress. The rows are locked
+	until the status is committed, so a concurrent run does not get the same rows.'''
+	queued = frappe.db.sql("""select name, item_code, warehouse, posting_date, posting_time,
+			allow_negative_stock, via_landed_cost_voucher
+		from `tabRepost Item Valuation`
+		where status = 'Queued'
+		order by posting_datetime asc, creation asc
+		for update""", as_dict=1)
+
+	if queued:
+		set_status([d.name for d in queued], "In Progress")
+	frappe.db.commit()
+
+	return queued
+
+def repost_item_valuation(item_code, warehouse, entries):
+	from erpnext.stock.stock_ledger import update_entries_after
+	from erpnext.controllers.stock_controller import update_gl_entries_after
+
+	names = [d.name for d in entries]
+
+	# entries are sorted by posting datetime, the first one is the watermark
+	first = entries[0]
+
+	try:
+		update_entries_after({
+			"item_code": item_code,
+			"warehouse": warehouse,
+			"posting_date": first.posting_date,
+			"posting_time": first.posting_time
+		}, allow_negative_stock=max(cint(d.allow_negative_stock) for d in entries),
+			via_landed_cost_voucher=min(cint(d.via_landed_cost_voucher) for d in entries),
+			verbose=0)
+
+		if cint(frappe.defaults.get_global_default("auto_accounting_for_stock")):
+			update_gl_entries_after(first.posting_date, first.posting_time, [warehouse], [item_code])
+
+		set_status(names, "Completed")
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		set_status(names, "Failed", frappe.get_traceback())
+		frappe.db.commit()
+
+def set_status(names, status, error_log=None):
+	frappe.db.sql("""update `tabRepost Item Valuation`
+		set status=%s, error_log=%s, modified=%s
+		where name in ({0})""".format(", ".join(["%s"] * len(names))),
+		tuple([status, error_log, now()] + names))
+
+@frappe.whitelist()
+def get_repost_status(item_code=None, warehouse=None):
+	'''Returns count of reposts per status and the pending reposts
+	(earliest queued posting datetime per item and warehouse)'''
+	conditions, values = "", {"item_code": item_code, "warehouse": warehouse}
+	if item_code:
+		conditions += " and item_code = %(item_code)s"
+	if warehouse:
+		conditions += " and warehouse = %(warehouse)s"
+
+	status = dict(frappe.db.sql("""select status, count(name)
+		from `tabRepost Item Valuation` where 1=1 {0}
+		group by status""".format(conditions), values))
+
+	pending = frappe.db.sql("""select item_code, warehouse,
+			min(posting_datetime) as posting_datetime,
+			count(name) as requests
+		from `tabRepost Item Valuation`
+		where status in ('Queued', 'In Progress') {0}
+		group by item_code, warehouse
+		order by posting_datetime""".format(conditions), values, as_dict=1)
+
+	return {
+		"status": dict((s, status.get(s, 0)) for s in ("Queued", "In Progress", "Completed", "Failed")),
+		"pending": pending
+	}
+
+def on_doctype_update():
+	if not frappe.db.sql("""show index from `tabRepost Item Valuation`
+		where Key_name="status_posting_datetime" """):
+		frappe.db.commit()
+		frappe.db.sql("""alter table `tabRepost Item Valuation`
+			add index status_posting_datetime(status, posting_datetime)""")
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import add_days, nowdate
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.repost_item_valuation.repost_item_valuation import \
+	repost_entries, get_repost_status, claim_queued_entries
+
+class TestRepostItemValuation(unittest.TestCase):
+	def setUp(self):
+		frappe.db.set_value("Stock Settings", None, "repost_future_stock_in_background", 1)
+
+	def tearDown(self):
+		frappe.db.set_value("Stock Settings", None, "repost_future_stock_in_background", 0)
+
+	def test_back_dated_entry_is_reposted_in_background(self):
+		item_code, warehouse = "_Test Item", "_Test Warehouse - _TC"
+
+		make_stock_entry(item_code=item_code, target=warehouse, qty=10, basic_rate=100)
+		se = make_stock_entry(item_code=item_code, target=warehouse, qty=5, basic_rate=200,
+			posting_date=add_days(nowdate(), -10), posting_time="10:00")
+
+		repost = frappe.get_all("Repost Item Valuation",
+			filters={"voucher_type": "Stock Entry", "voucher_no": se.name}, fields=["name", "status"])
+		self.assertEqual(len(repost), 1)
+		self.assertEqual(repost[0].status, "Queued")
+		self.assertTrue(get_repost_status(item_code, warehouse)["pending"])
+
+		repost_entries()
+
+		self.assertEqual(frappe.db.get_value("Repost Item Valuation", repost[0].name, "status"),
+			"Completed")
+
+		last_sle = frappe.db.sql("""select qty_after_transaction from `tabStock Ledger Entry`
+			where item_code=%s and warehouse=%s
+			order by posting_datetime desc, name desc limit 1""",
+			(item_code, warehouse))
+		self.assertEqual(frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
+			"actual_qty"), last_sle[0][0])
+
+	def test_queued_entries_are_claimed_once(self):
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=10, basic_rate=100)
+		se = make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=5,
+			basic_rate=200, posting_date=add_days(nowdate(), -10), posting_time="10:00")
+		name = frappe.db.get_value("Repost Item Valuation",
+			{"voucher_type": "Stock Entry", "voucher_no": se.name})
+
+		self.assertTrue(name in [d.name for d in claim_queued_entries()])
+		self.assertEqual(frappe.db.get_value("Repost Item Valuation", name, "status"), "In Progress")
+
+		# a second run does not get the claimed entries
+		self.assertFalse(name in [d.name for d in claim_queued_entries()])
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import flt, getdate, get_last_day, add_months, now
+from frappe.model.document import Document
+
+class StockBalanceSnapshot(Document):
+	pass
+
+def update_snapshots(item_code, warehouse, from_date, previous_sle, entries):
+	'''Rebuild month end balances of an item / warehouse from the month of `from_date`.
+
+	`previous_sle` is the last entry before `from_date` and `entries` are the
+	reposted entries after it, in posting order.'''
+	from_period_end = get_last_day(from_date)
+
+	frappe.db.sql("""delete from `tabStock Balance Snapshot`
+		where item_code=%s and warehouse=%s and period_end >= %s""",
+		(item_code, warehouse, from_period_end))
+
+	closing_balances = {}
+	for sle in [previous_sle] + list(entries):
+		if not sle or not sle.get("posting_date"):
+			continue
+
+		period_end = get_last_day(sle.posting_date)
+		if period_end >= from_period_end:
+			# entries are in posting order, last entry of the month is the closing balance
+			closing_balances[period_end] = sle
+
+	make_snapshots(item_code, warehouse, closing_balances)
+
+def make_snapshots(item_code, warehouse, closing_balances):
+	if not closing_balances:
+		return
+
+	timestamp, values = now(), []
+	for period_end, sle in closing_balances.items():
+		values.extend([frappe.generate_hash(length=10), timestamp, timestamp,
+			frappe.session.user, frappe.session.user, item_code, warehouse, period_end,
+			flt(sle.qty_after_transaction), flt(sle.valuation_rate), flt(sle.stock_value)])
+
+	frappe.db.sql("""insert into `tabStock Balance Snapshot`
+		(name, creation, modified, owner, modified_by, item_code, warehouse, period_end,
+			qty_after_transaction, valuation_rate, stock_value)
+		values {0}""".format(", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(closing_balances))),
+		tuple(values))
+
+def rebuild_snapshots(item_code=None, warehouse=None):
+	'''Rebuild all month end balances from the stock ledger'''
+	conditions, values = "", {"item_code": item_code, "warehouse": warehouse}
+	if item_code:
+		conditions += " and item_code=%(item_code)s"
+	if warehouse:
+		conditions += " and warehouse=%(warehouse)s"
+
+	frappe.db.sql("""delete from `tabStock Balance Snapshot` where 1=1 {0}""".format(conditions), values)
+
+	for item_code, warehouse in frappe.db.sql("""select distinct item_code, warehouse
+		from `tabStock Ledger Entry` where ifnull(is_cancelled, 'No')='No' {0}""".format(conditions), values):
+
+		closing_balances = {}
+		for sle in frappe.db.sql("""select posting_date, qty_after_transaction, valuation_rate, stock_value
+			from `tabStock Ledger Entry`
+			where item_code=%s and warehouse=%s and ifnull(is_cancelled, 'No')='No'
+			order by posting_datetime asc, name asc""", (item_code, warehouse), as_dict=1):
+				closing_balances[get_last_day(sle.posting_date)] = sle
+
+		make_snapshots(item_code, warehouse, closing_balances)
+
+def get_snapshot_date(posting_date):
+	'''Returns the latest month end on or before the posting date'''
+	posting_date = getdate(posting_date)
+	period_end = get_last_day(posting_date)
+	if period_end == posting_date:
+		return period_end
+
+	return get_last_day(add_months(posting_date, -1))
+
+def on_doctype_update():
+	if not frappe.db.sql("""show index from `tabStock Balance Snapshot`
+		where Key_name="item_warehouse_period_end" """):
+		frappe.db.commit()
+		frappe.db.sql("""alter table `tabStock Balance Snapshot`
+			add unique index item_warehouse_period_end(item_code, warehouse, period_end)""")
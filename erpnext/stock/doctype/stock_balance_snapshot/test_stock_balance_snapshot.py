@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import add_months, get_last_day, nowdate
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.utils import get_stock_value_on
+
+class TestStockBalanceSnapshot(unittest.TestCase):
+	def test_snapshot_on_back_dated_entry(self):
+		item_code, warehouse = "_Test Item", "_Test Warehouse - _TC"
+		posting_date = add_months(nowdate(), -2)
+		period_end = get_last_day(posting_date)
+
+		stock_value_on = get_stock_value_on(warehouse, period_end, item_code)
+
+		make_stock_entry(item_code=item_code, target=warehouse, qty=5, basic_rate=100,
+			posting_date=posting_date, posting_time="10:00")
+
+		snapshot = frappe.db.get_value("Stock Balance Snapshot", {"item_code": item_code,
+			"warehouse": warehouse, "period_end": period_end}, ["qty_after_transaction", "stock_value"], as_dict=1)
+
+		last_sle = frappe.db.sql("""select qty_after_transaction, stock_value from `tabStock Ledger Entry`
+			where item_code=%s and warehouse=%s and posting_date <= %s
+			order by posting_datetime desc, name desc limit 1""",
+			(item_code, warehouse, period_end), as_dict=1)[0]
+
+		self.assertEqual(snapshot.qty_after_transaction, last_sle.qty_after_transaction)
+		self.assertEqual(snapshot.stock_value, last_sle.stock_value)
+		self.assertEqual(get_stock_value_on(warehouse, period_end, item_code), last_sle.stock_value)
+		self.assertTrue(get_stock_value_on(warehouse, period_end, item_code) > stock_value_on)
@@ -9,7 +9,8 @@ from frappe.utils import flt, getdate, add_days, formatdate
 from frappe.model.document import Document
 from datetime import date
 from erpnext.controllers.item_variant import ItemTemplateCannotHaveStock
-from erpnext.accounts.utils import get_fiscal_year
+from erpnext.accounts.utils import get_fiscal_year, get_fiscal_years
+from erpnext.utilities.bulk_insert import get_master_details
 
 class StockFreezeError(frappe.ValidationError): pass
 
@@ -24,6 +25,7 @@ class StockLedgerEntry(Document):
 		self.validate_batch()
 		validate_warehouse_company(self.warehouse, self.company)
 		self.scrub_posting_time()
+		self.set_posting_datetime()
 		self.validate_and_set_fiscal_year()
 		self.block_transactions_against_group_warehouse()
 
@@ -87,23 +89,16 @@ class StockLedgerEntry(Document):
 		self.stock_uom = item_det.stock_uom
 
 	def check_stock_frozen_date(self):
-		stock_frozen_upto = frappe.db.get_value('Stock Settings', None, 'stock_frozen_upto') or ''
-		if stock_frozen_upto:
-			stock_auth_role = frappe.db.get_value('Stock Settings', None,'stock_auth_role')
-			if getdate(self.posting_date) <= getdate(stock_frozen_upto) and not stock_auth_role in frappe.get_roles():
-				frappe.throw(_("Stock transactions before {0} are frozen").format(formatdate(stock_frozen_upto)), StockFreezeError)
-
-		stock_frozen_upto_days = int(frappe.db.get_value('Stock Settings', None, 'stock_frozen_upto_days') or 0)
-		if stock_frozen_upto_days:
-			stock_auth_role = frappe.db.get_value('Stock Settings', None,'stock_auth_role')
-			older_than_x_days_ago = (add_days(getdate(self.posting_date), stock_frozen_upto_days) <= date.today())
-			if older_than_x_days_ago and not stock_auth_role in frappe.get_roles():
-				frappe.throw(_("Not allowed to update stock transactions older than {0}").format(stock_frozen_upto_days), StockFreezeError)
+		check_stock_frozen_date(self.posting_date)
 
 	def scrub_posting_time(self):
 		if not self.posting_time or self.posting_time == '00:0':
 			self.posting_time = '00:00'
 
+	def set_posting_datetime(self):
+		from erpnext.stock.utils import get_posting_datetime
+		self.posting_datetime = get_posting_datetime(self.posting_date, self.posting_time)
+
 	def validate_batch(self):
 		if self.batch_no and self.voucher_type != "Stock Entry":
 			expiry_date = frappe.db.get_value("Batch", self.batch_no, "expiry_date")
@@ -123,9 +118,123 @@ class StockLedgerEntry(Document):
 		from erpnext.stock.utils import is_group_warehouse
 		is_group_warehouse(self.warehouse)
 
+def check_stock_frozen_date(posting_date):
+	stock_frozen_upto = frappe.db.get_value('Stock Settings', None, 'stock_frozen_upto') or ''
+	if stock_frozen_upto:
+		stock_auth_role = frappe.db.get_value('Stock Settings', None,'stock_auth_role')
+		if getdate(posting_date) <= getdate(stock_frozen_upto) and not stock_auth_role in frappe.get_roles():
+			frappe.throw(_("Stock transactions before {0} are frozen").format(formatdate(stock_frozen_upto)), StockFreezeError)
+
+	stock_frozen_upto_days = int(frappe.db.get_value('Stock Settings', None, 'stock_frozen_upto_days') or 0)
+	if stock_frozen_upto_days:
+		stock_auth_role = frappe.db.get_value('Stock Settings', None,'stock_auth_role')
+		older_than_x_days_ago = (add_days(getdate(posting_date), stock_frozen_upto_days) <= date.today())
+		if older_than_x_days_ago and not stock_auth_role in frappe.get_roles():
+			frappe.throw(_("Not allowed to update stock transactions older than {0}").format(stock_frozen_upto_days), StockFreezeError)
+
+def validate_bulk_entries(sl_entries):
+	'''Validate Stock Ledger Entries inserted in bulk (see `stock_ledger.make_entries_in_bulk`).
+
+	Runs the validations of `validate` and `on_submit` with one query per master
+	for the whole batch. Serialized items are not allowed here, they need serial no
+	validation per entry. Also sets stock_uom, posting_time, posting_datetime and fiscal_year.'''
+	from erpnext.stock.utils import get_posting_datetime
+
+	meta = frappe.get_meta("Stock Ledger Entry")
+	items = get_master_details("Item", [d.get("item_code") for d in sl_entries],
+		["has_batch_no", "docstatus", "is_stock_item", "has_variants", "stock_uom", "has_serial_no"])
+	warehouses = get_master_details("Warehouse", [d.get("warehouse") for d in sl_entries],
+		["company", "is_group"])
+	batches = get_master_details("Batch", [d.get("batch_no") for d in sl_entries if d.get("batch_no")],
+		["item", "expiry_date"])
+
+	fiscal_years = {}
+	for posting_date in set(getdate(d.get("posting_date")) for d in sl_entries if d.get("posting_date")):
+		check_stock_frozen_date(posting_date)
+
+	for sle in sl_entries:
+		for k in ['warehouse','posting_date','voucher_type','voucher_no','company']:
+			if not sle.get(k):
+				frappe.throw(_("{0} is required").format(meta.get_label(k)))
+
+		if sle.get("voucher_type") != "Stock Reconciliation" and not sle.get("actual_qty"):
+			frappe.throw(_("Actual Qty is mandatory"))
+
+		item_det = items.get(sle.get("item_code"))
+		if not item_det:
+			frappe.throw(_("Item {0} not found").format(sle.get("item_code")))
+
+		if item_det.is_stock_item != 1:
+			frappe.throw(_("Item {0} must be a stock Item").format(sle.get("item_code")))
+
+		if item_det.has_serial_no or sle.get("serial_no"):
+			frappe.throw(_("Serialized Item {0} cannot be posted in bulk").format(sle.get("item_code")))
+
+		batch_no = sle.get("batch_no")
+		if sle.get("voucher_type") != 'Stock Reconciliation':
+			if item_det.has_batch_no ==1:
+				if not batch_no:
+					frappe.throw(_("Batch number is mandatory for Item {0}").format(sle.get("item_code")))
+				elif batches.get(batch_no, frappe._dict()).item != sle.get("item_code"):
+					frappe.throw(_("{0} is not a valid Batch Number for Item {1}").format(batch_no, sle.get("item_code")))
+
+			elif item_det.has_batch_no ==0 and batch_no:
+					frappe.throw(_("The Item {0} cannot have Batch").format(sle.get("item_code")))
+
+		if item_det.has_variants:
+			frappe.throw(_("Stock cannot exist for Item {0} since has variants").format(sle.get("item_code")),
+				ItemTemplateCannotHaveStock)
+
+		if batch_no and sle.get("voucher_type") != "Stock Entry" and batches.get(batch_no):
+			expiry_date = batches[batch_no].expiry_date
+			if expiry_date and getdate(sle.get("posting_date")) > getdate(expiry_date):
+				frappe.throw(_("Batch {0} of Item {1} has expired.").format(batch_no, sle.get("item_code")))
+
+		warehouse = warehouses.get(sle.get("warehouse"), frappe._dict())
+		if warehouse.company and warehouse.company != sle.get("company"):
+			from erpnext.stock.utils import InvalidWarehouseCompany
+			frappe.throw(_("Warehouse {0} does not belong to company {1}").format(sle.get("warehouse"),
+				sle.get("company")), InvalidWarehouseCompany)
+
+		if warehouse.is_group:
+			frappe.throw(_("Group node warehouse is not allowed to select for transactions"))
+
+		sle["stock_uom"] = item_det.stock_uom
+		if not sle.get("posting_time") or sle.get("posting_time") == '00:0':
+			sle["posting_time"] = '00:00'
+		sle["posting_datetime"] = get_posting_datetime(sle.get("posting_date"), sle.get("posting_time"))
+
+		# fiscal years of the posting date, a given fiscal year is corrected like in
+		# validate_and_set_fiscal_year
+		key = (getdate(sle.get("posting_date")), sle.get("company"))
+		if key not in fiscal_years:
+			fiscal_years[key] = [d[0] for d in get_fiscal_years(sle.get("posting_date"),
+				label=meta.get_label("posting_date"), company=sle.get("company"))]
+		if sle.get("fiscal_year") not in fiscal_years[key]:
+			sle["fiscal_year"] = fiscal_years[key][0]
+
+def validate_batch_balance(sl_entries):
+	'''Check that batch balance is not negative after the entries are inserted'''
+	for warehouse, item_code, batch_no in set((d.get("warehouse"), d.get("item_code"), d.get("batch_no"))
+		for d in sl_entries if d.get("batch_no")):
+		batch_bal_after_transaction = flt(frappe.db.sql("""select sum(actual_qty)
+			from `tabStock Ledger Entry`
+			where warehouse=%s and item_code=%s and batch_no=%s""",
+			(warehouse, item_code, batch_no))[0][0])
+
+		if batch_bal_after_transaction < 0:
+			frappe.throw(_("Stock balance in Batch {0} will become negative {1} for Item {2} at Warehouse {3}")
+				.format(batch_no, batch_bal_after_transaction, item_code, warehouse))
+
 def on_doctype_update():
 	if not frappe.db.sql("""show index from `tabStock Ledger Entry`
 		where Key_name="posting_sort_index" """):
 		frappe.db.commit()
 		frappe.db.sql("""alter table `tabStock Ledger Entry`
 			add index posting_sort_index(posting_date, posting_time, name)""")
+
+	if not frappe.db.sql("""show index from `tabStock Ledger Entry`
+		where Key_name="item_warehouse_posting_datetime" """):
+		frappe.db.commit()
+		frappe.db.sql("""alter table `tabStock Ledger Entry`
+			add index item_warehouse_posting_datetime(item_code, warehouse, posting_datetime, name)""")
@@ -5,8 +5,123 @@ from __future__ import unicode_literals
 
 import frappe
 import unittest
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.utils import get_posting_datetime
 
 # test_records = frappe.get_test_records('Stock Ledger Entry')
 
 class TestStockLedgerEntry(unittest.TestCase):
-	pass
+	def test_posting_datetime(self):
+		se = make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=1,
+			basic_rate=100, posting_date="2017-01-15", posting_time="10:30:00")
+
+		posting_datetime = frappe.db.get_value("Stock Ledger Entry",
+			{"voucher_type": "Stock Entry", "voucher_no": se.name}, "posting_datetime")
+		self.assertEqual(posting_datetime, get_posting_datetime("2017-01-15", "10:30:00"))
+
+	def test_posting_datetime_index(self):
+		self.assertTrue(frappe.db.sql("""show index from `tabStock Ledger Entry`
+			where Key_name="item_warehouse_posting_datetime" """))
+
+	def test_previous_sle(self):
+		from erpnext.stock.stock_ledger import get_previous_sle
+
+		entries = []
+		for posting_time in ("10:00:00", "11:00:00"):
+			se = make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=1,
+				basic_rate=100, posting_date="2016-01-10", posting_time=posting_time)
+			entries.append(frappe.db.get_value("Stock Ledger Entry",
+				{"voucher_type": "Stock Entry", "voucher_no": se.name},
+				["name", "qty_after_transaction"], as_dict=1))
+
+		args = {
+			"item_code": "_Test Item",
+			"warehouse": "_Test Warehouse - _TC",
+			"posting_date": "2016-01-10"
+		}
+
+		# latest entry on or before the posting time
+		self.assertEqual(get_previous_sle(dict(args, posting_time="10:30:00")).name, entries[0].name)
+		self.assertEqual(get_previous_sle(dict(args, posting_time="11:00:00")).name, entries[1].name)
+
+		# excluding the entry itself
+		previous_sle = get_previous_sle(dict(args, posting_time="11:00:00", sle=entries[1].name))
+		self.assertEqual(previous_sle.name, entries[0].name)
+		self.assertEqual(previous_sle.qty_after_transaction + 1, entries[1].qty_after_transaction)
+
+	def test_bulk_insert(self):
+		'''Transfer makes two entries, they are inserted in bulk and valued like single entries'''
+		from erpnext.stock.utils import get_bin
+
+		make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=10, basic_rate=100)
+		source_qty = get_bin("_Test Item", "_Test Warehouse - _TC").actual_qty
+		target_qty = get_bin("_Test Item", "_Test Warehouse 1 - _TC").actual_qty
+
+		se = make_stock_entry(item_code="_Test Item", source="_Test Warehouse - _TC",
+			target="_Test Warehouse 1 - _TC", qty=5)
+
+		sl_entries = frappe.db.sql("""select name, warehouse, actual_qty, qty_after_transaction,
+				fiscal_year, stock_uom, posting_datetime, docstatus
+			from `tabStock Ledger Entry` where voucher_type='Stock Entry' and voucher_no=%s""",
+			se.name, as_dict=1)
+
+		self.assertEqual(len(sl_entries), 2)
+		self.assertEqual(len(set(d.name for d in sl_entries)), 2)
+
+		for d in sl_entries:
+			self.assertEqual(d.docstatus, 1)
+			self.assertTrue(d.fiscal_year and d.stock_uom and d.posting_datetime)
+			self.assertEqual(d.qty_after_transaction,
+				get_bin("_Test Item", d.warehouse).actual_qty)
+
+		self.assertEqual(get_bin("_Test Item", "_Test Warehouse - _TC").actual_qty, source_qty - 5)
+		self.assertEqual(get_bin("_Test Item", "_Test Warehouse 1 - _TC").actual_qty, target_qty + 5)
+
+	def test_bulk_insert_in_batches(self):
+		'''More entries than one insert query takes, the last batch has a single entry'''
+		from erpnext.utilities.bulk_insert import BULK_INSERT_BATCH_SIZE
+
+		se = make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=1,
+			basic_rate=100, do_not_save=True)
+		for i in xrange(BULK_INSERT_BATCH_SIZE):
+			row = se.get("items")[0].as_dict()
+			row.pop("name")
+			row.pop("idx")
+			se.append("items", row)
+		se.insert()
+		se.submit()
+
+		sl_entries = frappe.db.sql("""select qty_after_transaction, valuation_rate, stock_value
+			from `tabStock Ledger Entry` where voucher_type='Stock Entry' and voucher_no=%s
+			order by name""", se.name, as_dict=1)
+
+		self.assertEqual(len(sl_entries), BULK_INSERT_BATCH_SIZE + 1)
+		for previous, d in zip(sl_entries, sl_entries[1:]):
+			self.assertEqual(d.qty_after_transaction, previous.qty_after_transaction + 1)
+			self.assertTrue(d.valuation_rate > 0)
+
+	def test_master_lookups_are_cached(self):
+		from erpnext.stock.utils import get_master_cache_stats, get_master_value
+
+		se = make_stock_entry(item_code="_Test Item", target="_Test Warehouse - _TC", qty=1,
+			basic_rate=100, do_not_save=True)
+		for i in xrange(19):
+			row = se.get("items")[0].as_dict()
+			row.pop("name")
+			row.pop("idx")
+			se.append("items", row)
+		se.insert()
+
+		before = get_master_cache_stats()
+		se.submit()
+
+		# one lookup each of item, warehouse, company and stock settings for 20 rows
+		self.assertTrue(get_master_cache_stats().misses - before.misses <= 4)
+
+		# cached values are cleared when the master is updated
+		stock_settings = frappe.get_doc("Stock Settings")
+		get_master_value("Stock Settings", None, "valuation_method")
+		before = get_master_cache_stats()
+		stock_settings.save()
+		get_master_value("Stock Settings", None, "valuation_method")
+		self.assertEqual(get_master_cache_stats().misses, before.misses + 1)
@@ -194,9 +194,11 @@ class Warehouse(NestedSet):
 
 	def recalculate_bin_qty(self, new_name):
 		from erpnext.stock.stock_balance import repost_stock
+		from erpnext.stock.utils import clear_master_cache
 		frappe.db.auto_commit_on_many_writes = 1
 		existing_allow_negative_stock = frappe.db.get_value("Stock Settings", None, "allow_negative_stock")
 		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", 1)
+		clear_master_cache()
 
 		repost_stock_for_items = frappe.db.sql_list("""select distinct item_code
 			from tabBin where warehouse=%s""", new_name)
@@ -208,6 +210,7 @@ class Warehouse(NestedSet):
 			repost_stock(item_code, new_name)
 
 		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", existing_allow_negative_stock)
+		clear_master_cache()
 		frappe.db.auto_commit_on_many_writes = 0
 
 	def convert_to_group_or_ledger(self):
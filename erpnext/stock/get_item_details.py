@@ -6,6 +6,7 @@ import frappe
 from frappe import _, throw
 from frappe.utils import flt, cint, add_days, cstr
 import json
+import copy
 from erpnext.accounts.doctype.pricing_rule.pricing_rule import get_pricing_rule_for_item, set_transaction_type
 from erpnext.setup.utils import get_exchange_rate
 from frappe.model.meta import get_field_precision
@@ -34,7 +35,7 @@ def get_item_details(args):
 		}
 	"""
 	args = process_args(args)
-	item_doc = frappe.get_doc("Item", args.item_code)
+	item_doc = get_item_doc(args.item_code)
 	item = item_doc
 
 	validate_item_details(args, item)
@@ -43,11 +44,11 @@ def get_item_details(args):
 
 	get_party_item_code(args, item_doc, out)
 
-	if frappe.db.exists("Product Bundle", args.item_code):
+	bundle_items = get_product_bundle_items(args.item_code)
+	if bundle_items is not None:
 		valuation_rate = 0.0
-		bundled_items = frappe.get_doc("Product Bundle", args.item_code)
 
-		for bundle_item in bundled_items.items:
+		for bundle_item in bundle_items:
 			valuation_rate += \
 				flt(get_valuation_rate(bundle_item.item_code, out.get("warehouse")).get("valuation_rate") \
 					* bundle_item.qty)
@@ -96,6 +97,202 @@ def get_item_details(args):
 
 	return out
 
+@frappe.whitelist()
+def get_item_details_for_items(args, items):
+	"""Returns item details of many rows in one call, in the order of the rows.
+
+	`args` is the header context shared by the rows (company, party, price list,
+	currency, transaction date etc., as in `get_item_details`) and `items` is the
+	list of rows with their item fields. Items, Item Prices, Bins and candidate
+	pricing rules are fetched once for all the rows."""
+	if isinstance(args, basestring):
+		args = json.loads(args)
+	if isinstance(items, basestring):
+		items = json.loads(items)
+
+	args = frappe._dict(args)
+	args.pop("items", None)
+
+	rows = []
+	for item in items:
+		row = frappe._dict(args.copy())
+		row.update(item)
+		rows.append(row)
+
+	frappe.local.item_details_cache = ItemDetailsCache(args, [d.get("item_code") for d in rows])
+	try:
+		return [get_item_details(row) for row in rows]
+	finally:
+		frappe.local.item_details_cache = None
+
+class ItemDetailsCache(object):
+	"""Values fetched once for all rows of `get_item_details_for_items`.
+
+	Only the `taxes`, `customer_items` and `supplier_items` tables of the prefetched
+	Items are loaded. Lookups of items that are not prefetched, e.g. rows set by
+	barcode, fall back to the database."""
+	item_tables = (("taxes", "Item Tax"), ("customer_items", "Item Customer Detail"),
+		("supplier_items", "Item Supplier"))
+
+	def __init__(self, args, item_codes):
+		self.values = {}
+		self.items = {}
+		self.price_list = args.get("price_list") or args.get("selling_price_list") \
+			or args.get("buying_price_list")
+
+		self.prefetch_items(item_codes)
+		self.product_bundles = self.get_product_bundles()
+
+		# valuation rate of a bundle is from its items
+		self.prefetch_items([d.item_code for bundle_items in self.product_bundles.values()
+			for d in bundle_items])
+
+		item_codes = self.items.keys()
+
+		# prices and conversion factors of variants can be from their templates
+		self.price_item_codes = list(set(item_codes
+			+ [d.variant_of for d in self.items.values() if d.variant_of]))
+
+		self.bins = self.get_bins(item_codes)
+		self.item_prices = self.get_item_prices()
+		self.conversion_factors = self.get_conversion_factors()
+		self.purchase_valuation_rates = self.get_purchase_valuation_rates(
+			[d.name for d in self.items.values() if not d.is_stock_item])
+
+	def memoize(self, key, method, *args):
+		if key not in self.values:
+			self.values[key] = method(*args)
+		return self.values[key]
+
+	def prefetch_items(self, item_codes):
+		item_codes = list(set(d for d in item_codes if d and d not in self.items))
+		if not item_codes:
+			return
+
+		items = {}
+		for d in frappe.db.sql("""select * from `tabItem` where name in ({0})""".format(
+			", ".join(["%s"] * len(item_codes))), tuple(item_codes), as_dict=1):
+				d.doctype = "Item"
+				for fieldname, child_doctype in self.item_tables:
+					d[fieldname] = []
+				items[d.name] = d
+
+		if not items:
+			return
+
+		for fieldname, child_doctype in self.item_tables:
+			for d in frappe.db.sql("""select * from `tab{0}`
+				where parenttype='Item' and parentfield=%s and parent in ({1})
+				order by parent, idx""".format(child_doctype, ", ".join(["%s"] * len(items))),
+				tuple([fieldname] + items.keys()), as_dict=1):
+					d.doctype = child_doctype
+					items[d.parent][fieldname].append(d)
+
+		self.items.update(items)
+
+	def get_item_doc(self, item_code):
+		# a new document for every row, the item is updated for variants
+		return frappe.get_doc(copy.deepcopy(self.items[item_code]))
+
+	def get_product_bundles(self):
+		if not self.items:
+			return {}
+
+		product_bundles = dict((name, []) for name in frappe.db.sql_list("""select name
+			from `tabProduct Bundle` where name in ({0})""".format(", ".join(["%s"] * len(self.items))),
+			tuple(self.items.keys())))
+
+		if product_bundles:
+			for d in frappe.db.sql("""select parent, item_code, qty from `tabProduct Bundle Item`
+				where parenttype='Product Bundle' and parent in ({0})
+				order by parent, idx""".format(", ".join(["%s"] * len(product_bundles))),
+				tuple(product_bundles.keys()), as_dict=1):
+					product_bundles[d.parent].append(d)
+
+		return product_bundles
+
+	def get_bins(self, item_codes):
+		if not item_codes:
+			return {}
+
+		return dict(((d.item_code, d.warehouse), d) for d in frappe.db.sql("""select item_code, warehouse,
+				projected_qty, actual_qty, valuation_rate
+			from `tabBin` where item_code in ({0})""".format(", ".join(["%s"] * len(item_codes))),
+			tuple(item_codes), as_dict=1))
+
+	def get_item_prices(self):
+		if not (self.price_list and self.price_item_codes):
+			return {}
+
+		item_prices = {}
+		for item_code, price_list_rate in frappe.db.sql("""select item_code, price_list_rate
+			from `tabItem Price` where price_list=%s and item_code in ({0})
+			order by modified desc""".format(", ".join(["%s"] * len(self.price_item_codes))),
+			tuple([self.price_list] + self.price_item_codes)):
+				item_prices.setdefault(item_code, price_list_rate)
+
+		return item_prices
+
+	def get_conversion_factors(self):
+		if not self.price_item_codes:
+			return {}
+
+		return dict(((parent, uom), conversion_factor) for parent, uom, conversion_factor in frappe.db.sql("""
+			select parent, uom, conversion_factor from `tabUOM Conversion Detail`
+			where parenttype='Item' and parent in ({0})""".format(", ".join(["%s"] * len(self.price_item_codes))),
+			tuple(self.price_item_codes)))
+
+	def get_purchase_valuation_rates(self, item_codes):
+		if not item_codes:
+			return {}
+
+		return dict(frappe.db.sql("""select item_code, sum(base_net_amount) / sum(qty*conversion_factor)
+			from `tabPurchase Invoice Item`
+			where item_code in ({0}) and docstatus=1
+			group by item_code""".format(", ".join(["%s"] * len(item_codes))), tuple(item_codes)))
+
+def get_item_details_cache():
+	"""Returns the cache of the running `get_item_details_for_items` call, if any"""
+	return getattr(frappe.local, "item_details_cache", None)
+
+def get_item_doc(item_code):
+	cache = get_item_details_cache()
+	if cache and item_code in cache.items:
+		return cache.get_item_doc(item_code)
+
+	return frappe.get_doc("Item", item_code)
+
+def get_item_values(item_code, fieldname):
+	"""Returns Item field values like `frappe.db.get_value`, from the cache if the item is prefetched"""
+	cache = get_item_details_cache()
+	if cache and item_code in cache.items:
+		item = cache.items[item_code]
+		if isinstance(fieldname, (list, tuple)):
+			return [item.get(f) for f in fieldname]
+		return item.get(fieldname)
+
+	return frappe.db.get_value("Item", item_code, fieldname)
+
+def get_shared_value(doctype, filters, fieldname):
+	"""Returns `frappe.db.get_value`, memoized for the rows of `get_item_details_for_items`
+	as they share the same party, company and price list"""
+	cache = get_item_details_cache()
+	if not cache:
+		return frappe.db.get_value(doctype, filters, fieldname)
+
+	key = (doctype, json.dumps(filters, sort_keys=True, default=cstr) if isinstance(filters, dict) else filters,
+		tuple(fieldname) if isinstance(fieldname, list) else fieldname)
+	return cache.memoize(key, frappe.db.get_value, doctype, filters, fieldname)
+
+def get_product_bundle_items(item_code):
+	"""Returns items of the Product Bundle of the item, None if the item is not a bundle"""
+	cache = get_item_details_cache()
+	if cache and item_code in cache.items:
+		return cache.product_bundles.get(item_code)
+
+	if frappe.db.exists("Product Bundle", item_code):
+		return frappe.get_doc("Product Bundle", item_code).items
+
 def process_args(args):
 	if isinstance(args, basestring):
 		args = json.loads(args)
@@ -203,9 +400,9 @@ def get_basic_details(args, item):
 		["Account", "expense_account", "default_expense_account"],
 		["Cost Center", "cost_center", "cost_center"],
 		["Warehouse", "warehouse", ""]]:
-			company = frappe.db.get_value(d[0], out.get(d[1]), "company")
+			company = get_shared_value(d[0], out.get(d[1]), "company")
 			if not out[d[1]] or (company and args.company != company):
-				out[d[1]] = frappe.db.get_value("Company", args.company, d[2]) if d[2] else None
+				out[d[1]] = get_shared_value("Company", args.company, d[2]) if d[2] else None
 
 	for fieldname in ("item_name", "item_group", "barcode", "brand", "stock_uom"):
 		out[fieldname] = item.get(fieldname)
@@ -215,17 +412,17 @@ def get_basic_details(args, item):
 def get_default_income_account(args, item):
 	return (item.income_account
 		or args.income_account
-		or frappe.db.get_value("Item Group", item.item_group, "default_income_account"))
+		or get_shared_value("Item Group", item.item_group, "default_income_account"))
 
 def get_default_expense_account(args, item):
 	return (item.expense_account
 		or args.expense_account
-		or frappe.db.get_value("Item Group", item.item_group, "default_expense_account"))
+		or get_shared_value("Item Group", item.item_group, "default_expense_account"))
 
 def get_default_cost_center(args, item):
-	return (frappe.db.get_value("Project", args.get("project"), "cost_center")
+	return (get_shared_value("Project", args.get("project"), "cost_center")
 		or (item.selling_cost_center if args.get("customer") else item.buying_cost_center)
-		or frappe.db.get_value("Item Group", item.item_group, "default_cost_center")
+		or get_shared_value("Item Group", item.item_group, "default_cost_center")
 		or args.get("cost_center"))
 
 def get_price_list_rate(args, item_doc, out):
@@ -287,13 +484,17 @@ def insert_item_price(args):
 					args.price_list))
 
 def get_price_list_rate_for(price_list, item_code):
+	cache = get_item_details_cache()
+	if cache and price_list == cache.price_list and item_code in cache.price_item_codes:
+		return cache.item_prices.get(item_code)
+
 	return frappe.db.get_value("Item Price",
 			{"price_list": price_list, "item_code": item_code}, "price_list_rate")
 
 def validate_price_list(args):
 	if args.get("price_list"):
-		if not frappe.db.get_value("Price List",
-			{"name": args.price_list, args.transaction_type: 1, "enabled": 1}):
+		if not get_shared_value("Price List",
+			{"name": args.price_list, args.transaction_type: 1, "enabled": 1}, "name"):
 			throw(_("Price List {0} is disabled or does not exist").format(args.price_list))
 	elif not args.get("supplier"):
 		throw(_("Price List not selected"))
@@ -302,7 +503,7 @@ def validate_conversion_rate(args, meta):
 	from erpnext.controllers.accounts_controller import validate_conversion_rate
 
 	if (not args.conversion_rate
-		and args.currency==frappe.db.get_value("Company", args.company, "default_currency")):
+		and args.currency==get_shared_value("Company", args.company, "default_currency")):
 		args.conversion_rate = 1.0
 
 	# validate currency conversion rate
@@ -374,6 +575,12 @@ def get_serial_nos_by_fifo(args):
 
 @frappe.whitelist()
 def get_conversion_factor(item_code, uom):
+	cache = get_item_details_cache()
+	if cache and item_code in cache.items:
+		variant_of = cache.items[item_code].variant_of
+		return {"conversion_factor": cache.conversion_factors.get((item_code, uom))
+			or (cache.conversion_factors.get((variant_of, uom)) if variant_of else None)}
+
 	variant_of = frappe.db.get_value("Item", item_code, "variant_of")
 	filters = {"parent": item_code, "uom": uom}
 	if variant_of:
@@ -388,6 +595,12 @@ def get_projected_qty(item_code, warehouse):
 
 @frappe.whitelist()
 def get_bin_details(item_code, warehouse):
+	cache = get_item_details_cache()
+	if cache and item_code in cache.items:
+		bin = cache.bins.get((item_code, warehouse))
+		return frappe._dict({"projected_qty": bin.projected_qty, "actual_qty": bin.actual_qty}) \
+			if bin else {"projected_qty": 0, "actual_qty": 0}
+
 	return frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
 			["projected_qty", "actual_qty"], as_dict=True) \
 			or {"projected_qty": 0, "actual_qty": 0}
@@ -471,7 +684,7 @@ def apply_price_list(args, as_doc=False):
 
 def apply_price_list_on_item(args):
 	item_details = frappe._dict()
-	item_doc = frappe.get_doc("Item", args.item_code)
+	item_doc = get_item_doc(args.item_code)
 	get_price_list_rate(args, item_doc, item_details)
 
 	item_details.update(get_pricing_rule_for_item(args))
@@ -516,15 +729,28 @@ def get_default_bom(item_code=None):
 			frappe.throw(_("No default BOM exists for Item {0}").format(item_code))
 
 def get_valuation_rate(item_code, warehouse=None):
-	item = frappe.get_doc("Item", item_code)
+	cache = get_item_details_cache()
+	if cache and item_code in cache.items:
+		item = cache.items[item_code]
+	else:
+		cache = None
+		item = frappe.get_doc("Item", item_code)
+
 	if item.is_stock_item:
 		if not warehouse:
 			warehouse = item.default_warehouse
 
+		if cache:
+			bin = cache.bins.get((item_code, warehouse))
+			return {"valuation_rate": bin.valuation_rate} if bin else {"valuation_rate": 0}
+
 		return frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
 			["valuation_rate"], as_dict=True) or {"valuation_rate": 0}
 
 	elif not item.is_stock_item:
+		if cache:
+			return {"valuation_rate": cache.purchase_valuation_rates.get(item_code) or 0.0}
+
 		valuation_rate =frappe.db.sql("""select sum(base_net_amount) / sum(qty*conversion_factor)
 			from `tabPurchase Invoice Item`
 			where item_code = %s and docstatus=1""", item_code)
@@ -4,7 +4,9 @@
 from __future__ import unicode_literals
 import frappe
 from frappe import _
-from frappe.utils import date_diff, flt
+from frappe.utils import date_diff, flt, getdate
+from datetime import date
+from erpnext.stock.valuation import FIFOQueue
 
 def execute(filters=None):
 
@@ -18,8 +20,8 @@ def execute(filters=None):
 		if not fifo_queue: continue
 
 		average_age = get_average_age(fifo_queue, to_date)
-		earliest_age = date_diff(to_date, fifo_queue[0][1])
-		latest_age = date_diff(to_date, fifo_queue[-1][1])
+		earliest_age = date_diff(to_date, get_date_from_ordinal(fifo_queue[0][1]))
+		latest_age = date_diff(to_date, get_date_from_ordinal(fifo_queue[-1][1]))
 
 		data.append([item, details.item_name, details.description, details.item_group,
 			details.brand, average_age, earliest_age, latest_age, details.stock_uom])
@@ -27,13 +29,15 @@ def execute(filters=None):
 	return columns, data
 
 def get_average_age(fifo_queue, to_date):
-	batch_age = age_qty = total_qty = 0.0
-	for batch in fifo_queue:
-		batch_age = date_diff(to_date, batch[1])
-		age_qty += batch_age * batch[0]
-		total_qty += batch[0]
+	"""Qty weighted average age of batches. The queue holds [qty, posting date ordinal]
+	batches, so the running total value of the queue is sum(qty * ordinal)"""
+	if not fifo_queue.total_qty:
+		return 0.0
 
-	return (age_qty / total_qty) if total_qty else 0.0
+	return getdate(to_date).toordinal() - (fifo_queue.total_value / fifo_queue.total_qty)
+
+def get_date_from_ordinal(ordinal):
+	return date.fromordinal(int(ordinal))
 
 def get_columns():
 	return [_("Item Code") + ":Link/Item:100", _("Item Name") + "::100", _("Description") + "::200",
@@ -43,27 +47,16 @@ def get_columns():
 def get_fifo_queue(filters):
 	item_details = {}
 	for d in get_stock_ledger_entries(filters):
-		item_details.setdefault(d.name, {"details": d, "fifo_queue": []})
+		item_details.setdefault(d.name, {"details": d, "fifo_queue": FIFOQueue()})
 		fifo_queue = item_details[d.name]["fifo_queue"]
 
 		if d.voucher_type == "Stock Reconciliation":
 			d.actual_qty = flt(d.qty_after_transaction) - flt(item_details[d.name].get("qty_after_transaction", 0))
 
 		if d.actual_qty > 0:
-			fifo_queue.append([d.actual_qty, d.posting_date])
+			fifo_queue.append(d.actual_qty, getdate(d.posting_date).toordinal())
 		else:
-			qty_to_pop = abs(d.actual_qty)
-			while qty_to_pop:
-				batch = fifo_queue[0] if fifo_queue else [0, None]
-				if 0 < batch[0] <= qty_to_pop:
-					# if batch qty > 0
-					# not enough or exactly same qty in current batch, clear batch
-					qty_to_pop -= batch[0]
-					fifo_queue.pop(0)
-				else:
-					# all from current batch
-					batch[0] -= qty_to_pop
-					qty_to_pop = 0
+			fifo_queue.consume(abs(d.actual_qty))
 
 		item_details[d.name]["qty_after_transaction"] = d.qty_after_transaction
 
@@ -3,38 +3,140 @@
 
 from __future__ import unicode_literals
 import frappe
+import os, json, zlib
 
-from frappe.utils import flt, cstr, nowdate, nowtime
-from erpnext.stock.utils import update_bin
+from frappe.utils import flt, cstr, cint, nowdate, nowtime
+from erpnext.stock.utils import update_bin, get_posting_datetime, clear_master_cache
 from erpnext.stock.stock_ledger import update_entries_after
 
-def repost(only_actual=False, allow_negative_stock=False, allow_zero_rate=False, only_bin=False):
+def repost(only_actual=False, allow_negative_stock=False, allow_zero_rate=False, only_bin=False,
+	workers=1, checkpoint_file=None):
 	"""
 	Repost everything!
+
+	Item / warehouse pairs are independent of each other, so they are split
+	into partitions (by item) and reposted by `workers` processes.
+
+	If `checkpoint_file` is given, every reposted pair is appended to it and
+	pairs already in the file are skipped, so an interrupted repost can be resumed.
+
+	Returns a report of reposted and failed pairs for every partition.
 	"""
 	frappe.db.auto_commit_on_many_writes = 1
 
 	if allow_negative_stock:
 		existing_allow_negative_stock = frappe.db.get_value("Stock Settings", None, "allow_negative_stock")
 		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", 1)
+		clear_master_cache()
+		frappe.db.commit()
 
-	for d in frappe.db.sql("""select distinct item_code, warehouse from
+	done = get_reposted_pairs(checkpoint_file)
+	item_warehouses = [d for d in frappe.db.sql("""select distinct item_code, warehouse from
 		(select item_code, warehouse from tabBin
 		union
-		select item_code, warehouse from `tabStock Ledger Entry`) a"""):
-			try:
-				repost_stock(d[0], d[1], allow_zero_rate, only_actual, only_bin)
-				frappe.db.commit()
-			except:
-				frappe.db.rollback()
+		select item_code, warehouse from `tabStock Ledger Entry`) a""") if tuple(d) not in done]
+
+	workers = max(cint(workers), 1)
+	partitions = get_partitions(item_warehouses, workers)
+	args = [frappe._dict({
+		"partition": i,
+		"item_warehouses": partition,
+		"allow_zero_rate": allow_zero_rate,
+		"only_actual": only_actual,
+		"only_bin": only_bin,
+		"checkpoint_file": checkpoint_file
+	}) for i, partition in enumerate(partitions)]
+
+	report = []
+	if workers == 1:
+		for partition_args in args:
+			report.append(repost_partition(partition_args))
+			print_partition_progress(report[-1], len(partitions))
+	else:
+		from multiprocessing import Pool
+
+		# workers open their own connections, do not share the socket with forked processes
+		frappe.db.commit()
+		frappe.db.close()
+
+		pool = Pool(workers, initializer=init_repost_worker,
+			initargs=(frappe.local.site, frappe.local.sites_path))
+		try:
+			for partition_report in pool.imap_unordered(repost_partition, args):
+				report.append(partition_report)
+				print_partition_progress(partition_report, len(partitions))
+		finally:
+			pool.close()
+			pool.join()
 
 	if allow_negative_stock:
 		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", existing_allow_negative_stock)
+		clear_master_cache()
 	frappe.db.auto_commit_on_many_writes = 0
 
-def repost_stock(item_code, warehouse, allow_zero_rate=False, only_actual=False, only_bin=False):
+	return sorted(report, key=lambda d: d.partition)
+
+def get_partitions(item_warehouses, no_of_partitions):
+	"""Split item / warehouse pairs in partitions, keeping all warehouses of an item together"""
+	partitions = [[] for i in xrange(no_of_partitions)]
+	for item_code, warehouse in item_warehouses:
+		partitions[zlib.crc32(cstr(item_code).encode("utf-8")) % no_of_partitions].append((item_code, warehouse))
+
+	return [d for d in partitions if d]
+
+def init_repost_worker(site, sites_path):
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	frappe.db.auto_commit_on_many_writes = 1
+
+def repost_partition(args):
+	"""Repost item / warehouse pairs of a partition, commit after each pair"""
+	report = frappe._dict({
+		"partition": args.partition,
+		"total": len(args.item_warehouses),
+		"reposted": 0,
+		"failed": []
+	})
+
+	for item_code, warehouse in args.item_warehouses:
+		try:
+			repost_stock(item_code, warehouse, args.allow_zero_rate, args.only_actual, args.only_bin,
+				raise_exception=True)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			report.failed.append([item_code, warehouse, frappe.get_traceback()])
+		else:
+			report.reposted += 1
+			update_checkpoint(args.checkpoint_file, item_code, warehouse)
+
+	return report
+
+def get_reposted_pairs(checkpoint_file):
+	reposted = set()
+	if checkpoint_file and os.path.exists(checkpoint_file):
+		with open(checkpoint_file, "r") as f:
+			for line in f:
+				if line.strip():
+					reposted.add(tuple(json.loads(line)))
+	return reposted
+
+def update_checkpoint(checkpoint_file, item_code, warehouse):
+	if checkpoint_file:
+		# one line per pair, appends are safe across worker processes
+		with open(checkpoint_file, "a") as f:
+			f.write(json.dumps([item_code, warehouse]) + "\n")
+
+def print_partition_progress(report, no_of_partitions):
+	print "Partition {0}/{1}: {2}/{3} reposted, {4} failed".format(report.partition + 1,
+		no_of_partitions, report.reposted, report.total, len(report.failed))
+	for item_code, warehouse, error in report.failed:
+		print item_code, warehouse, error.strip().splitlines()[-1]
+
+def repost_stock(item_code, warehouse, allow_zero_rate=False, only_actual=False, only_bin=False,
+	raise_exception=False):
 	if not only_bin:
-		repost_actual_qty(item_code, warehouse, allow_zero_rate)
+		repost_actual_qty(item_code, warehouse, allow_zero_rate, raise_exception)
 
 	if item_code and warehouse and not only_actual:
 		qty_dict = {
@@ -50,16 +152,17 @@ def repost_stock(item_code, warehouse, allow_zero_rate=False, only_actual=False,
 
 		update_bin_qty(item_code, warehouse, qty_dict)
 
-def repost_actual_qty(item_code, warehouse, allow_zero_rate=False):
+def repost_actual_qty(item_code, warehouse, allow_zero_rate=False, raise_exception=False):
 	try:
 		update_entries_after({ "item_code": item_code, "warehouse": warehouse }, allow_zero_rate)
 	except:
-		pass
+		if raise_exception:
+			raise
 
 def get_balance_qty_from_sle(item_code, warehouse):
 	balance_qty = frappe.db.sql("""select qty_after_transaction from `tabStock Ledger Entry`
 		where item_code=%s and warehouse=%s and is_cancelled='No'
-		order by posting_date desc, posting_time desc, name desc
+		order by posting_datetime desc, name desc
 		limit 1""", (item_code, warehouse))
 
 	return flt(balance_qty[0][0]) if balance_qty else 0.0
@@ -183,6 +286,7 @@ def set_stock_balance_as_per_serial_no(item_code=None, posting_date=None, postin
 			'transaction_date'	 		: nowdate(),
 			'posting_date'				: posting_date,
 			'posting_time'			 	: posting_time,
+			'posting_datetime'			: get_posting_datetime(posting_date, posting_time),
 			'voucher_type'			 	: 'Stock Reconciliation (Manual)',
 			'voucher_no'				: '',
 			'voucher_detail_no'			: '',
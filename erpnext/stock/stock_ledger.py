@@ -5,40 +5,75 @@ from __future__ import unicode_literals
 import frappe, erpnext
 from frappe import _
 from frappe.utils import cint, flt, cstr, now
-from erpnext.stock.utils import get_valuation_method
-import json
+from erpnext.stock.utils import get_valuation_method, get_posting_datetime, get_master_value, \
+	clear_master_cache
+from erpnext.stock.valuation import FIFOQueue
+from erpnext.utilities.bulk_insert import insert_submitted_docs
+from erpnext.stock.doctype.stock_balance_snapshot.stock_balance_snapshot import update_snapshots
+from erpnext.stock.doctype.bin.bin import projected_qty_sql, queue_item_projected_qty_update, \
+	update_items_projected_qty
 
 # future reposting
 class NegativeStockError(frappe.ValidationError): pass
 
+# number of reposted Stock Ledger Entries written back per query
+SLE_UPDATE_BATCH_SIZE = 200
+sle_value_fields = ("qty_after_transaction", "valuation_rate", "stock_value",
+	"stock_queue", "stock_value_difference")
+
+# vouchers with at least these many plain entries are inserted in bulk
+BULK_INSERT_MIN_ENTRIES = 2
+bin_qty_fields = ("actual_qty", "ordered_qty", "reserved_qty", "indented_qty", "planned_qty")
+
 _exceptions = frappe.local('stockledger_exceptions')
 # _exceptions = []
 
 def make_sl_entries(sl_entries, is_amended=None, allow_negative_stock=False, via_landed_cost_voucher=False):
 	if sl_entries:
-		from erpnext.stock.utils import update_bin
-
-		cancel = True if sl_entries[0].get("is_cancelled") == "Yes" else False
-		if cancel:
-			set_as_cancel(sl_entries[0].get('voucher_no'), sl_entries[0].get('voucher_type'))
-
-		for sle in sl_entries:
-			sle_id = None
-			if sle.get('is_cancelled') == 'Yes':
-				sle['actual_qty'] = -flt(sle['actual_qty'])
-
-			if sle.get("actual_qty") or sle.get("voucher_type")=="Stock Reconciliation":
-				sle_id = make_entry(sle, allow_negative_stock, via_landed_cost_voucher)
-
-			args = sle.copy()
-			args.update({
-				"sle_id": sle_id,
-				"is_amended": is_amended
-			})
-			update_bin(args, allow_negative_stock, via_landed_cost_voucher)
+		# masters may have been changed directly in the database since the last voucher
+		clear_master_cache()
+
+		# total projected qty of items is updated once, after all bins are updated
+		frappe.flags.items_to_update_projected_qty = set()
+		try:
+			make_entries_and_update_bins(sl_entries, is_amended, allow_negative_stock, via_landed_cost_voucher)
+			update_items_projected_qty(frappe.flags.items_to_update_projected_qty)
+		finally:
+			frappe.flags.items_to_update_projected_qty = None
+
+def make_entries_and_update_bins(sl_entries, is_amended=None, allow_negative_stock=False,
+	via_landed_cost_voucher=False):
+	from erpnext.stock.utils import update_bin
+
+	cancel = True if sl_entries[0].get("is_cancelled") == "Yes" else False
+	if cancel:
+		set_as_cancel(sl_entries[0].get('voucher_no'), sl_entries[0].get('voucher_type'))
+
+	bulk_entries = [] if cancel else get_entries_for_bulk_insert(sl_entries)
+	if bulk_entries:
+		make_entries_in_bulk(bulk_entries, is_amended, allow_negative_stock, via_landed_cost_voucher)
+
+	bulk_entry_ids = set(id(sle) for sle in bulk_entries)
+	for sle in sl_entries:
+		if id(sle) in bulk_entry_ids:
+			continue
+
+		sle_id = None
+		if sle.get('is_cancelled') == 'Yes':
+			sle['actual_qty'] = -flt(sle['actual_qty'])
+
+		if sle.get("actual_qty") or sle.get("voucher_type")=="Stock Reconciliation":
+			sle_id = make_entry(sle, allow_negative_stock, via_landed_cost_voucher)
+
+		args = sle.copy()
+		args.update({
+			"sle_id": sle_id,
+			"is_amended": is_amended
+		})
+		update_bin(args, allow_negative_stock, via_landed_cost_voucher)
 
-		if cancel:
-			delete_cancelled_entry(sl_entries[0].get('voucher_type'), sl_entries[0].get('voucher_no'))
+	if cancel:
+		delete_cancelled_entry(sl_entries[0].get('voucher_type'), sl_entries[0].get('voucher_no'))
 
 def set_as_cancel(voucher_type, voucher_no):
 	frappe.db.sql("""update `tabStock Ledger Entry` set is_cancelled='Yes',
@@ -56,6 +91,69 @@ def make_entry(args, allow_negative_stock=False, via_landed_cost_voucher=False):
 	sle.submit()
 	return sle.name
 
+def get_entries_for_bulk_insert(sl_entries):
+	"""Returns entries that can be inserted without a document per entry.
+
+	Serialized items and Stock Reconciliation need per entry validation and
+	are left to `make_entry`."""
+	entries = [sle for sle in sl_entries if sle.get("actual_qty") and not sle.get("serial_no")
+		and sle.get("voucher_type") != "Stock Reconciliation"]
+	if len(entries) < BULK_INSERT_MIN_ENTRIES:
+		return []
+
+	items = list(set(sle.get("item_code") for sle in entries))
+	serialized_items = frappe.db.sql_list("""select name from tabItem
+		where has_serial_no=1 and name in ({0})""".format(", ".join(["%s"] * len(items))), tuple(items))
+
+	entries = [sle for sle in entries if sle.get("item_code") not in serialized_items]
+	return entries if len(entries) >= BULK_INSERT_MIN_ENTRIES else []
+
+def make_entries_in_bulk(sl_entries, is_amended=None, allow_negative_stock=False, via_landed_cost_voucher=False):
+	"""Insert Stock Ledger Entries with multi-row inserts, then update the bin
+	and repost future entries once per item and warehouse"""
+	from erpnext.stock.utils import update_bin
+	from erpnext.stock.doctype.stock_ledger_entry.stock_ledger_entry import \
+		validate_bulk_entries, validate_batch_balance
+
+	validate_bulk_entries(sl_entries)
+	insert_entries(sl_entries)
+
+	if not allow_negative_stock:
+		validate_batch_balance(sl_entries)
+
+	bin_args = {}
+	for sle in sorted(sl_entries, key=lambda d: (d.get("posting_datetime"), d.get("name"))):
+		key = (sle.get("item_code"), sle.get("warehouse"))
+		if key not in bin_args:
+			# repost from the earliest entry of the item / warehouse
+			args = bin_args[key] = sle.copy()
+			args.update({
+				"sle_id": sle.get("name"),
+				"is_amended": is_amended
+			})
+			for fieldname in bin_qty_fields:
+				args[fieldname] = 0.0
+
+		for fieldname in bin_qty_fields:
+			bin_args[key][fieldname] += flt(sle.get(fieldname))
+
+	for sle in sl_entries:
+		args = bin_args.pop((sle.get("item_code"), sle.get("warehouse")), None)
+		if args:
+			update_bin(args, allow_negative_stock, via_landed_cost_voucher)
+
+def insert_entries(sl_entries):
+	"""Insert validated entries as submitted Stock Ledger Entries, sets name of each entry"""
+	for sle in sl_entries:
+		sle["is_cancelled"] = sle.get("is_cancelled") or "No"
+
+		# values are set when the entries are reposted, columns are not null
+		for fieldname in ("actual_qty", "incoming_rate", "outgoing_rate") + sle_value_fields:
+			if fieldname != "stock_queue":
+				sle[fieldname] = flt(sle.get(fieldname))
+
+	insert_submitted_docs("Stock Ledger Entry", sl_entries, "SLE/", 8)
+
 def delete_cancelled_entry(voucher_type, voucher_no):
 	frappe.db.sql("""delete from `tabStock Ledger Entry`
 		where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no))
@@ -73,17 +171,23 @@ class update_entries_after(object):
 				"posting_date": "2012-12-12",
 				"posting_time": "12:00"
 			}
+
+		If `repost_future_entries` is False, only entries up to the current
+		time-bucket are valued and the Bin is left as is, future entries are
+		reposted later via Repost Item Valuation
 	"""
-	def __init__(self, args, allow_zero_rate=False, allow_negative_stock=None, via_landed_cost_voucher=False, verbose=1):
+	def __init__(self, args, allow_zero_rate=False, allow_negative_stock=None, via_landed_cost_voucher=False,
+		verbose=1, repost_future_entries=True):
 		from frappe.model.meta import get_field_precision
 
 		self.exceptions = []
 		self.verbose = verbose
+		self.repost_future_entries = repost_future_entries
 		self.allow_zero_rate = allow_zero_rate
 		self.allow_negative_stock = allow_negative_stock
 		self.via_landed_cost_voucher = via_landed_cost_voucher
 		if not self.allow_negative_stock:
-			self.allow_negative_stock = cint(frappe.db.get_single_value("Stock Settings",
+			self.allow_negative_stock = cint(get_master_value("Stock Settings", None,
 				"allow_negative_stock"))
 
 		self.args = args
@@ -96,27 +200,41 @@ class update_entries_after(object):
 		for key in ("qty_after_transaction", "valuation_rate", "stock_value"):
 			setattr(self, key, flt(self.previous_sle.get(key)))
 
-		self.company = frappe.db.get_value("Warehouse", self.warehouse, "company")
+		self.company = get_master_value("Warehouse", self.warehouse, "company")
 		self.precision = get_field_precision(frappe.get_meta("Stock Ledger Entry").get_field("stock_value"),
-			currency=frappe.db.get_value("Company", self.company, "default_currency", cache=True))
+			currency=get_master_value("Company", self.company, "default_currency"))
 
 		self.prev_stock_value = self.previous_sle.stock_value or 0.0
-		self.stock_queue = json.loads(self.previous_sle.stock_queue or "[]")
+		self.stock_queue = FIFOQueue.loads(self.previous_sle.stock_queue)
 		self.valuation_method = get_valuation_method(self.item_code)
 		self.stock_value_difference = 0.0
+
+		# recalculated entries are written back in chunks, see `update_sle_values`
+		self.sle_updates = []
 		self.build()
 
 	def build(self):
 		# includes current entry!
 		entries_to_fix = self.get_sle_after_datetime()
 
+		if not self.repost_future_entries:
+			current_timestamp = get_posting_datetime(self.args.get("posting_date"),
+				self.args.get("posting_time"))
+
 		for sle in entries_to_fix:
+			if not self.repost_future_entries and sle.timestamp > current_timestamp:
+				break
 			self.process_sle(sle)
 
+		self.flush_sle_updates()
+
 		if self.exceptions:
 			self.raise_exceptions()
 
-		self.update_bin()
+		if self.repost_future_entries:
+			self.update_bin()
+			update_snapshots(self.item_code, self.warehouse, self.args.get("posting_date"),
+				self.previous_sle, entries_to_fix)
 
 	def update_bin(self):
 		# update bin
@@ -132,17 +250,15 @@ class update_entries_after(object):
 				"warehouse": self.warehouse
 			})
 			bin_doc.insert(ignore_permissions=True)
-		else:
-			bin_doc = frappe.get_doc("Bin", bin_name)
+			bin_name = bin_doc.name
 
-		bin_doc.update({
-			"valuation_rate": self.valuation_rate,
-			"actual_qty": self.qty_after_transaction,
-			"stock_value": self.stock_value
-		})
-		bin_doc.flags.via_stock_ledger_entry = True
+		frappe.db.sql("""update `tabBin` set valuation_rate=%s, actual_qty=%s, stock_value=%s,
+				{0}, modified=%s, modified_by=%s
+			where name=%s""".format(projected_qty_sql),
+			(self.valuation_rate, self.qty_after_transaction, self.stock_value,
+				now(), frappe.session.user, bin_name))
 
-		bin_doc.save(ignore_permissions=True)
+		queue_item_projected_qty_update(self.item_code)
 
 	def process_sle(self, sle):
 		if (sle.serial_no and not self.via_landed_cost_voucher) or not cint(self.allow_negative_stock):
@@ -161,7 +277,7 @@ class update_entries_after(object):
 				# assert
 				self.valuation_rate = sle.valuation_rate
 				self.qty_after_transaction = sle.qty_after_transaction
-				self.stock_queue = [[self.qty_after_transaction, self.valuation_rate]]
+				self.stock_queue.reset(self.qty_after_transaction, self.valuation_rate)
 				self.stock_value = flt(self.qty_after_transaction) * flt(self.valuation_rate)
 			else:
 				if self.valuation_method == "Moving Average":
@@ -171,7 +287,7 @@ class update_entries_after(object):
 				else:
 					self.get_fifo_values(sle)
 					self.qty_after_transaction += flt(sle.actual_qty)
-					self.stock_value = sum((flt(batch[0]) * flt(batch[1]) for batch in self.stock_queue))
+					self.stock_value = self.stock_queue.total_value
 
 		# rounding as per precision
 		self.stock_value = flt(self.stock_value, self.precision)
@@ -183,10 +299,18 @@ class update_entries_after(object):
 		sle.qty_after_transaction = self.qty_after_transaction
 		sle.valuation_rate = self.valuation_rate
 		sle.stock_value = self.stock_value
-		sle.stock_queue = json.dumps(self.stock_queue)
+		sle.stock_queue = self.stock_queue.dumps()
 		sle.stock_value_difference = stock_value_difference
-		sle.doctype="Stock Ledger Entry"
-		frappe.get_doc(sle).db_update()
+		self.sle_updates.append(sle)
+
+		if len(self.sle_updates) >= SLE_UPDATE_BATCH_SIZE:
+			self.flush_sle_updates()
+
+	def flush_sle_updates(self):
+		"""write pending recalculated values of future entries to the database"""
+		if self.sle_updates:
+			update_sle_values(self.sle_updates)
+			self.sle_updates = []
 
 	def validate_negative_stock(self, sle):
 		"""
@@ -264,6 +388,7 @@ class update_entries_after(object):
 			if not self.valuation_rate and sle.voucher_detail_no:
 				allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
 				if not allow_zero_valuation_rate:
+					self.flush_sle_updates()
 					self.valuation_rate = get_valuation_rate(sle.item_code, sle.warehouse,
 						sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
 						currency=erpnext.get_company_currency(sle.company))
@@ -274,76 +399,27 @@ class update_entries_after(object):
 		outgoing_rate = flt(sle.outgoing_rate)
 
 		if actual_qty > 0:
-			if not self.stock_queue:
-				self.stock_queue.append([0, 0])
-
-			# last row has the same rate, just updated the qty
-			if self.stock_queue[-1][1]==incoming_rate:
-				self.stock_queue[-1][0] += actual_qty
-			else:
-				if self.stock_queue[-1][0] > 0:
-					self.stock_queue.append([actual_qty, incoming_rate])
-				else:
-					qty = self.stock_queue[-1][0] + actual_qty
-					self.stock_queue[-1] = [qty, incoming_rate]
+			self.stock_queue.add_stock(actual_qty, incoming_rate)
 		else:
-			qty_to_pop = abs(actual_qty)
-			while qty_to_pop:
-				if not self.stock_queue:
-					# Get valuation rate from last sle if exists or from valuation rate field in item master
-					allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
-					if not allow_zero_valuation_rate:
-						_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-							sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-							currency=erpnext.get_company_currency(sle.company))
-					else:
-						_rate = 0
-
-					self.stock_queue.append([0, _rate])
-
-				index = None
-				if outgoing_rate > 0:
-					# Find the entry where rate matched with outgoing rate
-					for i, v in enumerate(self.stock_queue):
-						if v[1] == outgoing_rate:
-							index = i
-							break
-
-					# If no entry found with outgoing rate, collapse stack
-					if index == None:
-						new_stock_value = sum((d[0]*d[1] for d in self.stock_queue)) - qty_to_pop*outgoing_rate
-						new_stock_qty = sum((d[0] for d in self.stock_queue)) - qty_to_pop
-						self.stock_queue = [[new_stock_qty, new_stock_value/new_stock_qty if new_stock_qty > 0 else outgoing_rate]]
-						break
-				else:
-					index = 0
-
-				# select first batch or the batch with same rate
-				batch = self.stock_queue[index]
-				if qty_to_pop >= batch[0]:
-					# consume current batch
-					qty_to_pop = qty_to_pop - batch[0]
-					self.stock_queue.pop(index)
-					if not self.stock_queue and qty_to_pop:
-						# stock finished, qty still remains to be withdrawn
-						# negative stock, keep in as a negative batch
-						self.stock_queue.append([-qty_to_pop, outgoing_rate or batch[1]])
-						break
+			self.stock_queue.remove_stock(abs(actual_qty), outgoing_rate,
+				rate_generator=lambda: self.get_rate_for_empty_queue(sle))
 
-				else:
-					# qty found in current batch
-					# consume it and exit
-					batch[0] = batch[0] - qty_to_pop
-					qty_to_pop = 0
+		if self.stock_queue.total_qty:
+			self.valuation_rate = self.stock_queue.total_value / flt(self.stock_queue.total_qty)
 
-		stock_value = sum((flt(batch[0]) * flt(batch[1]) for batch in self.stock_queue))
-		stock_qty = sum((flt(batch[0]) for batch in self.stock_queue))
+		if not self.stock_queue:
+			self.stock_queue.append(0, sle.incoming_rate or sle.outgoing_rate or self.valuation_rate)
 
-		if stock_qty:
-			self.valuation_rate = stock_value / flt(stock_qty)
+	def get_rate_for_empty_queue(self, sle):
+		# Get valuation rate from last sle if exists or from valuation rate field in item master
+		allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
+		if allow_zero_valuation_rate:
+			return 0
 
-		if not self.stock_queue:
-			self.stock_queue.append([0, sle.incoming_rate or sle.outgoing_rate or self.valuation_rate])
+		self.flush_sle_updates()
+		return get_valuation_rate(sle.item_code, sle.warehouse,
+			sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
+			currency=erpnext.get_company_currency(sle.company))
 
 	def check_if_allow_zero_valuation_rate(self, voucher_type, voucher_detail_no):
 		ref_item_dt = voucher_type + (" Detail" if voucher_type == "Stock Entry" else " Item")
@@ -380,6 +456,29 @@ class update_entries_after(object):
 		else:
 			raise NegativeStockError, msg
 
+def update_sle_values(entries):
+	"""Write recalculated values of reposted Stock Ledger Entries in one multi-row update
+
+		update `tabStock Ledger Entry` set
+			stock_value = case name when 'SLE-1' then 10 when 'SLE-2' then 20 end, ...
+		where name in ('SLE-1', 'SLE-2')
+	"""
+	if not entries:
+		return
+
+	set_clauses, values = [], []
+	for fieldname in sle_value_fields:
+		set_clauses.append("`{0}` = case name {1} end".format(fieldname,
+			" ".join(["when %s then %s"] * len(entries))))
+		for sle in entries:
+			values.extend([sle.name, sle.get(fieldname)])
+
+	values.extend([sle.name for sle in entries])
+
+	frappe.db.sql("""update `tabStock Ledger Entry` set {0}
+		where name in ({1})""".format(", ".join(set_clauses), ", ".join(["%s"] * len(entries))),
+		tuple(values))
+
 def get_previous_sle(args, for_update=False):
 	"""
 		get the last sle on or before the current time-bucket,
@@ -400,21 +499,24 @@ def get_previous_sle(args, for_update=False):
 
 def get_stock_ledger_entries(previous_sle, operator=None, order="desc", limit=None, for_update=False, debug=False):
 	"""get stock ledger entries filtered by specific posting datetime conditions"""
-	conditions = "timestamp(posting_date, posting_time) {0} timestamp(%(posting_date)s, %(posting_time)s)".format(operator)
+	conditions = "posting_datetime {0} %(posting_datetime)s".format(operator)
 	if not previous_sle.get("posting_date"):
 		previous_sle["posting_date"] = "1900-01-01"
 	if not previous_sle.get("posting_time"):
 		previous_sle["posting_time"] = "00:00"
 
+	previous_sle["posting_datetime"] = get_posting_datetime(previous_sle["posting_date"],
+		previous_sle["posting_time"])
+
 	if operator in (">", "<=") and previous_sle.get("name"):
 		conditions += " and name!=%(name)s"
 
-	return frappe.db.sql("""select *, timestamp(posting_date, posting_time) as "timestamp" from `tabStock Ledger Entry`
+	return frappe.db.sql("""select *, posting_datetime as "timestamp" from `tabStock Ledger Entry`
 		where item_code = %%(item_code)s
 		and warehouse = %%(warehouse)s
 		and ifnull(is_cancelled, 'No')='No'
 		and %(conditions)s
-		order by timestamp(posting_date, posting_time) %(order)s, name %(order)s
+		order by posting_datetime %(order)s, name %(order)s
 		%(limit)s %(for_update)s""" % {
 			"conditions": conditions,
 			"limit": limit or "",
@@ -429,21 +531,21 @@ def get_valuation_rate(item_code, warehouse, voucher_type, voucher_no,
 		from `tabStock Ledger Entry`
 		where item_code = %s and warehouse = %s
 		and valuation_rate > 0
-		order by posting_date desc, posting_time desc, name desc limit 1""", (item_code, warehouse))
+		order by posting_datetime desc, name desc limit 1""", (item_code, warehouse))
 
 	if not last_valuation_rate:
 		# Get valuation rate from last sle for the item against any warehouse
 		last_valuation_rate = frappe.db.sql("""select valuation_rate
 			from `tabStock Ledger Entry`
 			where item_code = %s and valuation_rate > 0
-			order by posting_date desc, posting_time desc, name desc limit 1""", item_code)
+			order by posting_datetime desc, name desc limit 1""", item_code)
 
 	valuation_rate = flt(last_valuation_rate[0][0]) if last_valuation_rate else 0
 
 	if not valuation_rate:
 		# If negative stock allowed, and item delivered without any incoming entry,
 		# syste does not found any SLE, then take valuation rate from Item
-		valuation_rate = frappe.db.get_value("Item", item_code, "valuation_rate")
+		valuation_rate = get_master_value("Item", item_code, "valuation_rate")
 
 	if not valuation_rate:
 		# try in price list
@@ -0,0 +1,91 @@
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import json
+import unittest
+
+from erpnext.stock.valuation import FIFOQueue
+
+class TestFIFOQueue(unittest.TestCase):
+	def test_add_stock(self):
+		queue = FIFOQueue()
+		queue.add_stock(1, 10)
+		queue.add_stock(1, 10)
+		queue.add_stock(2, 20)
+		self.assertEqual(queue.get_batches(), [[2, 10], [2, 20]])
+
+	def test_add_stock_to_negative_batch(self):
+		queue = FIFOQueue([[-2, 10]])
+		queue.add_stock(3, 20)
+		self.assertEqual(queue.get_batches(), [[1, 20]])
+
+	def test_dumps_is_compact(self):
+		queue = FIFOQueue.loads("[[1.0, 10.0], [2.0, 20.5]]")
+		self.assertEqual(queue.dumps(), "[[1,10],[2,20.5]]")
+
+	def test_dumps_merges_batches_with_same_rate(self):
+		queue = FIFOQueue([[1, 10], [2, 20], [3, 10]])
+		queue.remove(1)
+		self.assertEqual(json.loads(queue.dumps()), [[4, 10]])
+
+	def test_running_totals(self):
+		queue = FIFOQueue([[2, 10], [3, 20]])
+		self.assertEqual((queue.total_qty, queue.total_value), (5, 80))
+
+		queue.remove_stock(3)
+		self.assertEqual(queue.get_batches(), [[2, 20]])
+		self.assertEqual((queue.total_qty, queue.total_value), (2, 40))
+
+	def test_remove_stock_with_outgoing_rate(self):
+		queue = FIFOQueue([[2, 10], [3, 20]])
+		queue.remove_stock(1, outgoing_rate=20)
+		self.assertEqual(queue.get_batches(), [[2, 10], [2, 20]])
+
+		# no batch with the outgoing rate, queue is collapsed
+		queue.remove_stock(2, outgoing_rate=30)
+		self.assertEqual(queue.get_batches(), [[2, 0]])
+
+	def test_remove_stock_to_negative(self):
+		queue = FIFOQueue([[2, 10]])
+		queue.remove_stock(5)
+		self.assertEqual(queue.get_batches(), [[-3, 10]])
+		self.assertEqual(queue.total_qty, -3)
+
+	def test_remove_stock_from_empty_queue(self):
+		queue = FIFOQueue()
+		queue.remove_stock(1, rate_generator=lambda: 15)
+		self.assertEqual(queue.get_batches(), [[-1, 15]])
+
+	def test_consume(self):
+		queue = FIFOQueue([[2, 10], [3, 20]])
+		self.assertEqual(queue.consume(3), (3, 40))
+		self.assertEqual(queue.get_batches(), [[2, 20]])
+
+	def test_queue_with_null_rate(self):
+		# older queues have a null rate if no valuation rate was found
+		queue = FIFOQueue.loads("[[0, null]]")
+		self.assertEqual(queue.get_batches(), [[0, 0]])
+		self.assertEqual(queue.dumps(), "[[0,0]]")
+
+		queue.add_stock(2, 10)
+		self.assertEqual((queue.total_qty, queue.total_value), (2, 20))
+
+		queue = FIFOQueue()
+		queue.remove_stock(1, rate_generator=lambda: None)
+		self.assertEqual(queue.get_batches(), [[-1, 0]])
+
+	def test_find_batch_by_rate(self):
+		queue = FIFOQueue([[1, 10], [2, 20], [3, 10], [4, 30]])
+		self.assertIs(queue.find(10), queue[0])
+		self.assertIs(queue.find(30), queue[3])
+		self.assertIsNone(queue.find(40))
+
+		# consuming a whole batch from the middle keeps the index in order
+		queue.remove_stock(2, outgoing_rate=20)
+		self.assertEqual(queue.get_batches(), [[1, 10], [3, 10], [4, 30]])
+		self.assertIsNone(queue.find(20))
+
+		queue.popleft()
+		self.assertIs(queue.find(10), queue[0])
+		self.assertEqual((queue.total_qty, queue.total_value), (7, 150))
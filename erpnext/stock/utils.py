@@ -5,44 +5,71 @@ from __future__ import unicode_literals
 import frappe
 from frappe import _
 import json
-from frappe.utils import flt, cstr, nowdate, nowtime
+from frappe.utils import flt, cstr, nowdate, nowtime, getdate, get_datetime
+from erpnext.stock.valuation import FIFOQueue
+from erpnext.utilities.tree import get_descendants
 
 class InvalidWarehouseCompany(frappe.ValidationError): pass
 
+# master fields read for every stock ledger entry, all fields of a master
+# are loaded together on the first lookup, see `get_master_value`
+stock_master_fields = {
+	"Item": ("valuation_method", "is_stock_item", "valuation_rate"),
+	"Warehouse": ("company",),
+	"Company": ("default_currency",),
+	"Stock Settings": ("valuation_method", "allow_negative_stock")
+}
+
 def get_stock_value_on(warehouse=None, posting_date=None, item_code=None):
+	"""Returns stock value on the posting date, from the month end balances in
+	Stock Balance Snapshot and the stock ledger entries after them"""
+	from erpnext.stock.doctype.stock_balance_snapshot.stock_balance_snapshot import get_snapshot_date
+
 	if not posting_date: posting_date = nowdate()
 
-	values, condition = [posting_date], ""
+	values, condition = [], ""
 
 	if warehouse:
-		
-		lft, rgt, is_group = frappe.db.get_value("Warehouse", warehouse, ["lft", "rgt", "is_group"])
-		
-		if is_group:
-			values.extend([lft, rgt])
-			condition += "and exists (\
-				select name from `tabWarehouse` wh where wh.name = sle.warehouse\
-				and wh.lft >= %s and wh.rgt <= %s)"
-		
+		if frappe.db.get_value("Warehouse", warehouse, "is_group"):
+			warehouses = get_descendants("Warehouse", warehouse) or [warehouse]
+			values.extend(warehouses)
+			condition += " AND warehouse in ({0})".format(", ".join(["%s"] * len(warehouses)))
+
 		else:
 			values.append(warehouse)
 			condition += " AND warehouse = %s"
 
 	if item_code:
 		values.append(item_code)
-		condition.append(" AND item_code = %s")
+		condition += " AND item_code = %s"
 
+	snapshot_date = get_snapshot_date(posting_date)
+
+	sle_map = {}
+	for d in frappe.db.sql("""
+		SELECT sle.item_code, sle.warehouse, sle.stock_value
+		FROM `tabStock Balance Snapshot` sle,
+			(SELECT item_code, warehouse, max(period_end) as period_end
+			FROM `tabStock Balance Snapshot` sle
+			WHERE period_end <= %s {0}
+			GROUP BY item_code, warehouse) latest
+		WHERE sle.item_code = latest.item_code and sle.warehouse = latest.warehouse
+			and sle.period_end = latest.period_end
+	""".format(condition), [snapshot_date] + values, as_dict=1):
+		sle_map[(d.item_code, d.warehouse)] = flt(d.stock_value)
+
+	# latest entry after the snapshot date overrides the snapshot balance
 	stock_ledger_entries = frappe.db.sql("""
 		SELECT item_code, stock_value, name, warehouse
 		FROM `tabStock Ledger Entry` sle
-		WHERE posting_date <= %s {0}
-		ORDER BY timestamp(posting_date, posting_time) DESC, name DESC
-	""".format(condition), values, as_dict=1)
+		WHERE posting_date > %s AND posting_date <= %s
+			AND ifnull(is_cancelled, 'No') = 'No' {0}
+		ORDER BY posting_datetime ASC, name ASC
+	""".format(condition), [snapshot_date, posting_date] + values, as_dict=1)
 
-	sle_map = {}
 	for sle in stock_ledger_entries:
-		sle_map[sle.item_code] = sle_map.get(sle.item_code, 0.0) + flt(sle.stock_value)
-		
+		sle_map[(sle.item_code, sle.warehouse)] = flt(sle.stock_value)
+
 	return sum(sle_map.values())
 
 @frappe.whitelist()
@@ -91,7 +118,7 @@ def get_bin(item_code, warehouse):
 	return bin_obj
 
 def update_bin(args, allow_negative_stock=False, via_landed_cost_voucher=False):
-	is_stock_item = frappe.db.get_value('Item', args.get("item_code"), 'is_stock_item')
+	is_stock_item = get_master_value('Item', args.get("item_code"), 'is_stock_item')
 	if is_stock_item:
 		bin = get_bin(args.get("item_code"), args.get("warehouse"))
 		bin.update_stock(args, allow_negative_stock, via_landed_cost_voucher)
@@ -103,7 +130,7 @@ def update_bin(args, allow_negative_stock=False, via_landed_cost_voucher=False):
 def get_incoming_rate(args):
 	"""Get Incoming Rate based on valuation method"""
 	from erpnext.stock.stock_ledger import get_previous_sle
-	
+
 	if isinstance(args, basestring):
 		args = json.loads(args)
 
@@ -116,7 +143,7 @@ def get_incoming_rate(args):
 		if valuation_method == 'FIFO':
 			if not previous_sle:
 				return 0.0
-			previous_stock_queue = json.loads(previous_sle.get('stock_queue', '[]') or '[]')
+			previous_stock_queue = FIFOQueue.loads(previous_sle.get('stock_queue'))
 			in_rate = get_fifo_rate(previous_stock_queue, args.get("qty") or 0) if previous_stock_queue else 0
 		elif valuation_method == 'Moving Average':
 			in_rate = previous_sle.get('valuation_rate') or 0
@@ -133,37 +160,68 @@ def get_avg_purchase_rate(serial_nos):
 
 def get_valuation_method(item_code):
 	"""get valuation method from item or default"""
-	val_method = frappe.db.get_value('Item', item_code, 'valuation_method')
+	val_method = get_master_value('Item', item_code, 'valuation_method')
 	if not val_method:
-		val_method = frappe.db.get_value("Stock Settings", None, "valuation_method") or "FIFO"
+		val_method = get_master_value("Stock Settings", None, "valuation_method") or "FIFO"
 	return val_method
 
+def get_master_value(doctype, name, fieldname):
+	"""Returns field value of Item, Warehouse, Company or Stock Settings, cached
+	for the request. The cache is cleared when one of these masters is updated"""
+	cache = get_master_cache()
+	key = (doctype, name or doctype)
+
+	values = cache["values"].get(key)
+	if values is not None and fieldname in values:
+		cache["hits"] += 1
+	else:
+		cache["misses"] += 1
+		fields = list(stock_master_fields.get(doctype, ()))
+		if fieldname not in fields:
+			fields.append(fieldname)
+
+		values = frappe.db.get_value(doctype, name, fields, as_dict=True) \
+			or frappe._dict((f, None) for f in fields)
+		cache["values"].setdefault(key, frappe._dict()).update(values)
+
+	return cache["values"][key].get(fieldname)
+
+def get_master_cache():
+	if not getattr(frappe.local, "stock_master_cache", None):
+		frappe.local.stock_master_cache = {"values": {}, "hits": 0, "misses": 0}
+	return frappe.local.stock_master_cache
+
+def get_master_cache_stats():
+	"""Returns hits and misses of master lookups in this request"""
+	cache = get_master_cache()
+	return frappe._dict(hits=cache["hits"], misses=cache["misses"])
+
+def clear_master_cache(doc=None, method=None):
+	"""Clear cached master values of the updated document, or all values.
+	Called on update, rename and delete of the cached masters"""
+	cache = get_master_cache()
+	if doc:
+		for key in cache["values"].keys():
+			if key[0] == doc.doctype:
+				del cache["values"][key]
+	else:
+		cache["values"] = {}
+
 def get_fifo_rate(previous_stock_queue, qty):
 	"""get FIFO (average) Rate from Queue"""
+	if not isinstance(previous_stock_queue, FIFOQueue):
+		previous_stock_queue = FIFOQueue(previous_stock_queue)
+
 	if qty >= 0:
-		total = sum(f[0] for f in previous_stock_queue)
-		return sum(flt(f[0]) * flt(f[1]) for f in previous_stock_queue) / flt(total) if total else 0.0
+		return previous_stock_queue.get_average_rate()
 	else:
-		available_qty_for_outgoing, outgoing_cost = 0, 0
-		qty_to_pop = abs(qty)
-		while qty_to_pop and previous_stock_queue:
-			batch = previous_stock_queue[0]
-			if 0 < batch[0] <= qty_to_pop:
-				# if batch qty > 0
-				# not enough or exactly same qty in current batch, clear batch
-				available_qty_for_outgoing += flt(batch[0])
-				outgoing_cost += flt(batch[0]) * flt(batch[1])
-				qty_to_pop -= batch[0]
-				previous_stock_queue.pop(0)
-			else:
-				# all from current batch
-				available_qty_for_outgoing += flt(qty_to_pop)
-				outgoing_cost += flt(qty_to_pop) * flt(batch[1])
-				batch[0] -= qty_to_pop
-				qty_to_pop = 0
-
+		available_qty_for_outgoing, outgoing_cost = previous_stock_queue.consume(abs(qty))
 		return outgoing_cost / available_qty_for_outgoing
 
+def get_posting_datetime(posting_date, posting_time=None):
+	"""Returns posting datetime as stored in `Stock Ledger Entry.posting_datetime`"""
+	return get_datetime("{0} {1}".format(getdate(posting_date), posting_time or "00:00"))
+
 def get_valid_serial_nos(sr_nos, qty=0, item_code=''):
 	"""split serial nos, validate and return list of valid serial nos"""
 	# TODO: remove duplicates in client side
@@ -0,0 +1,238 @@
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import json
+from collections import deque
+from frappe.utils import flt
+
+# totals of queues up to this length are recalculated after every movement,
+# so they are exact and not subject to floating point drift
+EXACT_TOTALS_QUEUE_LENGTH = 10
+
+class FIFOQueue(object):
+	"""
+		FIFO stock queue of [qty, rate] batches, oldest batch first.
+
+		Batches are kept in a deque, so consuming from the front is O(1).
+		Total qty and value of the queue are maintained as batches are added
+		or consumed, and batches are indexed by rate, so a movement only costs
+		work proportional to the batches it touches, not to the queue length.
+		Only removing a whole batch from the middle of the queue shifts the
+		batches after it.
+
+		Empty qty or rate (older queues may have `null` rates) are stored as 0.
+
+		The queue is stored in `Stock Ledger Entry.stock_queue` as compact JSON,
+		consecutive batches with the same rate are stored as one batch.
+	"""
+	def __init__(self, batches=None):
+		self.batches = deque()
+		self.total_qty = 0.0
+		self.total_value = 0.0
+
+		# rate -> batches with that rate, oldest first
+		self.rate_index = {}
+
+		for qty, rate in (batches or []):
+			self.append(qty, rate)
+
+	@classmethod
+	def loads(cls, stock_queue):
+		"""Make queue from the value stored in Stock Ledger Entry"""
+		if isinstance(stock_queue, basestring):
+			stock_queue = json.loads(stock_queue or "[]")
+		return cls(stock_queue)
+
+	def dumps(self):
+		"""Serialize the queue for Stock Ledger Entry, merging batches with the same rate"""
+		merged = []
+		for qty, rate in self.batches:
+			if merged and merged[-1][1] == rate and (merged[-1][0] > 0) == (qty > 0):
+				merged[-1][0] += qty
+			else:
+				merged.append([qty, rate])
+
+		return json.dumps([[compact(qty), compact(rate)] for qty, rate in merged], separators=(",", ":"))
+
+	def get_batches(self):
+		return [list(batch) for batch in self.batches]
+
+	def __len__(self):
+		return len(self.batches)
+
+	def __iter__(self):
+		return iter(self.batches)
+
+	def __getitem__(self, index):
+		return self.batches[index]
+
+	def append(self, qty, rate):
+		batch = [flt(qty), flt(rate)]
+		self.batches.append(batch)
+		self.total_qty += batch[0]
+		self.total_value += batch[0] * batch[1]
+		self.rate_index.setdefault(batch[1], deque()).append(batch)
+
+	def popleft(self):
+		return self.remove(0)
+
+	def remove(self, index):
+		"""Remove batch at index, O(1) for the first batch"""
+		return self.remove_batch(self.batches[index])
+
+	def remove_batch(self, batch):
+		"""Remove a batch of the queue, O(1) for the first and the last batch"""
+		if batch is self.batches[0]:
+			self.batches.popleft()
+		elif batch is self.batches[-1]:
+			self.batches.pop()
+		else:
+			del self.batches[self.get_index(batch)]
+
+		same_rate = self.rate_index[batch[1]]
+		if batch is same_rate[0]:
+			same_rate.popleft()
+		elif batch is same_rate[-1]:
+			same_rate.pop()
+		else:
+			del same_rate[get_index(same_rate, batch)]
+
+		if not same_rate:
+			del self.rate_index[batch[1]]
+
+		if self.batches:
+			self.total_qty -= batch[0]
+			self.total_value -= batch[0] * batch[1]
+		else:
+			self.total_qty = self.total_value = 0.0
+
+		return batch
+
+	def set_qty(self, batch, qty):
+		"""Change qty of a batch in the queue"""
+		qty = flt(qty)
+		self.total_qty += qty - batch[0]
+		self.total_value += (qty - batch[0]) * batch[1]
+		batch[0] = qty
+
+	def find(self, rate):
+		"""Returns the first batch with the given rate"""
+		same_rate = self.rate_index.get(flt(rate))
+		return same_rate[0] if same_rate else None
+
+	def get_index(self, batch):
+		return get_index(self.batches, batch)
+
+	def reset(self, qty, rate):
+		"""Replace all batches with a single batch"""
+		self.batches = deque()
+		self.total_qty = self.total_value = 0.0
+		self.rate_index = {}
+		self.append(qty, rate)
+
+	def get_average_rate(self):
+		return self.total_value / self.total_qty if self.total_qty else 0.0
+
+	def add_stock(self, qty, rate):
+		"""Add incoming qty at rate"""
+		qty, rate = flt(qty), flt(rate)
+		if not self.batches:
+			self.append(0, 0)
+
+		last_batch = self.batches[-1]
+		if last_batch[1] == rate:
+			# last row has the same rate, just updated the qty
+			self.set_qty(last_batch, last_batch[0] + qty)
+		elif last_batch[0] > 0:
+			self.append(qty, rate)
+		else:
+			# negative stock, incoming qty settles the negative batch first
+			qty += last_batch[0]
+			self.remove(len(self.batches) - 1)
+			self.append(qty, rate)
+
+		self.refresh_totals()
+
+	def remove_stock(self, qty, outgoing_rate=0, rate_generator=None):
+		"""Remove outgoing qty from the queue.
+
+		If `outgoing_rate` is set, qty is taken from the batch with the same rate,
+		or the queue is collapsed to one batch if there is no such batch.
+		`rate_generator` gives the rate of stock taken from an empty queue."""
+		qty, outgoing_rate = flt(qty), flt(outgoing_rate)
+		while qty:
+			if not self.batches:
+				self.append(0, rate_generator() if rate_generator else 0)
+
+			if outgoing_rate > 0:
+				batch = self.find(outgoing_rate)
+
+				# If no entry found with outgoing rate, collapse stack
+				if batch is None:
+					self.refresh_totals(force=True)
+					new_stock_value = self.total_value - qty * outgoing_rate
+					new_stock_qty = self.total_qty - qty
+					self.reset(new_stock_qty, new_stock_value / new_stock_qty if new_stock_qty > 0 else outgoing_rate)
+					break
+			else:
+				# select first batch
+				batch = self.batches[0]
+
+			if qty >= batch[0]:
+				# consume current batch
+				qty = qty - batch[0]
+				self.remove_batch(batch)
+				if not self.batches and qty:
+					# stock finished, qty still remains to be withdrawn
+					# negative stock, keep in as a negative batch
+					self.append(-qty, outgoing_rate or batch[1])
+					break
+			else:
+				# qty found in current batch
+				# consume it and exit
+				self.set_qty(batch, batch[0] - qty)
+				qty = 0
+
+		self.refresh_totals()
+
+	def consume(self, qty):
+		"""Take qty from the oldest batches, returns consumed qty and value"""
+		qty = flt(qty)
+		consumed_qty = consumed_value = 0.0
+		while qty and self.batches:
+			batch = self.batches[0]
+			if 0 < batch[0] <= qty:
+				# not enough or exactly same qty in current batch, clear batch
+				consumed_qty += batch[0]
+				consumed_value += batch[0] * batch[1]
+				qty -= batch[0]
+				self.popleft()
+			else:
+				# all from current batch
+				consumed_qty += qty
+				consumed_value += qty * batch[1]
+				self.set_qty(batch, batch[0] - qty)
+				qty = 0
+
+		self.refresh_totals()
+		return consumed_qty, consumed_value
+
+	def refresh_totals(self, force=False):
+		"""Recalculate totals from the batches, for short queues or if `force` is set"""
+		if force or len(self.batches) <= EXACT_TOTALS_QUEUE_LENGTH:
+			self.total_qty = sum(batch[0] for batch in self.batches)
+			self.total_value = sum(batch[0] * batch[1] for batch in self.batches)
+
+def get_index(batches, batch):
+	"""Returns position of the batch, compared by identity as batches with the
+	same qty and rate are equal"""
+	for i, b in enumerate(batches):
+		if b is batch:
+			return i
+
+def compact(value):
+	"""Store whole numbers without the decimal part"""
+	if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+		return int(value)
+	return value
@@ -0,0 +1,84 @@
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import cint, flt, cstr, now
+
+# rows per insert query
+BULK_INSERT_BATCH_SIZE = 100
+
+def insert_submitted_docs(doctype, docs, prefix, digits):
+	"""Insert validated dicts as submitted documents of `doctype` with multi-row inserts.
+
+	Names are reserved from the naming series `prefix` + `digits` (e.g. "GL." and 7
+	for "GL.#######"). Sets name and the standard fields in each dict. Values are
+	cleaned up by fieldtype like `Document.insert` does, empty numbers are set to 0."""
+	meta = frappe.get_meta(doctype)
+	columns = [c for c in meta.get_valid_columns()
+		if c not in ("parent", "parentfield", "parenttype")]
+	fields = dict((c, meta.get_field(c)) for c in columns)
+	names = make_series_names(prefix, digits, len(docs))
+	timestamp = now()
+
+	for doc, name in zip(docs, names):
+		doc.update({
+			"name": name,
+			"owner": frappe.session.user,
+			"modified_by": frappe.session.user,
+			"creation": timestamp,
+			"modified": timestamp,
+			"docstatus": 1,
+			"idx": 0
+		})
+
+	for i in xrange(0, len(docs), BULK_INSERT_BATCH_SIZE):
+		batch = docs[i:i + BULK_INSERT_BATCH_SIZE]
+		values = []
+		for doc in batch:
+			values.extend([get_valid_value(fields[column], doc.get(column)) for column in columns])
+
+		frappe.db.sql("""insert into `tab{0}` ({1}) values {2}""".format(doctype,
+			", ".join("`{0}`".format(c) for c in columns),
+			", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(batch))),
+			tuple(values))
+
+def get_valid_value(df, value):
+	"""Returns value as `BaseDocument.get_valid_dict` sets it for the field"""
+	if not df:
+		return value
+
+	if df.fieldtype == "Check":
+		return 1 if cint(value) else 0
+	elif df.fieldtype == "Int":
+		return cint(value)
+	elif df.fieldtype in ("Currency", "Float", "Percent"):
+		return flt(value)
+	elif df.fieldtype in ("Datetime", "Date", "Time") and value == "":
+		return None
+	elif df.get("unique") and cstr(value).strip() == "":
+		return None
+
+	return value
+
+def get_master_details(doctype, names, fields):
+	"""Returns `fields` of the given masters by name, with one query for all names"""
+	names = list(set(names))
+	if not names:
+		return {}
+
+	return dict((d.name, d) for d in frappe.db.sql("""select name, {0} from `tab{1}`
+		where name in ({2})""".format(", ".join(fields), doctype, ", ".join(["%s"] * len(names))),
+		tuple(names), as_dict=1))
+
+def make_series_names(prefix, digits, count):
+	"""Reserve `count` names from a naming series with a single update of the series"""
+	current = frappe.db.sql("select `current` from `tabSeries` where name=%s for update", prefix)
+	if current and current[0][0] is not None:
+		current = cint(current[0][0])
+		frappe.db.sql("update `tabSeries` set current = current+%s where name=%s", (count, prefix))
+	else:
+		current = 0
+		frappe.db.sql("insert into `tabSeries` (name, current) values (%s, %s)", (prefix, count))
+
+	return ["{0}{1}".format(prefix, str(current + i).zfill(digits)) for i in xrange(1, count + 1)]
@@ -0,0 +1,92 @@
+# Copyright (c) 2017, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe
+from bisect import bisect_right
+
+# nested set masters whose structure is cached, cleared on update, rename and delete
+tree_doctypes = ("Account", "Cost Center", "Warehouse", "Item Group", "Customer Group",
+	"Territory", "Sales Person")
+
+def get_tree(doctype):
+	"""Returns the cached structure of a nested set tree:
+
+	- `nodes`: list of (name, lft, rgt) ordered by lft
+	- `lfts`: lft of the nodes, for finding the nodes under a node
+	- `positions`: name: position in `nodes`
+	- `ancestors`: name: list of ancestors from the root, including the node"""
+	tree = frappe.cache().hget("nested_set_tree", doctype)
+
+	if not tree:
+		tree = {"nodes": [], "lfts": [], "positions": {}, "ancestors": {}}
+
+		# nodes ordered by lft, `parents` is the path from the root to the current node
+		parents = []
+		for name, lft, rgt in frappe.db.sql("""select name, lft, rgt from `tab{0}`
+			order by lft""".format(doctype)):
+				while parents and parents[-1][1] < lft:
+					parents.pop()
+				parents.append((name, rgt))
+
+				tree["positions"][name] = len(tree["nodes"])
+				tree["nodes"].append((name, lft, rgt))
+				tree["lfts"].append(lft)
+				tree["ancestors"][name] = [d[0] for d in parents]
+
+		frappe.cache().hset("nested_set_tree", doctype, tree)
+
+	return tree
+
+def get_ancestors(doctype, name):
+	"""Returns ancestors of the node from the root, including the node. Empty if
+	there is no such node."""
+	return list(get_tree(doctype)["ancestors"].get(name, []))
+
+def get_descendants(doctype, name):
+	"""Returns the node and all nodes under it (`lft >= node.lft and rgt <= node.rgt`),
+	in order of lft. Empty if there is no such node."""
+	tree = get_tree(doctype)
+	if name not in tree["positions"]:
+		return []
+
+	start = tree["positions"][name]
+
+	# nodes under the node follow it in lft order, up to its rgt
+	end = bisect_right(tree["lfts"], tree["nodes"][start][2], start)
+	return [d[0] for d in tree["nodes"][start:end]]
+
+def get_descendants_condition(fieldname, doctype, name):
+	"""Returns query condition for `fieldname` being the node or under it, in place of
+	an `exists` subquery on lft and rgt. For queries without values, `%` is not escaped."""
+	descendants = get_descendants(doctype, name) or [""]
+	return "{0} in ({1})".format(fieldname,
+		", ".join('"{0}"'.format(frappe.db.escape(d, percent=False)) for d in descendants))
+
+def is_descendant(doctype, name, ancestor):
+	"""Returns True if the node is `ancestor` or under it"""
+	return ancestor in get_tree(doctype)["ancestors"].get(name, [])
+
+def get_lft_rgt(doctype, name):
+	"""Returns (lft, rgt) of the node, (None, None) if there is no such node"""
+	tree = get_tree(doctype)
+	if name not in tree["positions"]:
+		return None, None
+
+	node = tree["nodes"][tree["positions"][name]]
+	return node[1], node[2]
+
+def clear_tree_cache(doc=None, method=None):
+	"""Clear cached structure of the tree of the document, or of all trees"""
+	if doc:
+		frappe.cache().hdel("nested_set_tree", doc.doctype)
+	else:
+		frappe.cache().delete_value("nested_set_tree")
+
+def rebuild_tree(doctype, parent_field):
+	"""Rebuild lft and rgt of the tree (`frappe.utils.nestedset.rebuild_tree`) and
+	clear its cached structure. Use this instead of rebuilding with frappe directly."""
+	from frappe.utils.nestedset import rebuild_tree
+
+	rebuild_tree(doctype, parent_field)
+	frappe.cache().hdel("nested_set_tree", doctype)